@@ -0,0 +1,129 @@
+"""
+Reports the effect of the graph-level inference optimizations. For each model, we compare the
+standard graph, the frozen inference graph, the inference graph after the Grappler optimizations
+(constant folding and dead-node pruning) and, optionally, the optimized graph compiled with XLA.
+"""
+import os.path
+import time
+import numpy as np
+from argparse import ArgumentParser
+from collections import Counter
+from typing import Dict, List, Any
+
+from dataset.dataset import DataSeries
+from models.model_factory import get_model
+from models.tf_model import TFModel
+from utils.constants import HYPERS_PATH
+from utils.file_utils import extract_model_name, save_by_file_suffix
+from utils.hyperparameters import HyperParameters
+from utils.loading_utils import make_dataset
+
+
+STANDARD = 'standard'
+INFERENCE = 'inference'
+OPTIMIZED = 'optimized'
+OPTIMIZED_XLA = 'optimized_xla'
+
+# Operations which the optimizations should remove (e.g. noise, dropout and redundant reshaping)
+TRACKED_OP_TYPES = ['RandomStandardNormal', 'RandomUniform', 'GatherV2', 'Transpose', 'Mul', 'Add', 'AddV2']
+
+
+def restore_model(mode: str, model_name: str, hypers: HyperParameters, save_folder: str) -> TFModel:
+    model = get_model(hypers, save_folder=save_folder, is_train=False)
+    assert isinstance(model, TFModel), 'Can only optimize neural network models'
+
+    if mode == STANDARD:
+        model.restore(name=model_name, is_train=False, is_frozen=False)
+    elif mode == INFERENCE:
+        model.restore_for_inference(name=model_name, use_cached_graph=True)
+    elif mode == OPTIMIZED:
+        model.restore_for_inference(name=model_name, use_cached_graph=True, optimize=True)
+    elif mode == OPTIMIZED_XLA:
+        model.restore_for_inference(name=model_name, use_cached_graph=True, optimize=True, use_xla=True)
+    else:
+        raise ValueError('Unknown mode: {0}'.format(mode))
+
+    return model
+
+
+def run_report(model_path: str, dataset_folder: str, num_batches: int, batch_size: int, use_xla: bool) -> Dict[str, Dict[str, Any]]:
+    save_folder, model_file = os.path.split(model_path)
+
+    model_name = extract_model_name(model_file)
+    assert model_name is not None, 'Could not extract name from file: {0}'.format(model_file)
+
+    hypers = HyperParameters.create_from_file(os.path.join(save_folder, HYPERS_PATH.format(model_name)))
+    dataset = make_dataset(model_name, save_folder, hypers.dataset_type, dataset_folder)
+
+    modes = [STANDARD, INFERENCE, OPTIMIZED]
+    if use_xla:
+        modes.append(OPTIMIZED_XLA)
+
+    results: Dict[str, Dict[str, Any]] = dict()
+    for mode in modes:
+        model = restore_model(mode=mode, model_name=model_name, hypers=hypers, save_folder=save_folder)
+
+        op_counts = Counter(op.type for op in model.sess.graph.get_operations())
+
+        test_batches = dataset.minibatch_generator(series=DataSeries.TEST,
+                                                   batch_size=batch_size,
+                                                   metadata=model.metadata,
+                                                   should_shuffle=False)
+
+        # The first batch is excluded from the latency because it includes lazy initialization (e.g. XLA compilation)
+        batch_times: List[float] = []
+        for batch_num, batch in enumerate(test_batches):
+            if batch_num > num_batches:
+                break
+
+            feed_dict = model.batch_to_feed_dict(batch, is_train=False, epoch_num=0)
+
+            start = time.perf_counter()
+            model.execute(feed_dict=feed_dict, ops=[model.output_op_name])
+            elapsed = time.perf_counter() - start
+
+            if batch_num > 0:
+                batch_times.append(elapsed)
+
+        model.sess.close()
+
+        results[mode] = dict(num_graph_ops=sum(op_counts.values()),
+                             op_counts={op_type: op_counts.get(op_type, 0) for op_type in TRACKED_OP_TYPES},
+                             batch_latency_avg=float(np.average(batch_times)) if len(batch_times) > 0 else 0.0,
+                             batch_latency_std=float(np.std(batch_times)) if len(batch_times) > 0 else 0.0)
+
+    dataset.close()
+
+    # Compare each mode with the standard graph
+    baseline = results[STANDARD]
+    for mode, mode_results in results.items():
+        mode_results['op_reduction'] = 1.0 - mode_results['num_graph_ops'] / max(baseline['num_graph_ops'], 1)
+        mode_results['speedup'] = baseline['batch_latency_avg'] / max(mode_results['batch_latency_avg'], 1e-9)
+
+        print('{0}: Graph Ops {1} ({2:.2%} fewer), Batch Latency {3:.5f}s (+/- {4:.5f}), Speedup {5:.3f}x'.format(mode, mode_results['num_graph_ops'], mode_results['op_reduction'], mode_results['batch_latency_avg'], mode_results['batch_latency_std'], mode_results['speedup']))
+        print('\t{0}'.format(', '.join('{0}: {1}'.format(op_type, count) for op_type, count in mode_results['op_counts'].items())))
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser('Reports the op-count reduction and latency gain of the optimized inference graphs.')
+    parser.add_argument('--model-paths', type=str, nargs='+', required=True)
+    parser.add_argument('--dataset-folder', type=str)
+    parser.add_argument('--num-batches', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--use-xla', action='store_true')
+    parser.add_argument('--output-file', type=str)
+    args = parser.parse_args()
+
+    report: Dict[str, Dict[str, Dict[str, Any]]] = dict()
+    for model_path in args.model_paths:
+        print('===== {0} ====='.format(model_path))
+        report[model_path] = run_report(model_path=model_path,
+                                        dataset_folder=args.dataset_folder,
+                                        num_batches=args.num_batches,
+                                        batch_size=args.batch_size,
+                                        use_xla=args.use_xla)
+
+    if args.output_file is not None:
+        save_by_file_suffix(report, args.output_file)
@@ -0,0 +1,111 @@
+"""
+Benchmarks the cold-start time of restoring a trained model. We compare the standard restore
+(full training graph + per-variable assignment) with the pruned inference graph, both when
+the inference graph is built from scratch and when it is loaded from the on-disk cache.
+"""
+import os.path
+import time
+import numpy as np
+from argparse import ArgumentParser
+from typing import Dict, List, Any
+
+from dataset.dataset import DataSeries
+from models.model_factory import get_model
+from models.tf_model import TFModel
+from utils.constants import HYPERS_PATH, INFERENCE_GRAPH_PATH
+from utils.file_utils import extract_model_name, save_by_file_suffix
+from utils.hyperparameters import HyperParameters
+from utils.loading_utils import make_dataset
+
+
+STANDARD = 'standard'
+INFERENCE_BUILD = 'inference_build'
+INFERENCE_CACHED = 'inference_cached'
+
+
+def restore_model(mode: str, model_name: str, hypers: HyperParameters, save_folder: str) -> TFModel:
+    model = get_model(hypers, save_folder=save_folder, is_train=False)
+    assert isinstance(model, TFModel), 'Can only benchmark neural network models'
+
+    if mode == STANDARD:
+        model.restore(name=model_name, is_train=False, is_frozen=False)
+    elif mode == INFERENCE_BUILD:
+        # Remove the cached graph to force a rebuild
+        graph_path = os.path.join(save_folder, INFERENCE_GRAPH_PATH.format(model_name))
+        if os.path.exists(graph_path):
+            os.remove(graph_path)
+
+        model.restore_for_inference(name=model_name, use_cached_graph=True)
+    elif mode == INFERENCE_CACHED:
+        model.restore_for_inference(name=model_name, use_cached_graph=True)
+    else:
+        raise ValueError('Unknown mode: {0}'.format(mode))
+
+    return model
+
+
+def run_benchmark(model_path: str, dataset_folder: str, trials: int, batch_size: int) -> Dict[str, Dict[str, Any]]:
+    save_folder, model_file = os.path.split(model_path)
+
+    model_name = extract_model_name(model_file)
+    assert model_name is not None, 'Could not extract name from file: {0}'.format(model_file)
+
+    hypers = HyperParameters.create_from_file(os.path.join(save_folder, HYPERS_PATH.format(model_name)))
+    dataset = make_dataset(model_name, save_folder, hypers.dataset_type, dataset_folder)
+
+    results: Dict[str, Dict[str, Any]] = dict()
+
+    # The cached mode must run after the build mode so the cached graph exists
+    for mode in (STANDARD, INFERENCE_BUILD, INFERENCE_CACHED):
+        restore_times: List[float] = []
+        first_batch_times: List[float] = []
+
+        for _ in range(trials):
+            start = time.perf_counter()
+            model = restore_model(mode=mode, model_name=model_name, hypers=hypers, save_folder=save_folder)
+            restore_times.append(time.perf_counter() - start)
+
+            # Time to the first prediction. This captures any lazy graph initialization.
+            batch = next(dataset.minibatch_generator(series=DataSeries.TEST,
+                                                     batch_size=batch_size,
+                                                     metadata=model.metadata,
+                                                     should_shuffle=False))
+            feed_dict = model.batch_to_feed_dict(batch, is_train=False, epoch_num=0)
+
+            start = time.perf_counter()
+            model.execute(feed_dict=feed_dict, ops=[model.output_op_name])
+            first_batch_times.append(time.perf_counter() - start)
+
+            model.sess.close()
+
+        results[mode] = dict(restore_avg=float(np.average(restore_times)),
+                             restore_std=float(np.std(restore_times)),
+                             first_batch_avg=float(np.average(first_batch_times)),
+                             first_batch_std=float(np.std(first_batch_times)),
+                             num_graph_ops=len(model.sess.graph.get_operations()))
+
+        print('{0}: Restore {1:.4f}s (+/- {2:.4f}), First Batch {3:.4f}s, Graph Ops: {4}'.format(mode, results[mode]['restore_avg'], results[mode]['restore_std'], results[mode]['first_batch_avg'], results[mode]['num_graph_ops']))
+
+    dataset.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser('Benchmarks the cold-start restore time for trained models.')
+    parser.add_argument('--model-paths', type=str, nargs='+', required=True)
+    parser.add_argument('--dataset-folder', type=str)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--output-file', type=str)
+    args = parser.parse_args()
+
+    benchmark_results: Dict[str, Dict[str, Dict[str, Any]]] = dict()
+    for model_path in args.model_paths:
+        print('===== {0} ====='.format(model_path))
+        benchmark_results[model_path] = run_benchmark(model_path=model_path,
+                                                      dataset_folder=args.dataset_folder,
+                                                      trials=args.trials,
+                                                      batch_size=args.batch_size)
+
+    if args.output_file is not None:
+        save_by_file_suffix(benchmark_results, args.output_file)
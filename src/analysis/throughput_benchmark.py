@@ -0,0 +1,409 @@
+"""
+Benchmarks the training and inference throughput of each model family and RNN cell type on
+synthetic datasets. For every configuration, we report the samples per second, the split between
+data preparation and computation, and the peak resident memory. The results are written to a JSON
+file tagged with the current git commit, and the compare mode flags regressions between two runs.
+"""
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Dict, Any, List, Optional
+
+from dataset.dataset import DataSeries, Dataset
+from dataset.dataset_factory import get_dataset
+from models.model_factory import get_model
+from models.tf_model import TFModel
+from models.traditional_model import TraditionalModel
+from utils.constants import SAMPLE_ID, INPUTS, OUTPUT, TRAIN, VALID, TEST
+from utils.file_utils import make_dir, save_by_file_suffix, read_by_file_suffix
+from utils.hyperparameters import HyperParameters
+
+
+# Model parameters shared by all neural network configurations. Each model only reads the fields it uses.
+BASE_MODEL_PARAMS = {
+    'state_size': 20,
+    'output_type': 'multi_classification',
+    'embedding_activation': 'leaky_relu',
+    'transform_units': [24],
+    'transform_activation': 'leaky_relu',
+    'output_hidden_units': [24],
+    'output_hidden_activation': 'leaky_relu',
+    'mlp_hidden_units': [24],
+    'mlp_activation': 'leaky_relu',
+    'stop_output_units': [16],
+    'stop_output_hidden_units': [16],
+    'stop_output_activation': 'leaky_relu',
+    'rnn_activation': 'tanh',
+    'stop_loss_weight': 0.01,
+    'loss_weights': 'none',
+    'has_single_output': True,
+    'target_updates': 10,
+    'update_loss_weight': 0.1,
+    'on_fraction': 0.3,
+    'leak_rate': 0.001
+}
+
+CELL_TYPES = ['gru', 'ugrnn']
+
+# Metrics where larger values are better. All other metrics are lower-is-better.
+HIGHER_IS_BETTER = ('train_samples_per_sec', 'inference_samples_per_sec')
+COMPARE_METRICS = ('train_samples_per_sec', 'inference_samples_per_sec', 'train_step_latency', 'inference_step_latency', 'peak_rss_mb')
+
+
+def get_configurations(num_levels: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the hyperparameters of every benchmarked configuration, keyed by name.
+    """
+    configs: Dict[str, Dict[str, Any]] = dict()
+
+    def add_config(name: str, model: str, dataset_type: str, model_params: Dict[str, Any]):
+        configs[name] = dict(model=model, dataset_type=dataset_type, model_params=model_params)
+
+    for model_type, stride_length in (('nbow', 1), ('rnn', 1), ('sample_rnn', num_levels)):
+        cell_types = CELL_TYPES if model_type != 'nbow' else [None]
+
+        for cell_type in cell_types:
+            model_params = dict(BASE_MODEL_PARAMS, model_type=model_type, num_outputs=num_levels, stride_length=stride_length, rnn_cell_type=cell_type or CELL_TYPES[0])
+            name = 'adaptive-{0}'.format(model_type) if cell_type is None else 'adaptive-{0}-{1}'.format(model_type, cell_type)
+            add_config(name, model='adaptive', dataset_type='standard', model_params=model_params)
+
+    for model_type in ('rnn', 'skip_rnn', 'phased_rnn'):
+        for cell_type in CELL_TYPES:
+            model_params = dict(BASE_MODEL_PARAMS, model_type=model_type, rnn_cell_type=cell_type)
+            add_config('standard-{0}-{1}'.format(model_type, cell_type), model='standard', dataset_type='standard', model_params=model_params)
+
+    for tree_type in ('standard', 'random_forest'):
+        model_params = dict(output_type='multi_classification', tree_type=tree_type, criterion='gini', max_depth=8, num_estimators=20)
+        add_config('decision_tree-{0}'.format(tree_type), model='decision_tree', dataset_type='single', model_params=model_params)
+
+    return configs
+
+
+def make_synthetic_dataset(output_folder: str, num_samples: int, seq_length: int, num_features: int, num_classes: int, seed: int) -> str:
+    """
+    Writes a synthetic classification dataset in the JSONL format. Each class shifts the
+    mean of the inputs, so the task is learnable. Returns the base data folder.
+    """
+    rand = np.random.RandomState(seed=seed)
+    data_folder = os.path.join(output_folder, 'synthetic', 'data')
+
+    class_means = rand.normal(loc=0.0, scale=1.0, size=(num_classes, num_features))
+    num_eval = max(int(0.2 * num_samples), 1)
+
+    for series, series_size in ((TRAIN, num_samples), (VALID, num_eval), (TEST, num_eval)):
+        series_folder = os.path.join(data_folder, series)
+        os.makedirs(series_folder, exist_ok=True)
+
+        labels = rand.randint(low=0, high=num_classes, size=series_size)
+        inputs = rand.normal(loc=0.0, scale=1.0, size=(series_size, seq_length, num_features)) + np.expand_dims(class_means[labels], axis=1)
+
+        samples = [{SAMPLE_ID: sample_id, INPUTS: inputs[sample_id].tolist(), OUTPUT: int(labels[sample_id])} for sample_id in range(series_size)]
+        save_by_file_suffix(samples, os.path.join(series_folder, 'data000.jsonl.gz'))
+
+    return data_folder
+
+
+def get_peak_rss_mb() -> float:
+    # On Linux, the maximum resident set size is reported in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def benchmark_neural_network(model: TFModel, dataset: Dataset, batch_size: int, epochs: int, warmup_batches: int) -> Dict[str, float]:
+    model.load_metadata(dataset)
+    model.make(is_train=True, is_frozen=False)
+    model.init()
+
+    train_ops = [model.loss_op_name, model.optimizer_op_name]
+
+    data_time = 0.0
+    compute_time = 0.0
+    num_samples = 0
+    num_steps = 0
+    batch_count = 0
+
+    for epoch in range(epochs):
+        train_generator = dataset.minibatch_generator(DataSeries.TRAIN,
+                                                      batch_size=batch_size,
+                                                      metadata=model.metadata,
+                                                      should_shuffle=True)
+
+        while True:
+            start = time.perf_counter()
+            batch = next(train_generator, None)
+            if batch is None:
+                break
+
+            feed_dict = model.batch_to_feed_dict(batch, is_train=True, epoch_num=epoch)
+            data_end = time.perf_counter()
+
+            model.execute(feed_dict, train_ops)
+            compute_end = time.perf_counter()
+
+            # Skip the first batches to exclude graph warm-up from the measurements
+            batch_count += 1
+            if batch_count <= warmup_batches:
+                continue
+
+            data_time += data_end - start
+            compute_time += compute_end - data_end
+            num_samples += len(batch[OUTPUT])
+            num_steps += 1
+
+    # Measure inference throughput on the test set
+    inference_data_time = 0.0
+    inference_compute_time = 0.0
+    inference_samples = 0
+    inference_steps = 0
+
+    test_generator = dataset.minibatch_generator(DataSeries.TEST,
+                                                 batch_size=batch_size,
+                                                 metadata=model.metadata,
+                                                 should_shuffle=False)
+    while True:
+        start = time.perf_counter()
+        batch = next(test_generator, None)
+        if batch is None:
+            break
+
+        feed_dict = model.batch_to_feed_dict(batch, is_train=False, epoch_num=0)
+        data_end = time.perf_counter()
+
+        model.execute(feed_dict, [model.output_op_name])
+        compute_end = time.perf_counter()
+
+        inference_data_time += data_end - start
+        inference_compute_time += compute_end - data_end
+        inference_samples += len(batch[OUTPUT])
+        inference_steps += 1
+
+    num_parameters = model.count_parameters()
+    model.sess.close()
+
+    return make_result(data_time=data_time,
+                       compute_time=compute_time,
+                       num_samples=num_samples,
+                       num_steps=num_steps,
+                       inference_data_time=inference_data_time,
+                       inference_compute_time=inference_compute_time,
+                       inference_samples=inference_samples,
+                       inference_steps=inference_steps,
+                       num_parameters=num_parameters)
+
+
+def benchmark_traditional_model(model: TraditionalModel, dataset: Dataset, batch_size: int) -> Dict[str, float]:
+    model.load_metadata(dataset)
+    model.make(is_train=True, is_frozen=False)
+
+    start = time.perf_counter()
+    train_inputs, train_outputs = model.read_arrays(dataset, series=DataSeries.TRAIN)
+    data_end = time.perf_counter()
+
+    model.model.fit(train_inputs, train_outputs)
+    compute_end = time.perf_counter()
+
+    data_time, compute_time = data_end - start, compute_end - data_end
+
+    start = time.perf_counter()
+    test_inputs, _ = model.read_arrays(dataset, series=DataSeries.TEST)
+    data_end = time.perf_counter()
+
+    model.predict_arrays(test_inputs)
+    compute_end = time.perf_counter()
+
+    return make_result(data_time=data_time,
+                       compute_time=compute_time,
+                       num_samples=len(train_inputs),
+                       num_steps=1,
+                       inference_data_time=data_end - start,
+                       inference_compute_time=compute_end - data_end,
+                       inference_samples=len(test_inputs),
+                       inference_steps=1,
+                       num_parameters=0)
+
+
+def make_result(data_time: float, compute_time: float, num_samples: int, num_steps: int,
+                inference_data_time: float, inference_compute_time: float, inference_samples: int, inference_steps: int,
+                num_parameters: int) -> Dict[str, float]:
+    train_time = data_time + compute_time
+    inference_time = inference_data_time + inference_compute_time
+
+    return dict(train_samples_per_sec=num_samples / max(train_time, 1e-9),
+                train_step_latency=train_time / max(num_steps, 1),
+                train_data_fraction=data_time / max(train_time, 1e-9),
+                inference_samples_per_sec=inference_samples / max(inference_time, 1e-9),
+                inference_step_latency=inference_time / max(inference_steps, 1),
+                inference_data_fraction=inference_data_time / max(inference_time, 1e-9),
+                num_train_samples=num_samples,
+                num_inference_samples=inference_samples,
+                num_parameters=num_parameters)
+
+
+def run_configuration(name: str, config: Dict[str, Any], data_folder: str, save_folder: str, seq_length: int, batch_size: int, epochs: int, warmup_batches: int) -> Dict[str, float]:
+    """
+    Benchmarks a single configuration. This function runs in a fresh process, so the peak
+    memory only reflects the given configuration.
+    """
+    hypers = HyperParameters(dict(config, batch_size=batch_size, epochs=epochs, seq_length=seq_length))
+    dataset = get_dataset(dataset_type=hypers.dataset_type, data_folder=data_folder)
+
+    model = get_model(hypers, save_folder=save_folder, is_train=True)
+    if isinstance(model, TFModel):
+        result = benchmark_neural_network(model, dataset, batch_size=batch_size, epochs=epochs, warmup_batches=warmup_batches)
+    elif isinstance(model, TraditionalModel):
+        result = benchmark_traditional_model(model, dataset, batch_size=batch_size)
+    else:
+        raise ValueError('Unknown model class for configuration {0}'.format(name))
+
+    dataset.close()
+
+    result['peak_rss_mb'] = get_peak_rss_mb()
+    return result
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        folder = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=folder, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def run_benchmark(config_names: Optional[List[str]], num_samples: int, seq_length: int, num_features: int, num_classes: int,
+                  num_levels: int, batch_size: int, epochs: int, warmup_batches: int, seed: int) -> Dict[str, Any]:
+    configs = get_configurations(num_levels=num_levels)
+    if config_names is not None:
+        unknown = [name for name in config_names if name not in configs]
+        if len(unknown) > 0:
+            raise ValueError('Unknown configurations: {0}. Options are: {1}'.format(unknown, list(configs.keys())))
+
+        configs = {name: configs[name] for name in config_names}
+
+    work_folder = tempfile.mkdtemp(prefix='throughput-benchmark-')
+    try:
+        data_folder = make_synthetic_dataset(output_folder=work_folder,
+                                             num_samples=num_samples,
+                                             seq_length=seq_length,
+                                             num_features=num_features,
+                                             num_classes=num_classes,
+                                             seed=seed)
+
+        save_folder = os.path.join(work_folder, 'models')
+        make_dir(save_folder)
+
+        results: Dict[str, Dict[str, float]] = dict()
+        for name, config in configs.items():
+            # Run each configuration in a new process to isolate the memory measurements
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                future = pool.submit(run_configuration,
+                                     name=name,
+                                     config=config,
+                                     data_folder=data_folder,
+                                     save_folder=save_folder,
+                                     seq_length=seq_length,
+                                     batch_size=batch_size,
+                                     epochs=epochs,
+                                     warmup_batches=warmup_batches)
+                results[name] = future.result()
+
+            print('{0}: Train {1:.1f} samples/s ({2:.1%} data), Inference {3:.1f} samples/s, Peak RSS {4:.1f} MB'.format(name, results[name]['train_samples_per_sec'], results[name]['train_data_fraction'], results[name]['inference_samples_per_sec'], results[name]['peak_rss_mb']))
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    settings = dict(num_samples=num_samples,
+                    seq_length=seq_length,
+                    num_features=num_features,
+                    num_classes=num_classes,
+                    num_levels=num_levels,
+                    batch_size=batch_size,
+                    epochs=epochs,
+                    warmup_batches=warmup_batches,
+                    seed=seed)
+
+    return dict(commit=get_git_commit(),
+                timestamp=datetime.now().strftime('%Y-%m-%d-%H-%M-%S'),
+                settings=settings,
+                results=results)
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compares two benchmark results and returns a description of each regression beyond the given tolerance.
+    """
+    if baseline['settings'] != current['settings']:
+        print('WARNING: The benchmark settings differ between the two results.')
+
+    regressions: List[str] = []
+    for name, current_result in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            continue
+
+        baseline_result = baseline['results'][name]
+        for metric in COMPARE_METRICS:
+            base_value, value = baseline_result[metric], current_result[metric]
+            if base_value <= 0:
+                continue
+
+            change = (value - base_value) / base_value
+            is_regression = change < -tolerance if metric in HIGHER_IS_BETTER else change > tolerance
+
+            print('{0} {1}: {2:.4f} -> {3:.4f} ({4:+.1%}){5}'.format(name, metric, base_value, value, change, ' REGRESSION' if is_regression else ''))
+
+            if is_regression:
+                regressions.append('{0} {1} ({2:+.1%})'.format(name, metric, change))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser('Benchmarks the training and inference throughput of each model configuration.')
+    parser.add_argument('--configs', type=str, nargs='+', help='Configurations to benchmark. Defaults to all configurations.')
+    parser.add_argument('--num-samples', type=int, default=2000)
+    parser.add_argument('--seq-length', type=int, default=20)
+    parser.add_argument('--num-features', type=int, default=3)
+    parser.add_argument('--num-classes', type=int, default=4)
+    parser.add_argument('--num-levels', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--warmup-batches', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output-file', type=str, help='JSON file in which to save the results.')
+    parser.add_argument('--compare', type=str, nargs='+', help='Baseline result file, optionally followed by a second result file to compare against. With a single file, the benchmark runs first.')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative change at which a metric counts as a regression.')
+    args = parser.parse_args()
+
+    assert args.seq_length % args.num_levels == 0, 'The sequence length must be divisible by the number of levels'
+
+    if args.compare is not None and len(args.compare) == 2:
+        current_results = read_by_file_suffix(args.compare[1])
+    else:
+        current_results = run_benchmark(config_names=args.configs,
+                                        num_samples=args.num_samples,
+                                        seq_length=args.seq_length,
+                                        num_features=args.num_features,
+                                        num_classes=args.num_classes,
+                                        num_levels=args.num_levels,
+                                        batch_size=args.batch_size,
+                                        epochs=args.epochs,
+                                        warmup_batches=args.warmup_batches,
+                                        seed=args.seed)
+
+        if args.output_file is not None:
+            save_by_file_suffix(current_results, args.output_file)
+
+    if args.compare is not None:
+        regressions = compare_results(baseline=read_by_file_suffix(args.compare[0]),
+                                      current=current_results,
+                                      tolerance=args.tolerance)
+
+        if len(regressions) > 0:
+            print('Found {0} regressions: {1}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
@@ -1,20 +1,34 @@
 import os.path
 import numpy as np
 import math
-from collections import namedtuple
-from typing import Dict, Any, Tuple, List, Optional
+import tensorflow as tf
+from collections import namedtuple, defaultdict, OrderedDict
+from typing import Dict, Any, Tuple, List, Optional, Callable, DefaultDict
 
 from models.adaptive_model import AdaptiveModel
 from models.standard_model import StandardModel
 from dataset.dataset import Dataset, DataSeries
-from utils.file_utils import save_by_file_suffix, read_by_file_suffix
+from models.tf_model import TFModel
+from utils.file_utils import save_by_file_suffix, read_by_file_suffix, save_npz, hash_files
+from utils.tfutils import get_session_config
 from utils.sequence_model_utils import SequenceModelType
 from utils.constants import OUTPUT, LOGITS, SEQ_LENGTH, SKIP_GATES, PHASE_GATES, STOP_OUTPUT_NAME
+from utils.constants import MODEL_PATH, HYPERS_PATH, METADATA_PATH
 
 LOG_FILE_FMT = 'model-{0}-{1}-{2}.jsonl.gz'
 ModelResults = namedtuple('ModelResults', ['predictions', 'labels', 'stop_probs', 'accuracy'])
+
+# Describes how to execute one kind of model. The process_batch function reduces the operation
+# results of a single batch, and the summarize function creates the results from the concatenated reductions.
+ModelExecution = namedtuple('ModelExecution', ['ops', 'process_batch', 'summarize'])
 BATCH_SIZE = 64
 
+# Cached model results. The version is part of the cache key and should be incremented
+# whenever the execution functions change.
+MODEL_RESULTS_PATH = 'model-results-{0}-{1}-{2}.npz'
+MODEL_RESULTS_VERSION = 1
+CACHE_KEY = 'cache_key'
+
 
 def clip(x: int, bounds: Tuple[int, int]) -> int:
     if x > bounds[1]:
@@ -105,26 +119,89 @@ def concat_model_results(model_results: List[ModelResults]) -> ModelResults:
                         accuracy=accuracy)
 
 
-def execute_adaptive_model(model: AdaptiveModel, dataset: Dataset, series: DataSeries) -> ModelResults:
+def get_model_results_key(model: TFModel, dataset: Dataset, series: DataSeries, kind: str) -> str:
     """
-    Executes the neural network on the given data series. We do this in a separate step
-    to avoid recomputing for multiple budgets. Executing the neural network is relatively expensive.
+    Returns the key for the cached results of the given model on the given data series. The key
+    changes whenever the saved model files or the data files change.
+    """
+    save_folder = model.save_folder
+    model_name = model.restore_name
+    model_files = [os.path.join(save_folder, path.format(model_name)) for path in (MODEL_PATH, HYPERS_PATH, METADATA_PATH)]
 
-    Args:
-        model: The adaptive model used to perform inference
-        dataset: The dataset to perform inference on
-        series: The data series to extract. This is usually the TEST set.
-    Returns:
-        A model result tuple containing the inference results.
+    return '{0}-{1}-{2}-{3}-{4}'.format(MODEL_RESULTS_VERSION, kind, series.name, hash_files(model_files), dataset.fingerprint(series))
+
+
+def load_cached_model_results(path: str, key: str) -> Optional[ModelResults]:
     """
-    level_predictions: List[np.ndarray] = []
-    stop_probs: List[np.ndarray] = []
-    labels: List[np.ndarray] = []
+    Loads the cached model results from the given (uncompressed) npz file. Returns None
+    if the file does not exist or if the file holds results for a different key.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as cached:
+        if str(cached[CACHE_KEY]) != key:
+            return None
+
+        stop_probs = cached['stop_probs'] if 'stop_probs' in cached else None
+        return ModelResults(predictions=cached['predictions'],
+                            labels=cached['labels'],
+                            stop_probs=stop_probs,
+                            accuracy=cached['accuracy'])
 
-    num_outputs = model.num_outputs
 
-    # Operations to execute
-    ops = [LOGITS, STOP_OUTPUT_NAME]
+def save_model_results(model_results: ModelResults, path: str, key: str):
+    """
+    Saves the model results into an uncompressed npz file. We write to a temporary file
+    and then rename to avoid leaving partial results on failure.
+    """
+    data = {
+        CACHE_KEY: np.array(key),
+        'predictions': model_results.predictions,
+        'labels': model_results.labels,
+        'accuracy': model_results.accuracy
+    }
+
+    if model_results.stop_probs is not None:
+        data['stop_probs'] = model_results.stop_probs
+
+    temp_path = '{0}.{1}.tmp.npz'.format(path[:-len('.npz')], os.getpid())
+    save_npz(data, temp_path, compressed=False)
+    os.replace(temp_path, path)
+
+
+def get_model_results_path(model: TFModel, series: DataSeries, kind: str) -> str:
+    return os.path.join(model.save_folder, MODEL_RESULTS_PATH.format(kind, series.name.lower(), model.restore_name))
+
+
+def get_model_results(model: TFModel,
+                      dataset: Dataset,
+                      series: DataSeries,
+                      kind: str,
+                      execute_fn: Callable[[TFModel, Dataset, DataSeries], ModelResults],
+                      use_cache: bool) -> ModelResults:
+    """
+    Returns the results of executing the given model on the data series. Results are
+    cached next to the model file and are recomputed when either the model or the data changes.
+    """
+    # We can only cache results for models which are restored from disk
+    if not use_cache or model.restore_name is None:
+        return execute_fn(model, dataset, series)
+
+    cache_path = get_model_results_path(model, series, kind)
+    key = get_model_results_key(model, dataset, series, kind)
+
+    model_results = load_cached_model_results(cache_path, key)
+    if model_results is None:
+        model_results = execute_fn(model, dataset, series)
+        save_model_results(model_results, cache_path, key)
+
+    return model_results
+
+
+def _run_model(model: TFModel, dataset: Dataset, series: DataSeries, execution: ModelExecution) -> ModelResults:
+    outputs: DefaultDict[str, List[np.ndarray]] = defaultdict(list)
+    labels: List[np.ndarray] = []
 
     # Make the batch generator. Don't shuffle so we have consistent results.
     data_generator = dataset.minibatch_generator(series=series,
@@ -133,33 +210,58 @@ def execute_adaptive_model(model: AdaptiveModel, dataset: Dataset, series: DataS
                                                  should_shuffle=False)
 
     for batch_num, batch in enumerate(data_generator):
-        # Compute the predicted log probabilities
         feed_dict = model.batch_to_feed_dict(batch, is_train=False, epoch_num=0)
-        model_results = model.execute(feed_dict, ops=ops)
+        model_results = model.execute(feed_dict, ops=execution.ops)
 
-        # Concatenate logits into a [B, L, C] array (logit_ops is already ordered by level).
-        # For reference, L is the number of levels and C is the number of classes
-        logits = model_results[LOGITS]
+        for key, value in execution.process_batch(model, model_results).items():
+            outputs[key].append(value)
 
-        stop_output = model_results[STOP_OUTPUT_NAME]  # [B, L]
-        stop_probs.append(stop_output)
+        labels.append(np.array(batch[OUTPUT]).reshape(-1, 1))
 
-        # Compute the predictions for each level
-        level_pred = np.argmax(logits, axis=-1)  # [B, L]
-        level_predictions.append(level_pred)
+    concat_outputs = {key: np.concatenate(values, axis=0) for key, values in outputs.items()}
+    return execution.summarize(model, concat_outputs, np.concatenate(labels, axis=0))
 
-        labels.append(np.array(batch[OUTPUT]).reshape(-1, 1))
 
-    # Save results as attributes
-    level_predictions = np.concatenate(level_predictions, axis=0)
-    labels = np.concatenate(labels, axis=0)  # [N, 1]
-    stop_probs = np.concatenate(stop_probs, axis=0)
+def execute_adaptive_model(model: AdaptiveModel, dataset: Dataset, series: DataSeries, use_cache: bool = True) -> ModelResults:
+    """
+    Executes the neural network on the given data series. We do this in a separate step
+    to avoid recomputing for multiple budgets. Executing the neural network is relatively expensive.
+
+    Args:
+        model: The adaptive model used to perform inference
+        dataset: The dataset to perform inference on
+        series: The data series to extract. This is usually the TEST set.
+        use_cache: Whether to use (and update) the on-disk cache of model results.
+    Returns:
+        A model result tuple containing the inference results.
+    """
+    return get_model_results(model, dataset, series, kind='adaptive', execute_fn=_run_adaptive_model, use_cache=use_cache)
+
+
+def _process_adaptive_batch(model: AdaptiveModel, model_results: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # Logits is a [B, L, C] array (already ordered by level). For reference, L is the number
+    # of levels and C is the number of classes.
+    return {
+        'predictions': np.argmax(model_results[LOGITS], axis=-1),  # [B, L]
+        'stop_probs': model_results[STOP_OUTPUT_NAME]  # [B, L]
+    }
+
+
+def _summarize_adaptive(model: AdaptiveModel, outputs: Dict[str, np.ndarray], labels: np.ndarray) -> ModelResults:
+    level_predictions = outputs['predictions']
     level_accuracy = np.average(np.isclose(level_predictions, labels).astype(float), axis=0)
 
-    return ModelResults(predictions=level_predictions, labels=labels, stop_probs=stop_probs, accuracy=level_accuracy)
+    return ModelResults(predictions=level_predictions, labels=labels, stop_probs=outputs['stop_probs'], accuracy=level_accuracy)
+
+
+ADAPTIVE_EXECUTION = ModelExecution(ops=[LOGITS, STOP_OUTPUT_NAME], process_batch=_process_adaptive_batch, summarize=_summarize_adaptive)
+
+
+def _run_adaptive_model(model: AdaptiveModel, dataset: Dataset, series: DataSeries) -> ModelResults:
+    return _run_model(model, dataset, series, execution=ADAPTIVE_EXECUTION)
 
 
-def execute_standard_model(model: StandardModel, dataset: Dataset, series: DataSeries) -> ModelResults:
+def execute_standard_model(model: StandardModel, dataset: Dataset, series: DataSeries, use_cache: bool = True) -> ModelResults:
     """
     Executes the neural network on the given data series. We do this in a separate step
     to avoid recomputing for multiple budgets. Executing the neural network is relatively expensive.
@@ -168,39 +270,32 @@ def execute_standard_model(model: StandardModel, dataset: Dataset, series: DataS
         model: The standard model used to perform inference
         dataset: The dataset to perform inference on
         series: The data series to extract. This is usually the TEST set.
+        use_cache: Whether to use (and update) the on-disk cache of model results.
     Returns:
         A model result tuple containing the inference results.
     """
-    level_predictions: List[np.ndarray] = []
-    labels: List[np.ndarray] = []
+    return get_model_results(model, dataset, series, kind='standard', execute_fn=_run_standard_model, use_cache=use_cache)
 
-    # Make the batch generator. Don't shuffle so we have consistent results.
-    data_generator = dataset.minibatch_generator(series=series,
-                                                 batch_size=BATCH_SIZE,
-                                                 metadata=model.metadata,
-                                                 should_shuffle=False)
-
-    for batch_num, batch in enumerate(data_generator):
-        # Compute the predicted log probabilities
-        feed_dict = model.batch_to_feed_dict(batch, is_train=False, epoch_num=0)
-        model_results = model.execute(feed_dict, [LOGITS])
-
-        # Compute the predictions for each level
-        level_pred = np.argmax(model_results[LOGITS], axis=-1)  # [B, L]
-        level_predictions.append(level_pred)
 
-        labels.append(np.array(batch[OUTPUT]).reshape(-1, 1))
+def _process_standard_batch(model: StandardModel, model_results: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {'predictions': np.argmax(model_results[LOGITS], axis=-1)}  # [B, L]
 
-    # Save results as attributes
-    level_predictions = np.concatenate(level_predictions, axis=0)
-    labels = np.concatenate(labels, axis=0)  # [N, 1]
 
+def _summarize_standard(model: StandardModel, outputs: Dict[str, np.ndarray], labels: np.ndarray) -> ModelResults:
+    level_predictions = outputs['predictions']
     level_accuracy = np.average(np.isclose(level_predictions, labels).astype(float), axis=0)
 
     return ModelResults(predictions=level_predictions, labels=labels, stop_probs=None, accuracy=level_accuracy)
 
 
-def execute_skip_rnn_model(model: StandardModel, dataset: Dataset, series: DataSeries) -> ModelResults:
+STANDARD_EXECUTION = ModelExecution(ops=[LOGITS], process_batch=_process_standard_batch, summarize=_summarize_standard)
+
+
+def _run_standard_model(model: StandardModel, dataset: Dataset, series: DataSeries) -> ModelResults:
+    return _run_model(model, dataset, series, execution=STANDARD_EXECUTION)
+
+
+def execute_skip_rnn_model(model: StandardModel, dataset: Dataset, series: DataSeries, use_cache: bool = True) -> ModelResults:
     """
     Executes the neural network on the given data series. We do this in a separate step
     to avoid recomputing for multiple budgets. Executing the neural network is relatively expensive.
@@ -209,52 +304,55 @@ def execute_skip_rnn_model(model: StandardModel, dataset: Dataset, series: DataS
         model: The Skip RNN standard model used to perform inference
         dataset: The dataset to perform inference on
         series: The data series to extract. This is usually the TEST set.
+        use_cache: Whether to use (and update) the on-disk cache of model results.
     Returns:
         A model result tuple containing the inference results. The sample fractions are placed in the stop_probs element.
     """
-    assert model.model_type == SequenceModelType.SKIP_RNN, 'Must provide a Skip RNN'
-    seq_length = model.seq_length
+    return get_model_results(model, dataset, series, kind='skip_rnn', execute_fn=_run_skip_rnn_model, use_cache=use_cache)
 
-    predictions: List[np.ndarray] = []
-    labels: List[np.ndarray] = []
-    sample_counts = np.zeros(shape=(seq_length, ), dtype=np.int64)
 
-    # Make the batch generator. Don't shuffle so we have consistent results.
-    data_generator = dataset.minibatch_generator(series=series,
-                                                 batch_size=BATCH_SIZE,
-                                                 metadata=model.metadata,
-                                                 should_shuffle=False)
+def _process_skip_rnn_batch(model: StandardModel, model_results: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    pred = np.argmax(model_results[LOGITS], axis=-1)  # [B]
 
-    for batch_num, batch in enumerate(data_generator):
-        # Compute the predicted log probabilities
-        feed_dict = model.batch_to_feed_dict(batch, is_train=False, epoch_num=0)
-        model_results = model.execute(feed_dict, [LOGITS, SKIP_GATES])
+    # Collect the number of samples processed for each batch element. We subtract 1
+    # because it is impossible for the models to consume zero samples.
+    num_samples = np.sum(model_results[SKIP_GATES], axis=-1).astype(int) - 1  # [B]
 
-        # Compute the predictions for each level
-        pred = np.argmax(model_results[LOGITS], axis=-1)  # [B]
-        predictions.append(pred.reshape(-1, 1))
+    return {'predictions': pred.reshape(-1, 1), 'num_samples': num_samples}
 
-        # Collect the number of samples processed for each batch element. We subtract 1
-        # because it is impossible for the models to consume zero samples.
-        num_samples = np.sum(model_results[SKIP_GATES], axis=-1).astype(int) - 1  # [B]
-        counts = np.bincount(num_samples, minlength=seq_length)
-        sample_counts += counts  # [T]
 
-        labels.append(np.array(batch[OUTPUT]).reshape(-1, 1))
+def _process_phased_rnn_batch(model: StandardModel, model_results: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    pred = np.argmax(model_results[LOGITS], axis=-1)  # [B]
 
-    # Save results as attributes
-    predictions = np.concatenate(predictions, axis=0)
-    labels = np.concatenate(labels, axis=0)  # [N, 1]
+    # Collect the number of samples processed for each batch element. We subtract 1
+    # because it is impossible for the models to consume zero samples.
+    phase_gates = model_results[PHASE_GATES]  # [B, T]
+    num_samples = np.count_nonzero(phase_gates, axis=-1) - 1  # [B]
+
+    return {'predictions': pred.reshape(-1, 1), 'num_samples': num_samples}
+
+
+def _summarize_sampling_model(model: StandardModel, outputs: Dict[str, np.ndarray], labels: np.ndarray) -> ModelResults:
+    predictions = outputs['predictions']  # [N, 1]
     accuracy = np.average(np.isclose(predictions, labels).astype(float), axis=0)
 
     # Normalize the sample counts
-    sample_counts = sample_counts.astype(float)
+    sample_counts = np.bincount(outputs['num_samples'], minlength=model.seq_length).astype(float)  # [T]
     sample_fractions = sample_counts / np.sum(sample_counts)
 
     return ModelResults(predictions=predictions, labels=labels, stop_probs=sample_fractions, accuracy=accuracy)
 
 
-def execute_phased_rnn_model(model: StandardModel, dataset: Dataset, series: DataSeries) -> ModelResults:
+SKIP_RNN_EXECUTION = ModelExecution(ops=[LOGITS, SKIP_GATES], process_batch=_process_skip_rnn_batch, summarize=_summarize_sampling_model)
+PHASED_RNN_EXECUTION = ModelExecution(ops=[LOGITS, PHASE_GATES], process_batch=_process_phased_rnn_batch, summarize=_summarize_sampling_model)
+
+
+def _run_skip_rnn_model(model: StandardModel, dataset: Dataset, series: DataSeries) -> ModelResults:
+    assert model.model_type == SequenceModelType.SKIP_RNN, 'Must provide a Skip RNN'
+    return _run_model(model, dataset, series, execution=SKIP_RNN_EXECUTION)
+
+
+def execute_phased_rnn_model(model: StandardModel, dataset: Dataset, series: DataSeries, use_cache: bool = True) -> ModelResults:
     """
     Executes the neural network on the given data series. We do this in a separate step
     to avoid recomputing for multiple budgets. Executing the neural network is relatively expensive.
@@ -263,48 +361,150 @@ def execute_phased_rnn_model(model: StandardModel, dataset: Dataset, series: Dat
         model: The Phased RNN standard model used to perform inference
         dataset: The dataset to perform inference on
         series: The data series to extract. This is usually the TEST set.
+        use_cache: Whether to use (and update) the on-disk cache of model results.
     Returns:
         A model result tuple containing the inference results. The sample fractions are placed in the stop_probs element.
     """
+    return get_model_results(model, dataset, series, kind='phased_rnn', execute_fn=_run_phased_rnn_model, use_cache=use_cache)
+
+
+def _run_phased_rnn_model(model: StandardModel, dataset: Dataset, series: DataSeries) -> ModelResults:
     assert model.model_type == SequenceModelType.PHASED_RNN, 'Must provide a Phased RNN'
-    seq_length = model.seq_length
+    return _run_model(model, dataset, series, execution=PHASED_RNN_EXECUTION)
 
-    predictions: List[np.ndarray] = []
-    labels: List[np.ndarray] = []
-    sample_counts = np.zeros(shape=(seq_length, ), dtype=np.int64)
 
-    # Make the batch generator. Don't shuffle so we have consistent results.
-    data_generator = dataset.minibatch_generator(series=series,
-                                                 batch_size=BATCH_SIZE,
-                                                 metadata=model.metadata,
-                                                 should_shuffle=False)
+MODEL_EXECUTIONS = {
+    'adaptive': ADAPTIVE_EXECUTION,
+    'standard': STANDARD_EXECUTION,
+    'skip_rnn': SKIP_RNN_EXECUTION,
+    'phased_rnn': PHASED_RNN_EXECUTION
+}
 
-    for batch_num, batch in enumerate(data_generator):
-        # Compute the predicted log probabilities
-        feed_dict = model.batch_to_feed_dict(batch, is_train=False, epoch_num=0)
-        model_results = model.execute(feed_dict, [LOGITS, PHASE_GATES])
 
-        # Compute the predictions for each level
-        pred = np.argmax(model_results[LOGITS], axis=-1)  # [B]
-        predictions.append(pred.reshape(-1, 1))
+class MultiModelGraph:
+    """
+    Holds the inference graphs of several models in a single graph, so that one
+    session call executes every model on the same batch.
+    """
 
-        # Collect the number of samples processed for each batch element. We subtract 1
-        # because it is impossible for the models to consume zero samples.
-        phase_gates = model_results[PHASE_GATES]  # [B, T]
-        num_samples = np.count_nonzero(phase_gates, axis=-1) - 1  # [B]
-        counts = np.bincount(num_samples, minlength=seq_length)
+    def __init__(self, models: List[TFModel], ops: List[str]):
+        assert all(model.is_inference for model in models), 'Can only combine models restored for inference'
 
-        sample_counts += counts  # [T]
+        self._graph = tf.Graph()
+        self._fetches: List[Dict[str, tf.Tensor]] = []
+        self._prefixes: List[str] = []
 
-        labels.append(np.array(batch[OUTPUT]).reshape(-1, 1))
+        with self._graph.as_default():
+            for model_idx, model in enumerate(models):
+                prefix = 'model_{0}'.format(model_idx)
+                tf.import_graph_def(model.sess.graph.as_graph_def(), name=prefix)
 
-    # Save results as attributes
-    predictions = np.concatenate(predictions, axis=0)
-    labels = np.concatenate(labels, axis=0)  # [N, 1]
-    accuracy = np.average(np.isclose(predictions, labels).astype(float), axis=0)
+                fetches = {op_name: self._get_tensor(prefix, op) for op_name, op in model.ops.items() if op_name in ops}
 
-    # Normalize the sample counts
-    sample_counts = sample_counts.astype(float)
-    sample_fractions = sample_counts / np.sum(sample_counts)
+                self._fetches.append(fetches)
+                self._prefixes.append(prefix)
 
-    return ModelResults(predictions=predictions, labels=labels, stop_probs=sample_fractions, accuracy=accuracy)
+        self._sess = tf.Session(graph=self._graph, config=get_session_config(models[0].hypers.intra_op_threads, models[0].hypers.inter_op_threads))
+
+    def _get_tensor(self, prefix: str, tensor: tf.Tensor) -> tf.Tensor:
+        return self._graph.get_tensor_by_name('{0}/{1}'.format(prefix, tensor.name))
+
+    def execute(self, feed_dicts: List[Dict[tf.Tensor, np.ndarray]]) -> List[Dict[str, np.ndarray]]:
+        """
+        Executes all models in one session call.
+
+        Args:
+            feed_dicts: The feed dictionary of each model (in the model order)
+        Returns:
+            The operation results for each model (in the model order)
+        """
+        assert len(feed_dicts) == len(self._prefixes), 'Must provide one feed dictionary per model'
+
+        # As in TFModel.execute(), we only feed the placeholders. The other inputs are (folded) constants.
+        combined_feed_dict: Dict[tf.Tensor, np.ndarray] = dict()
+        for prefix, feed_dict in zip(self._prefixes, feed_dicts):
+            for tensor, value in feed_dict.items():
+                if tensor.op.type == 'Placeholder':
+                    combined_feed_dict[self._get_tensor(prefix, tensor)] = value
+
+        return self._sess.run(self._fetches, feed_dict=combined_feed_dict)
+
+    def close(self):
+        self._sess.close()
+
+
+def execute_models(models: List[TFModel], dataset: Dataset, series: DataSeries, kind: str, use_cache: bool = True) -> List[ModelResults]:
+    """
+    Executes several models on the given data series in one pass over the data. Models with
+    the same tensorization metadata share one tensorized copy of the data. When restored for
+    inference, these models are also executed together in a single session.
+
+    Args:
+        models: The models to execute. All models must use the given dataset.
+        dataset: The dataset to perform inference on
+        series: The data series to extract. This is usually the TEST set.
+        kind: The kind of model (adaptive, standard, skip_rnn or phased_rnn)
+        use_cache: Whether to use (and update) the on-disk cache of model results.
+    Returns:
+        The results for each model (in the model order). The results match those of the single-model
+        execution functions (e.g. execute_skip_rnn_model).
+    """
+    assert kind in MODEL_EXECUTIONS, 'Unknown model kind: {0}'.format(kind)
+    execution = MODEL_EXECUTIONS[kind]
+
+    results: List[Optional[ModelResults]] = [None for _ in models]
+    cache_keys: List[Optional[str]] = [None for _ in models]
+
+    # Group the remaining models by the key of the tensorized data
+    groups: Dict[str, List[int]] = OrderedDict()
+    for model_idx, model in enumerate(models):
+        if use_cache and model.restore_name is not None:
+            cache_keys[model_idx] = get_model_results_key(model, dataset, series, kind)
+            results[model_idx] = load_cached_model_results(get_model_results_path(model, series, kind), cache_keys[model_idx])
+
+        if results[model_idx] is None:
+            data_key = dataset.eval_cache_key(series, model.metadata)
+            groups.setdefault(data_key, []).append(model_idx)
+
+    for model_indices in groups.values():
+        group_models = [models[model_idx] for model_idx in model_indices]
+
+        multi_model_graph = None
+        if all(model.is_inference for model in group_models):
+            multi_model_graph = MultiModelGraph(group_models, ops=execution.ops)
+
+        outputs: List[DefaultDict[str, List[np.ndarray]]] = [defaultdict(list) for _ in group_models]
+        labels: List[np.ndarray] = []
+
+        # All models in the group share the same batches. Don't shuffle so we have consistent results.
+        data_generator = dataset.minibatch_generator(series=series,
+                                                     batch_size=BATCH_SIZE,
+                                                     metadata=group_models[0].metadata,
+                                                     should_shuffle=False)
+
+        for batch in data_generator:
+            feed_dicts = [model.batch_to_feed_dict(batch, is_train=False, epoch_num=0) for model in group_models]
+
+            if multi_model_graph is not None:
+                batch_results = multi_model_graph.execute(feed_dicts)
+            else:
+                batch_results = [model.execute(feed_dict, ops=execution.ops) for model, feed_dict in zip(group_models, feed_dicts)]
+
+            for model, model_outputs, model_results in zip(group_models, outputs, batch_results):
+                for key, value in execution.process_batch(model, model_results).items():
+                    model_outputs[key].append(value)
+
+            labels.append(np.array(batch[OUTPUT]).reshape(-1, 1))
+
+        if multi_model_graph is not None:
+            multi_model_graph.close()
+
+        concat_labels = np.concatenate(labels, axis=0)  # [N, 1]
+        for model_idx, model, model_outputs in zip(model_indices, group_models, outputs):
+            concat_outputs = {key: np.concatenate(values, axis=0) for key, values in model_outputs.items()}
+            results[model_idx] = execution.summarize(model, concat_outputs, concat_labels)
+
+            if cache_keys[model_idx] is not None:
+                save_model_results(results[model_idx], get_model_results_path(model, series, kind), cache_keys[model_idx])
+
+    return results
@@ -10,11 +10,14 @@ from dataset.dataset_factory import get_dataset
 from utils.constants import SEQ_LENGTH, NUM_CLASSES
 from utils.file_utils import read_by_file_suffix, save_by_file_suffix, extract_model_name
 from utils.loading_utils import restore_neural_network
+from utils.resource_utils import add_resource_args, configure_from_args
+from utils.profiling import add_profiling_args, configure_profiling_from_args
 from noise_generators import get_noise_generator, NoiseGenerator
 from model_controllers import AdaptiveController, CONTROLLER_PATH
 from controller_utils import execute_adaptive_model, ModelResults
 from runtime_system import SystemType, RuntimeSystem
 from controllers.power_utils import make_power_system, PowerType
+from controllers.simulation_pool import SimulationPool
 
 
 BudgetResult = namedtuple('BudgetResult', ['accuracy', 'budget'])
@@ -26,11 +29,8 @@ def evaluate(system: RuntimeSystem, budget: float, max_time: int, noise_generato
     """
     Evaluates the adaptive system on the given budget.
     """
-    system.init_for_budget(budget=budget, max_time=max_time)
-
-    for t in range(max_time):
-        power_noise = noise_generator.get_noise(t=t)
-        system.step(budget=budget, power_noise=power_noise, t=t)
+    noise = np.array([noise_generator.get_noise(t=t) for t in range(max_time)])
+    system.simulate(budget=budget, noise=noise, max_time=max_time)
 
     accuracy = system.get_num_correct()[-1] / max_time
     return accuracy
@@ -78,6 +78,24 @@ def search_for_budget(test_results: ModelResults,
     return budget
 
 
+def search_task(runtime_systems: List[RuntimeSystem],
+                system_idx: int,
+                lower_result: BudgetResult,
+                upper_result: BudgetResult,
+                target_accuracy: float,
+                noise_generator: NoiseGenerator) -> float:
+    """
+    Runs search_for_budget() on the given system. Used as a SimulationPool task.
+    """
+    adaptive_system = runtime_systems[system_idx]
+    return search_for_budget(adaptive_system.test_results,
+                             adaptive_system=adaptive_system,
+                             lower_result=lower_result,
+                             upper_result=upper_result,
+                             target_accuracy=target_accuracy,
+                             noise_generator=noise_generator)
+
+
 def get_nearest_budgets(adaptive_log: Dict[str, Dict[str, Any]],
                         lowest_accuracy: float,
                         highest_accuracy: float,
@@ -169,19 +187,22 @@ def get_nearest_budgets(adaptive_log: Dict[str, Dict[str, Any]],
 
 def energy_comparison(adaptive_results: Dict[str, Dict[str, Any]],
                       baseline_results: Dict[str, Dict[str, Any]],
-                      adaptive_system_dict: Dict[str, RuntimeSystem],
+                      system_names: List[str],
                       adaptive_result_dict: Dict[str, ModelResults],
                       seq_length: int,
                       num_levels: int,
                       sensor_type: str,
-                      noise_generator: NoiseGenerator) -> List[float]:
+                      noise_generator: NoiseGenerator,
+                      pool: SimulationPool) -> List[float]:
     """
-    Compare the energy results between the adaptive and baseline systems.
+    Compare the energy results between the adaptive and baseline systems. The budget searches
+    for the baseline results run in the given pool, whose systems are ordered by system_names.
     """
     lowest_accuracy = min((result.accuracy[0] for result in adaptive_result_dict.values()))
     highest_accuracy = max((result.accuracy[-1] for result in adaptive_result_dict.values()))
 
-    diff: List[float] = []
+    baseline_budgets: List[float] = []
+    search_tasks: List[Tuple[Any, ...]] = []
 
     for baseline_result in baseline_results.values():
         baseline_acc = baseline_result['ACCURACY']
@@ -195,13 +216,11 @@ def energy_comparison(adaptive_results: Dict[str, Dict[str, Any]],
                                                  seq_length=seq_length,
                                                  num_levels=num_levels)
 
-        adaptive_budget = search_for_budget(adaptive_result_dict[name],
-                                            adaptive_system=adaptive_system_dict[name],
-                                            noise_generator=noise_generator,
-                                            lower_result=lower,
-                                            upper_result=upper,
-                                            target_accuracy=baseline_acc)
+        baseline_budgets.append(budget)
+        search_tasks.append((system_names.index(name), lower, upper, baseline_acc, noise_generator))
 
+    diff: List[float] = []
+    for budget, adaptive_budget in zip(baseline_budgets, pool.map(search_task, search_tasks)):
         perc_diff = (budget - adaptive_budget) / adaptive_budget
         diff.append(perc_diff)
 
@@ -244,8 +263,15 @@ if __name__ == '__main__':
     parser.add_argument('--noise-loc', type=float, default=0.0)
     parser.add_argument('--sensor-type', type=str, choices=['bluetooth', 'temp'], required=True)
     parser.add_argument('--should-print', action='store_true')
+    parser.add_argument('--sim-workers', type=int, default=1, help='Number of processes used for the budget searches.')
+    add_resource_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
 
+    # Pin the threads and cores when several processes share this host
+    configure_from_args(args)
+    configure_profiling_from_args(args)
+
     # Load the target data-set
     dataset = get_dataset(dataset_type='standard', data_folder=args.dataset_folder)
 
@@ -295,23 +321,32 @@ if __name__ == '__main__':
     adaptive_log = list(read_by_file_suffix(args.adaptive_log))[0]
     adaptive_results = adaptive_log[noise_type]
 
-    for baseline_log_file in args.baseline_logs:
-        # Load the baseline testing log
-        baseline_log = list(read_by_file_suffix(baseline_log_file))[0]
-        baseline_results = baseline_log[noise_type]
-
-        if args.should_print:
-            print(baseline_log_file)
-
-        # Perform the comparison
-        energy_diff = energy_comparison(adaptive_results=adaptive_results,
-                                        baseline_results=baseline_results,
-                                        adaptive_system_dict=adaptive_system_dict,
-                                        adaptive_result_dict=adaptive_result_dict,
-                                        seq_length=seq_length,
-                                        num_levels=num_levels,
-                                        sensor_type=args.sensor_type,
-                                        noise_generator=noise_generator)
-
-        # Save the results
-        save(comparison=energy_diff, baseline_log_path=baseline_log_file)
+    system_names = list(adaptive_system_dict.keys())
+
+    with SimulationPool(runtime_systems=[adaptive_system_dict[name] for name in system_names],
+                        num_workers=args.sim_workers,
+                        intra_op_threads=args.intra_op_threads,
+                        inter_op_threads=args.inter_op_threads,
+                        placement=args.placement) as pool:
+
+        for baseline_log_file in args.baseline_logs:
+            # Load the baseline testing log
+            baseline_log = list(read_by_file_suffix(baseline_log_file))[0]
+            baseline_results = baseline_log[noise_type]
+
+            if args.should_print:
+                print(baseline_log_file)
+
+            # Perform the comparison
+            energy_diff = energy_comparison(adaptive_results=adaptive_results,
+                                            baseline_results=baseline_results,
+                                            system_names=system_names,
+                                            adaptive_result_dict=adaptive_result_dict,
+                                            seq_length=seq_length,
+                                            num_levels=num_levels,
+                                            sensor_type=args.sensor_type,
+                                            noise_generator=noise_generator,
+                                            pool=pool)
+
+            # Save the results
+            save(comparison=energy_diff, baseline_log_path=baseline_log_file)
@@ -1,40 +1,84 @@
 import numpy as np
 import os.path
+import multiprocessing
+import tempfile
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime
 from scipy.stats import norm
-from typing import List, Optional, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Iterator, Any
 
 from dataset.dataset import Dataset, DataSeries
 from models.adaptive_model import AdaptiveModel
 from utils.np_utils import index_of, round_to_precision
 from utils.constants import OUTPUT, BIG_NUMBER, SMALL_NUMBER, INPUTS, SEQ_LENGTH, DROPOUT_KEEP_RATE, SEQ_LENGTH, NUM_CLASSES
 from utils.file_utils import save_pickle_gz, read_pickle_gz, extract_model_name
-from utils.loading_utils import restore_neural_network
+from utils.loading_utils import restore_neural_network, get_hyperparameters, get_metadata
+from utils.resource_utils import add_resource_args, configure_from_args, init_pool_worker
+from utils.profiling import timed, add_profiling_args, configure_profiling_from_args
 from controllers.power_distribution import PowerDistribution
 from controllers.power_utils import PowerSystem, make_power_system, PowerType
 from controllers.controller_utils import execute_adaptive_model, get_budget_index, ModelResults
 
+# Numexpr is optional and speeds up the level comparisons
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
 
 CONTROLLER_PATH = 'model-controller-{0}-{1}.pkl.gz'
+LEVELS_CHUNK_SIZE = 1 << 24  # Maximum number of elements in the intermediate arrays of levels_to_execute()
 STEAL_ITERATIONS = 10
 RANDOM_MOVE = 0.05
 
 
 ThresholdData = namedtuple('ThresholdData', ['stop_probs', 'model_correct'])
+IslandState = namedtuple('IslandState', ['thresholds', 'best_thresholds', 'best_valid_loss', 'rand'])
 
 
 # HELPER FUNCTIONS
 
-def levels_to_execute(probs: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+def _compare_levels(probs: np.ndarray, thresholds: np.ndarray, out: np.ndarray):
+    """
+    Writes the [S, B, L] comparison probs > thresholds into the given boolean buffer.
+    """
+    if ne is not None:
+        ne.evaluate('p > t', local_dict=dict(p=probs, t=thresholds), out=out, casting='unsafe')
+    else:
+        np.greater(probs, thresholds, out=out)
+
+
+def _levels_for_chunk(probs: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    Computes the halting levels for a [S, L] chunk of thresholds on [1, B, L] probabilities.
+    """
+    num_thresholds, num_levels = thresholds.shape
+    num_samples = probs.shape[1]
+
+    level_predictions = np.empty(shape=(num_thresholds, num_samples, num_levels), dtype=bool)  # [S, B, L]
+    _compare_levels(probs, np.expand_dims(thresholds, axis=1), out=level_predictions)
+
+    # Inference always halts at the top level. Setting this level as a sentinel means
+    # the first passing level is the halting level for every sample.
+    level_predictions[:, :, -1] = True
+
+    return np.argmax(level_predictions, axis=-1).astype(int)  # [S, B]
+
+
+def levels_to_execute(probs: np.ndarray, thresholds: np.ndarray, max_chunk_size: int = LEVELS_CHUNK_SIZE, num_threads: int = 1) -> np.ndarray:
     """
     Finds the number of levels to execute for each batch sample using the given stop probabilities
-    and stop thresholds.
+    and stop thresholds. The thresholds and samples are processed in chunks to bound the memory of
+    the intermediate [S, B, L] array.
 
     Args:
         probs: A [B, L] or [1, B, L] array of stop probabilities for each batch sample (B) and level (L)
         thresholds: A [S, L] array of thresholds for each level (L) and budget (S)
+        max_chunk_size: The maximum number of elements in each (boolean) [S, B, L] chunk
+        num_threads: The number of threads used to process the chunks
     Returns:
         A [S, B] array containing the level to halt inference at for each sample (B) under each budget (S).
     """
@@ -45,17 +89,30 @@ def levels_to_execute(probs: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
     # Validate shapes
     assert probs.shape[2] == thresholds.shape[1], 'Probs ({0}) and thresholds ({1}) must have the same number of levels'.format(probs.shape[2], thresholds.shape[1])
 
-    # Compute the predictions based on this threshold setting. The level predictions are a 0/1
-    # array which is 0 when we should NOT use this level and 1 when we should
-    expanded_thresholds = np.expand_dims(thresholds, axis=1)  # [S, 1, L]
-    level_predictions = (probs > expanded_thresholds).astype(int)  # [S, B, L]
+    num_thresholds, num_levels = thresholds.shape
+    num_samples = probs.shape[1]
+
+    # Each chunk covers a block of samples under a block of thresholds. The samples are split
+    # only when a single threshold over all samples exceeds the maximum chunk size.
+    samples_per_chunk = min(max(int(max_chunk_size / max(num_levels, 1)), 1), max(num_samples, 1))
+    thresholds_per_chunk = max(int(max_chunk_size / (samples_per_chunk * max(num_levels, 1))), 1)
 
-    # Based on these level predictions, we compute the number of levels for each batch sample
-    level_idx = np.arange(start=0, stop=thresholds.shape[-1])
-    mask = (1.0 - level_predictions) * BIG_NUMBER  # Big number when incorrect, 0 when correct
-    index_mask = mask + level_idx  # [S, B, L]
-    levels = np.min(index_mask, axis=-1)  # [S, B]
-    levels = np.minimum(levels, thresholds.shape[-1] - 1).astype(int)  # Clip the output, [S, B]
+    if thresholds_per_chunk >= num_thresholds and samples_per_chunk >= num_samples:
+        return _levels_for_chunk(probs, thresholds)
+
+    levels = np.empty(shape=(num_thresholds, num_samples), dtype=int)  # [S, B]
+    chunks = [(s, b) for s in range(0, num_thresholds, thresholds_per_chunk) for b in range(0, num_samples, samples_per_chunk)]
+
+    def fill_chunk(start: Tuple[int, int]):
+        s, b = start
+        levels[s:s + thresholds_per_chunk, b:b + samples_per_chunk] = _levels_for_chunk(probs[:, b:b + samples_per_chunk], thresholds[s:s + thresholds_per_chunk])
+
+    if num_threads > 1:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            list(executor.map(fill_chunk, chunks))
+    else:
+        for chunk in chunks:
+            fill_chunk(chunk)
 
     return levels
 
@@ -74,19 +131,10 @@ def classification_for_levels(model_correct: np.ndarray, levels: np.ndarray, bat
     # Validate shapes
     assert model_correct.shape[0] == levels.shape[1], 'Batch sizes must be aligned between model_correct ({0}) and levels ({1}) arrays'.format(model_correct.shape[0], levels.shape[1])
 
-    # Get useful dimensions
-    batch_size = model_correct.shape[0]
-    num_budgets = levels.shape[0]
-
-    if batch_idx is None:
-        batch_idx = np.arange(start=0, stop=batch_size)
-
-    correct_per_sample: List[np.ndarray] = []
-    for i in range(num_budgets):
-        level_pred = np.squeeze(model_correct[batch_idx, levels[i, :]])  # [B]
-        correct_per_sample.append(level_pred)
+    if batch_idx is not None:
+        model_correct = model_correct[batch_idx]
 
-    return np.vstack(correct_per_sample)  # [S, B]
+    return np.take_along_axis(model_correct, levels.T, axis=1).T  # [S, B]
 
 
 def get_level_counts(levels: np.ndarray, num_levels: int) -> np.ndarray:
@@ -100,71 +148,163 @@ def get_level_counts(levels: np.ndarray, num_levels: int) -> np.ndarray:
         A [S, L] array of counts for each budget. Element [i, j] of the output array
         denotes the number of samples which end at level j under budget i.
     """
-    # Bincount only works for 1-dimensional arrays, so we must perform the bincount for each
-    # budget individually.
+    # Offset the levels of each budget so a single bincount covers all budgets
     num_budgets = levels.shape[0]
-    return np.vstack([np.bincount(levels[b], minlength=num_levels) for b in range(num_budgets)])  # [S, L]
+    offsets = np.expand_dims(np.arange(num_budgets) * num_levels, axis=1)  # [S, 1]
 
+    counts = np.bincount((levels + offsets).reshape(-1), minlength=num_budgets * num_levels)  # [S * L]
+    return counts.reshape(num_budgets, num_levels)  # [S, L]
 
-def get_budget_interpolation_values(target: float, budgets: np.ndarray, avg_level_counts: np.ndarray, power_system: PowerSystem) -> Tuple[int, int, float]:
-    budget_idx = index_of(budgets, target)
-    if budget_idx >= 0:
-        return budget_idx, budget_idx, 1
 
-    min_power = power_system.get_min_power()
-    max_power = power_system.get_max_power()
+class BudgetInterpolator:
+    """
+    Index over the fitted budgets for interpolating between their thresholds. The expected power of each budget
+    is computed once, so each lookup is a binary search over the sorted budgets.
+    """
+
+    def __init__(self, budgets: np.ndarray, avg_level_counts: np.ndarray, power_system: PowerSystem):
+        assert np.all(np.diff(budgets) > 0), 'Budgets must be sorted in increasing order'
 
-    # Get the nearest two budgets nearest two known budgets
-    lower_idx, upper_idx = -1, -1
-    for idx in range(0, len(budgets) - 1):
-        if budgets[idx] <= target and budgets[idx + 1] >= target:
-            lower_idx = idx
-            upper_idx = idx + 1
+        self._budgets = np.asarray(budgets, dtype=float)  # [S]
+        self._num_budgets = self._budgets.shape[0]
 
-    # Compute the expected power for each threshold, [L]
-    power_estimates = power_system.get_power_estimates()
+        # Expected power for each budget, [S]
+        power_estimates = power_system.get_power_estimates()  # [L]
+        self._expected_power = np.sum(avg_level_counts * power_estimates, axis=-1)
 
-    expected_power: List[float] = []
-    for counts in avg_level_counts:
-        expected = np.sum(counts * power_estimates)
-        expected_power.append(expected)
+        self._min_power = power_system.get_min_power()
+        self._max_power = power_system.get_max_power()
 
-    # If the budget is out of the range of the learned budgets, the we supplement the learned
-    # thresholds with fixed policies at either end.
-    if lower_idx == -1 or upper_idx == -1:
-        if target < budgets[0]:
+    def budget_index(self, target: float) -> int:
+        """
+        Returns the index of the given budget, or -1 if the budget is not one of the fitted budgets.
+        """
+        idx = int(np.searchsorted(self._budgets, target))
 
+        for candidate in (idx - 1, idx):
+            if 0 <= candidate < self._num_budgets and abs(self._budgets[candidate] - target) < SMALL_NUMBER:
+                return candidate
+
+        return -1
+
+    def lookup(self, target: float) -> Tuple[int, int, float]:
+        """
+        Returns the indices of the budgets surrounding the target and the interpolation weight of the upper budget.
+        The index -1 denotes the fixed policy on the lowest level and the index S denotes the fixed policy on the
+        highest level.
+        """
+        budget_idx = self.budget_index(target)
+        if budget_idx >= 0:
+            return budget_idx, budget_idx, 1
+
+        # Index of the first budget above the target
+        idx = int(np.searchsorted(self._budgets, target))
+
+        # If the budget is out of the range of the learned budgets, the we supplement the learned
+        # thresholds with fixed policies at either end.
+        if idx == 0:
             # The budget is below the lowest learned budget. If it is below the lowest power amount,
             # then we use a fixed policy on the lowest level. Otherwise, we interpolate as usual.
-            if target < min_power:
+            if target < self._min_power:
                 return -1, -1, 1
 
-            lower_power = min_power
-            upper_power = expected_power[0]
-            upper_idx = 0
-            lower_idx = -1
-        else:
+            lower_power = self._min_power
+            upper_power = self._expected_power[0]
+        elif idx == self._num_budgets:
             # The budget is above the highest learned budget. We either fix the policy to the highest level
             # or interpolate given the position of the budget w.r.t. the highest power level.
-            if target > max_power:
-                return len(budgets), len(budgets), 1
+            if target > self._max_power:
+                return self._num_budgets, self._num_budgets, 1
 
-            lower_power = expected_power[-1]
-            upper_power = max_power
-            lower_idx = len(budgets) - 1
-            upper_idx = len(budgets)
-    else:
-        lower_power = expected_power[lower_idx]
-        upper_power = expected_power[upper_idx]
+            lower_power = self._expected_power[-1]
+            upper_power = self._max_power
+        else:
+            lower_power = self._expected_power[idx - 1]
+            upper_power = self._expected_power[idx]
+
+        lower_idx, upper_idx = idx - 1, idx
+
+        if abs(upper_power - lower_power) < SMALL_NUMBER:
+            return lower_idx, lower_idx, 1
+
+        # Interpolation weight, Clipped to the range [0, 1]
+        z = (target - lower_power) / (upper_power - lower_power)
+        z = min(max(z, 0), 1)
+
+        return lower_idx, upper_idx, z
+
+
+def get_budget_interpolation_values(target: float, budgets: np.ndarray, avg_level_counts: np.ndarray, power_system: PowerSystem) -> Tuple[int, int, float]:
+    interpolator = BudgetInterpolator(budgets=budgets, avg_level_counts=avg_level_counts, power_system=power_system)
+    return interpolator.lookup(target)
+
+
+# Threshold data shared by the budget fitting workers. Each worker memory-maps the arrays once.
+_worker_data: Dict[str, ThresholdData] = dict()
+
+
+def _init_fit_worker(data_paths: Dict[str, str],
+                     counter: Any,
+                     num_workers: int,
+                     intra_op_threads: Optional[int],
+                     inter_op_threads: int,
+                     policy_name: str):
+    init_pool_worker(counter=counter,
+                     num_workers=num_workers,
+                     intra_op_threads=intra_op_threads,
+                     inter_op_threads=inter_op_threads,
+                     policy_name=policy_name)
+
+    arrays = {key: np.load(path, mmap_mode='r') for key, path in data_paths.items()}
+
+    for prefix in ('train', 'valid'):
+        _worker_data[prefix] = ThresholdData(stop_probs=arrays['{0}_stop_probs'.format(prefix)],
+                                             model_correct=arrays['{0}_model_correct'.format(prefix)])
+
+
+def _fit_budget_worker(optimizer: 'BudgetOptimizer', budget: float, min_init: np.ndarray, should_print: bool) -> Tuple[np.ndarray, float, int]:
+    return optimizer.fit_budget(budget=budget,
+                                train_data=_worker_data['train'],
+                                valid_data=_worker_data['valid'],
+                                min_init=min_init,
+                                should_print=should_print)
 
-    if abs(upper_power - lower_power) < SMALL_NUMBER:
-        return lower_idx, lower_idx, lower_power
 
-    # Interpolation weight, Clipped to the range [0, 1]
-    z = (target - lower_power) / (upper_power - lower_power)
-    z = min(max(z, 0), 1)
+def _run_island_worker(optimizer: 'BudgetOptimizer', state: IslandState, budget: float, num_iterations: int) -> IslandState:
+    return optimizer.run_island(state=state,
+                                budget=budget,
+                                train_data=_worker_data['train'],
+                                valid_data=_worker_data['valid'],
+                                num_iterations=num_iterations)
 
-    return lower_idx, upper_idx, z
+
+@contextmanager
+def _fit_worker_pool(train_data: ThresholdData,
+                     valid_data: ThresholdData,
+                     num_workers: int,
+                     intra_op_threads: Optional[int] = None,
+                     inter_op_threads: int = 1,
+                     placement: str = 'compact') -> Iterator[ProcessPoolExecutor]:
+    """
+    Creates a process pool for threshold fitting. The workers memory-map the threshold data from
+    temporary files, so the arrays are neither pickled nor copied per task. Each worker limits its
+    thread counts and is pinned to its cores (see utils/resource_utils.py).
+    """
+    with tempfile.TemporaryDirectory(prefix='threshold-data-') as data_folder:
+        data_paths: Dict[str, str] = dict()
+        for prefix, data in (('train', train_data), ('valid', valid_data)):
+            for field, array in zip(data._fields, data):
+                path = os.path.join(data_folder, '{0}-{1}.npy'.format(prefix, field))
+                np.save(path, np.asarray(array))
+                data_paths['{0}_{1}'.format(prefix, field)] = path
+
+        mp_context = multiprocessing.get_context('spawn')
+
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 mp_context=mp_context,
+                                 initializer=_init_fit_worker,
+                                 initargs=(data_paths, mp_context.Value('i', 0), num_workers, intra_op_threads, inter_op_threads, placement)) as executor:
+            yield executor
 
 
 # BUDGET OPTIMIZER
@@ -177,7 +317,18 @@ class BudgetOptimizer:
                  precision: int,
                  trials: int,
                  max_iter: int,
-                 patience: int):
+                 patience: int,
+                 num_workers: int = 1,
+                 continuation: bool = False,
+                 refine_iter: int = 20,
+                 bidirectional: bool = False,
+                 num_islands: int = 1,
+                 intra_op_threads: Optional[int] = None,
+                 inter_op_threads: int = 1,
+                 placement: str = 'compact'):
+        assert num_islands >= 1, 'Must have at least one island'
+        assert num_islands <= trials, 'Must have at least one trial per island'
+
         self._num_budgets = budgets.shape[0]
         self._budgets = budgets
         self._precision = precision
@@ -185,6 +336,21 @@ class BudgetOptimizer:
         self._max_iter = max_iter
         self._patience = patience
         self._power_system = power_system
+        self._num_workers = num_workers
+
+        # Thread counts and CPU placement of the fitting workers
+        self._intra_op_threads = intra_op_threads
+        self._inter_op_threads = inter_op_threads
+        self._placement = placement
+
+        # Continuation fitting warm-starts each budget from the thresholds of its neighbor
+        self._continuation = continuation
+        self._refine_iter = refine_iter
+        self._bidirectional = bidirectional
+
+        # The island mode splits the trials of each budget into independent groups, which exchange their
+        # best thresholds every STEAL_ITERATIONS iterations
+        self._num_islands = num_islands
 
         self._thresholds = None
 
@@ -210,8 +376,7 @@ class BudgetOptimizer:
         levels = levels_to_execute(probs=stop_probs, thresholds=thresholds)  # [S, B]
 
         # Compute the approximate power
-        avg_power = np.vstack([self._power_system.get_avg_power_multiple(levels[idx] + 1) for idx in range(budgets.shape[0])])  # [S, 1]
-        avg_power = np.squeeze(avg_power, axis=-1)  # [S]
+        avg_power = self._power_system.avg_power_for_levels(levels)  # [S]
 
         # Compute the accuracy
         correct_per_level = classification_for_levels(model_correct=model_correct, levels=levels)
@@ -226,6 +391,7 @@ class BudgetOptimizer:
 
         return loss, avg_power
 
+    @timed('controller.fit')
     def fit(self, train_data: ThresholdData, valid_data: ThresholdData, should_print: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
         """
         Fits thresholds to the budgets corresponding to this class.
@@ -244,63 +410,381 @@ class BudgetOptimizer:
                 (3) A [S] array containing the final generalization accuracy for each budget
                 (4) The number of training iterations
         """
+        power_estimates = self._power_system.get_power_estimates()  # [L]
+        num_levels = power_estimates.shape[0]
+
+        min_init = np.median(train_data.stop_probs, axis=0)  # [L]
+
+        # Each budget uses its own random state, so the budgets are fit independently (except under continuation)
+        if self._continuation:
+            budget_results = self._fit_budgets_continuation(train_data=train_data,
+                                                            valid_data=valid_data,
+                                                            min_init=min_init,
+                                                            should_print=should_print)
+        elif self._num_islands > 1:
+            budget_results = self._fit_budgets_islands(train_data=train_data,
+                                                       valid_data=valid_data,
+                                                       min_init=min_init,
+                                                       should_print=should_print)
+        elif self._num_workers > 1 and self._num_budgets > 1:
+            budget_results = self._fit_budgets_parallel(train_data=train_data,
+                                                        valid_data=valid_data,
+                                                        min_init=min_init,
+                                                        should_print=should_print)
+        else:
+            budget_results = [self.fit_budget(budget=budget,
+                                              train_data=train_data,
+                                              valid_data=valid_data,
+                                              min_init=min_init,
+                                              should_print=should_print) for budget in self._budgets]
+
         # Arrays to keep track of the best thresholds per budget
-        best_thresholds: List[np.ndarray] = []  # Holds list of best thresholds for each budget
-        best_loss: List[float] = []
+        best_thresholds = [thresholds for thresholds, _, _ in budget_results]
+        best_loss = [loss for _, loss, _ in budget_results]
+        training_iterations = sum(iterations * self._trials for _, _, iterations in budget_results)
 
+        final_thresholds = np.vstack(best_thresholds)
+
+        # Get the level distribution
+        levels = levels_to_execute(probs=valid_data.stop_probs, thresholds=final_thresholds)
+        level_counts = get_level_counts(levels=levels, num_levels=num_levels)  # [S, L]
+        avg_level_counts = level_counts / (np.sum(level_counts, axis=-1, keepdims=True) + SMALL_NUMBER)
+
+        self._thresholds = final_thresholds
+        return final_thresholds, avg_level_counts, -np.array(best_loss).reshape(-1), training_iterations
+
+    def _init_thresholds(self, budget: float, min_init: np.ndarray, rand: np.random.RandomState) -> np.ndarray:
+        """
+        Returns a [S, L] array of random initial thresholds for each trial (S) and level (L).
+        """
         power_estimates = self._power_system.get_power_estimates()  # [L]
         num_levels = power_estimates.shape[0]
         level_idx = np.arange(num_levels)  # [L]
-
-        min_init = np.median(train_data.stop_probs, axis=0)  # [L]
         max_init = 1.0
 
-        training_iterations = 0
+        # Initialize the thresholds uniformly at random. We cap the thresholds at the smallest known level
+        # which consumes power more than the budget. This prevents quick, greedy methods to get under the budget
+        # in early iterations.
+        init_thresholds = rand.uniform(low=min_init, high=max_init, size=(self._trials, num_levels))
+        init_thresholds = round_to_precision(init_thresholds, self._precision)
+
+        power_diff = power_estimates - budget
+        diff_mask = (power_diff <= 0).astype(int) * BIG_NUMBER
+        max_level = np.argmin(power_diff + diff_mask)
+
+        mask = np.expand_dims((level_idx < max_level).astype(int), axis=0)  # [1, L]
+        return init_thresholds * mask
+
+    def fit_budget(self, budget: float, train_data: ThresholdData, valid_data: ThresholdData, min_init: np.ndarray, should_print: bool) -> Tuple[np.ndarray, float, int]:
+        """
+        Fits the thresholds for a single budget.
+
+        Args:
+            budget: The power budget
+            train_data: The data used for threshold fitting
+            valid_data: The data used to detect convergence
+            min_init: A [L] array of lower bounds for the initial thresholds
+            should_print: Whether we should print the results
+        Returns:
+            A tuple of three elements:
+                (1) A [L] array of thresholds
+                (2) The loss of these thresholds
+                (3) The number of completed iterations
+        """
+        if should_print:
+            print('===== Starting Budget {0:.3f} ====='.format(budget))
+
+        # Initialize the random state. We use the same seed for all budgets to get consistent results. Otherwise
+        # the results are dependent on how many budgets we use due to changes in randomness.
+        rand = np.random.RandomState(seed=42)
+        init_thresholds = self._init_thresholds(budget=budget, min_init=min_init, rand=rand)
+
+        # Fit thresholds for this budget
+        return self.fit_single(train_data=train_data,
+                               valid_data=valid_data,
+                               init_thresholds=init_thresholds,
+                               budget=budget,
+                               stealing_iterations=STEAL_ITERATIONS,
+                               rand=rand,
+                               should_print=should_print)
+
+    def _fit_budgets_parallel(self, train_data: ThresholdData, valid_data: ThresholdData, min_init: np.ndarray, should_print: bool) -> List[Tuple[np.ndarray, float, int]]:
+        """
+        Fits the budgets in a process pool with one task per budget.
+        """
+        num_workers = min(self._num_workers, self._num_budgets)
+
+        with _fit_worker_pool(train_data=train_data,
+                              valid_data=valid_data,
+                              num_workers=num_workers,
+                              intra_op_threads=self._intra_op_threads,
+                              inter_op_threads=self._inter_op_threads,
+                              placement=self._placement) as executor:
+            futures = [executor.submit(_fit_budget_worker, self, budget, min_init, should_print) for budget in self._budgets]
+            return [future.result() for future in futures]
+
+    def _fit_budgets_islands(self, train_data: ThresholdData, valid_data: ThresholdData, min_init: np.ndarray, should_print: bool) -> List[Tuple[np.ndarray, float, int]]:
+        """
+        Fits the budgets in sequence with the island mode. The islands of each budget run in a process pool
+        when there are multiple workers.
+        """
+        if self._num_workers <= 1:
+            return [self.fit_islands(budget=budget,
+                                     train_data=train_data,
+                                     valid_data=valid_data,
+                                     min_init=min_init,
+                                     should_print=should_print) for budget in self._budgets]
+
+        num_workers = min(self._num_workers, self._num_islands)
+
+        with _fit_worker_pool(train_data=train_data,
+                              valid_data=valid_data,
+                              num_workers=num_workers,
+                              intra_op_threads=self._intra_op_threads,
+                              inter_op_threads=self._inter_op_threads,
+                              placement=self._placement) as executor:
+            return [self.fit_islands(budget=budget,
+                                     train_data=train_data,
+                                     valid_data=valid_data,
+                                     min_init=min_init,
+                                     should_print=should_print,
+                                     executor=executor) for budget in self._budgets]
+
+    def fit_islands(self,
+                    budget: float,
+                    train_data: ThresholdData,
+                    valid_data: ThresholdData,
+                    min_init: np.ndarray,
+                    should_print: bool,
+                    executor: Optional[ProcessPoolExecutor] = None) -> Tuple[np.ndarray, float, int]:
+        """
+        Fits the thresholds for a single budget by splitting the trials into islands. Each island runs
+        independent restarts with its own random state. After every block of STEAL_ITERATIONS iterations,
+        the globally best thresholds migrate (with a random move) into the worst trial of every other island.
+        The islands stop together when the global validation loss does not improve for `patience` iterations.
+
+        Args:
+            budget: The power budget
+            train_data: The data used for threshold fitting
+            valid_data: The data used to detect convergence
+            min_init: A [L] array of lower bounds for the initial thresholds
+            should_print: Whether we should print the results
+            executor: An optional process pool (from _fit_worker_pool) in which to run the islands
+        Returns:
+            A tuple of three elements:
+                (1) A [L] array of thresholds
+                (2) The loss of these thresholds
+                (3) The number of completed iterations
+        """
+        if should_print:
+            print('===== Starting Budget {0:.3f} with {1} Islands ====='.format(budget, self._num_islands))
+
+        rand = np.random.RandomState(seed=42)
+        init_thresholds = self._init_thresholds(budget=budget, min_init=min_init, rand=rand)  # [S, L]
+        init_thresholds[:, -1] = 0
+
+        islands: List[IslandState] = []
+        for island_idx, island_thresholds in enumerate(np.array_split(init_thresholds, self._num_islands, axis=0)):
+            islands.append(IslandState(thresholds=island_thresholds,
+                                       best_thresholds=np.copy(island_thresholds),
+                                       best_valid_loss=np.ones(island_thresholds.shape[0]),
+                                       rand=np.random.RandomState(seed=42 + island_idx)))
+
+        best_overall_loss = 1.0
+        early_stopping_counter = 0
+        completed_iterations = 0
+
+        while completed_iterations < self._max_iter and early_stopping_counter < self._patience:
+            num_iterations = min(STEAL_ITERATIONS, self._max_iter - completed_iterations)
+
+            if executor is None:
+                islands = [self.run_island(state=state,
+                                           budget=budget,
+                                           train_data=train_data,
+                                           valid_data=valid_data,
+                                           num_iterations=num_iterations) for state in islands]
+            else:
+                futures = [executor.submit(_run_island_worker, self, state, budget, num_iterations) for state in islands]
+                islands = [future.result() for future in futures]
+
+            completed_iterations += num_iterations
+
+            # Migrate the globally best thresholds into the worst trial of every other island
+            island_losses = [np.min(state.best_valid_loss) for state in islands]
+            best_island = int(np.argmin(island_losses))
+            lowest_loss = island_losses[best_island]
+
+            best_state = islands[best_island]
+            migrant = best_state.best_thresholds[np.argmin(best_state.best_valid_loss)]
+
+            for island_idx, state in enumerate(islands):
+                worst_idx = np.argmax(state.best_valid_loss)
+                if island_idx == best_island or lowest_loss >= state.best_valid_loss[worst_idx]:
+                    continue
+
+                random_move = state.rand.uniform(low=-RANDOM_MOVE, high=RANDOM_MOVE, size=migrant.shape[0])
+                state.thresholds[worst_idx] = np.clip(round_to_precision(migrant + random_move, self._precision), a_min=0, a_max=1)
 
-        for budget in self._budgets:
             if should_print:
-                print('===== Starting Budget {0:.3f} ====='.format(budget))
+                print('Completed Iteration: {0}'.format(completed_iterations))
+                print('\tBest Valid Loss per Island: {0}'.format(island_losses))
 
-            # Initialize the random state. We use the same seed for all budgets to get consistent results. Otherwise
-            # the results are dependent on how many budgets we use due to changes in randomness.
-            rand = np.random.RandomState(seed=42)
+            # Detect convergence on the global validation loss
+            if lowest_loss < best_overall_loss:
+                best_overall_loss = lowest_loss
+                early_stopping_counter = 0
+            else:
+                early_stopping_counter += num_iterations
 
-            # Initialize the thresholds uniformly at random. We cap the thresholds at the smallest known level
-            # which consumes power more than the budget. This prevents quick, greedy methods to get under the budget
-            # in early iterations.
-            init_thresholds = rand.uniform(low=min_init, high=max_init, size=(self._trials, num_levels))
-            init_thresholds = round_to_precision(init_thresholds, self._precision)
+        if should_print and early_stopping_counter >= self._patience:
+            print('Converged.')
 
-            power_diff = power_estimates - budget
-            diff_mask = (power_diff <= 0).astype(int) * BIG_NUMBER
-            max_level = np.argmin(power_diff + diff_mask)
+        best_thresholds = np.concatenate([state.best_thresholds for state in islands], axis=0)  # [S, L]
+        budget_array = np.full(fill_value=budget, shape=best_thresholds.shape[0])
 
-            mask = np.expand_dims((level_idx < max_level).astype(int), axis=0)  # [1, L]
-            init_thresholds = init_thresholds * mask
+        return self.select_thresholds(best_thresholds=best_thresholds, budgets=budget_array, valid_data=valid_data) + (completed_iterations, )
 
-            # Fit thresholds for this budget
-            thresholds, loss, iterations = self.fit_single(train_data=train_data,
-                                                           valid_data=valid_data,
-                                                           init_thresholds=init_thresholds,
-                                                           budget=budget,
-                                                           stealing_iterations=STEAL_ITERATIONS,
-                                                           rand=rand,
-                                                           should_print=should_print)
+    def run_island(self, state: IslandState, budget: float, train_data: ThresholdData, valid_data: ThresholdData, num_iterations: int) -> IslandState:
+        """
+        Runs the given number of coordinate descent iterations on the trials of a single island. The trials
+        steal the best thresholds of the island at the end of the block.
 
-            best_thresholds.append(thresholds)
-            best_loss.append(loss)
+        Args:
+            state: The current state of the island
+            budget: The power budget
+            train_data: The data used for threshold fitting
+            valid_data: The data used to track the best thresholds
+            num_iterations: The number of iterations to run
+        Returns:
+            The updated state of the island
+        """
+        thresholds = np.copy(state.thresholds)  # [T, L]
+        best_thresholds = np.copy(state.best_thresholds)  # [T, L]
+        best_valid_loss = np.copy(state.best_valid_loss)  # [T]
+        rand = state.rand
 
-            training_iterations += iterations * self._trials
+        fp_one = 1 << self._precision
+        candidates = np.arange(fp_one) / fp_one  # [C]
 
-        final_thresholds = np.vstack(best_thresholds)
+        budget_array = np.full(fill_value=budget, shape=thresholds.shape[0])
+        num_levels = train_data.model_correct.shape[1]
 
-        # Get the level distribution
-        levels = levels_to_execute(probs=valid_data.stop_probs, thresholds=final_thresholds)
-        level_counts = get_level_counts(levels=levels, num_levels=num_levels)  # [S, L]
-        avg_level_counts = level_counts / (np.sum(level_counts, axis=-1, keepdims=True) + SMALL_NUMBER)
+        for _ in range(num_iterations):
+            # Select levels with the same rule as fit_single(), which never skips the previous level
+            level = rand.randint(low=0, high=num_levels - 1)
 
-        self._thresholds = final_thresholds
-        return final_thresholds, avg_level_counts, -np.array(best_loss).reshape(-1), training_iterations
+            self.optimize_level(thresholds=thresholds,
+                                level=level,
+                                candidates=candidates,
+                                budgets=budget_array,
+                                train_data=train_data)
+
+            valid_loss, _ = self.loss_function(thresholds=thresholds,
+                                               budgets=budget_array,
+                                               model_correct=valid_data.model_correct,
+                                               stop_probs=valid_data.stop_probs)
+
+            has_improved = valid_loss < best_valid_loss
+            best_thresholds = np.where(np.expand_dims(has_improved, axis=-1), thresholds, best_thresholds)
+            best_valid_loss = np.where(has_improved, valid_loss, best_valid_loss)
+
+        # Steal the best thresholds within the island
+        lowest_idx = np.argmin(best_valid_loss)
+        for j in range(thresholds.shape[0]):
+            if best_valid_loss[lowest_idx] < best_valid_loss[j]:
+                random_move = rand.uniform(low=-RANDOM_MOVE, high=RANDOM_MOVE, size=thresholds.shape[1])
+                thresholds[j] = np.clip(round_to_precision(best_thresholds[lowest_idx] + random_move, self._precision), a_min=0, a_max=1)
+
+        return IslandState(thresholds=thresholds,
+                           best_thresholds=best_thresholds,
+                           best_valid_loss=best_valid_loss,
+                           rand=rand)
+
+    def refine_budget(self, budget: float, init_thresholds: np.ndarray, train_data: ThresholdData, valid_data: ThresholdData, min_init: np.ndarray, should_print: bool) -> Tuple[np.ndarray, float, int]:
+        """
+        Refines the given (converged) thresholds for a nearby budget. The first trial starts from the given thresholds
+        and the remaining trials start from the usual random initialization. Budgets therefore keep their neighbor's
+        solution unless the refinement finds a better one.
+
+        Args:
+            budget: The power budget
+            init_thresholds: A [L] array of the thresholds to start from
+            train_data: The data used for threshold fitting
+            valid_data: The data used to detect convergence
+            min_init: A [L] array of lower bounds for the random initial thresholds
+            should_print: Whether we should print the results
+        Returns:
+            A tuple of three elements:
+                (1) A [L] array of thresholds
+                (2) The loss of these thresholds
+                (3) The number of completed iterations
+        """
+        if should_print:
+            print('===== Refining Budget {0:.3f} ====='.format(budget))
+
+        rand = np.random.RandomState(seed=42)
+
+        warm_thresholds = self._init_thresholds(budget=budget, min_init=min_init, rand=rand)  # [S, L]
+        warm_thresholds[0] = init_thresholds
+
+        return self.fit_single(train_data=train_data,
+                               valid_data=valid_data,
+                               init_thresholds=warm_thresholds,
+                               budget=budget,
+                               stealing_iterations=STEAL_ITERATIONS,
+                               rand=rand,
+                               should_print=should_print,
+                               max_iter=self._refine_iter)
+
+    def _fit_budgets_continuation(self, train_data: ThresholdData, valid_data: ThresholdData, min_init: np.ndarray, should_print: bool) -> List[Tuple[np.ndarray, float, int]]:
+        """
+        Fits the budgets in sorted order. The first budget is fit from scratch, and every later budget is refined from the
+        thresholds of its (already fitted) neighbor. We sweep from the highest budget downwards because lowering thresholds
+        takes fewer refinement steps than raising them. The bidirectional mode repeats the sweep in ascending order and
+        keeps the result with the lower loss for each budget.
+        """
+        order = np.argsort(self._budgets, kind='stable')[::-1]
+
+        def sweep(budget_order: np.ndarray) -> Dict[int, Tuple[np.ndarray, float, int]]:
+            results: Dict[int, Tuple[np.ndarray, float, int]] = dict()
+            prev_thresholds: Optional[np.ndarray] = None
+
+            for budget_idx in budget_order:
+                budget = self._budgets[budget_idx]
+
+                if prev_thresholds is None:
+                    result = self.fit_budget(budget=budget, train_data=train_data, valid_data=valid_data, min_init=min_init, should_print=should_print)
+                else:
+                    result = self.refine_budget(budget=budget,
+                                                init_thresholds=prev_thresholds,
+                                                train_data=train_data,
+                                                valid_data=valid_data,
+                                                min_init=min_init,
+                                                should_print=should_print)
+
+                results[budget_idx] = result
+                prev_thresholds = result[0]
+
+            return results
+
+        down_results = sweep(order)
+        if not self._bidirectional:
+            return [down_results[budget_idx] for budget_idx in range(self._num_budgets)]
+
+        up_results = sweep(order[::-1])
+
+        budget_results: List[Tuple[np.ndarray, float, int]] = []
+        for budget_idx in range(self._num_budgets):
+            down_thresholds, down_loss, down_iters = down_results[budget_idx]
+            up_thresholds, up_loss, up_iters = up_results[budget_idx]
+
+            # Both sweeps count towards the number of iterations
+            if up_loss < down_loss:
+                budget_results.append((up_thresholds, up_loss, down_iters + up_iters))
+            else:
+                budget_results.append((down_thresholds, down_loss, down_iters + up_iters))
+
+        return budget_results
 
     def evaluate(self, model_correct: np.ndarray, stop_probs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
@@ -325,6 +809,77 @@ class BudgetOptimizer:
                                        thresholds=self._thresholds)
         return -loss, pwr
 
+    def candidate_losses(self, thresholds: np.ndarray, level: int, candidates: np.ndarray, budget: float, model_correct: np.ndarray, stop_probs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluates the loss for every candidate value of the threshold at one level. This function
+        returns the same values as calling loss_function() once per candidate, but it only makes
+        a single pass over the samples. Changing the threshold at the given level only affects the
+        samples which reach this level. We sort these samples by their stop probability, so the
+        samples which continue past the level under each candidate form a prefix of the sorted order.
+
+        Args:
+            thresholds: A [L] array of thresholds for each level (L). The value at the given level is ignored.
+            level: The level of the threshold to evaluate. Must be below the top level.
+            candidates: A [C] array of candidate threshold values
+            budget: The power budget
+            model_correct: A [B, L] array of binary model correct labels for each batch sample (B) and model level (L)
+            stop_probs: A [B, L] array of stop probabilities for each batch sample (B) and model level (L)
+        Returns:
+            A tuple of two elements:
+                (1) A [C] array of the loss for each candidate
+                (2) A [C] array of the avg power for each candidate
+        """
+        num_samples, num_levels = stop_probs.shape
+        assert level < num_levels - 1, 'Cannot evaluate the threshold of the top level'
+
+        # Find the halting level of each sample when the given level never halts
+        skip_thresholds = np.copy(thresholds).reshape(1, -1)
+        skip_thresholds[0, level] = np.inf
+        skip_levels = levels_to_execute(probs=stop_probs, thresholds=skip_thresholds)[0]  # [B]
+
+        # Samples halting before the given level are not affected by the candidate threshold
+        reaches_level = skip_levels > level  # [B]
+        sample_idx = np.arange(num_samples)
+
+        fixed_counts = np.bincount(skip_levels[~reaches_level], minlength=num_levels)  # [L]
+        fixed_correct = np.sum(model_correct[sample_idx[~reaches_level], skip_levels[~reaches_level]])
+
+        # Sort the remaining samples by their stop probability at the given level
+        reach_idx = sample_idx[reaches_level]
+        order = np.argsort(stop_probs[reach_idx, level], kind='stable')
+        reach_idx = reach_idx[order]
+        reach_probs = stop_probs[reach_idx, level]  # [R]
+        reach_levels = skip_levels[reach_idx]  # [R]
+
+        # Prefix sums over the sorted samples. Row m holds the totals for the first m samples.
+        level_onehot = (np.expand_dims(reach_levels, axis=-1) == np.arange(num_levels)).astype(np.int64)  # [R, L]
+        zero_row = np.zeros(shape=(1, num_levels), dtype=np.int64)
+        continue_counts = np.concatenate([zero_row, np.cumsum(level_onehot, axis=0)], axis=0)  # [R + 1, L]
+
+        continue_correct = np.concatenate([[0], np.cumsum(model_correct[reach_idx, reach_levels])])  # [R + 1]
+        halt_correct = np.concatenate([[0], np.cumsum(model_correct[reach_idx, level])])  # [R + 1]
+
+        # Samples with a stop probability at most the candidate continue past the given level
+        num_continue = np.searchsorted(reach_probs, candidates, side='right')  # [C]
+        num_halt = len(reach_idx) - num_continue  # [C]
+
+        level_counts = np.expand_dims(fixed_counts, axis=0) + continue_counts[num_continue]  # [C, L]
+        level_counts[:, level] += num_halt
+
+        num_correct = fixed_correct + continue_correct[num_continue] + (halt_correct[-1] - halt_correct[num_continue])  # [C]
+
+        # Compute the power and loss using the same operations as loss_function()
+        weights = level_counts.astype(float) / num_samples  # [C, L]
+        avg_power = np.sum(weights * self._power_system.get_power_estimates(), axis=-1)  # [C], matches avg_power_for_levels()
+
+        accuracy = num_correct.astype(float) / num_samples  # [C]
+
+        time_steps = np.minimum(((budget * num_samples) / avg_power).astype(int), num_samples)  # [C]
+        adjusted_accuracy = (accuracy * time_steps) / num_samples  # [C]
+
+        return -adjusted_accuracy, avg_power
+
+    @timed('controller.fit_single')
     def fit_single(self,
                    train_data: ThresholdData,
                    valid_data: ThresholdData,
@@ -332,7 +887,8 @@ class BudgetOptimizer:
                    budget: float,
                    stealing_iterations: int,
                    rand: np.random.RandomState,
-                   should_print: bool) -> Tuple[np.ndarray, np.ndarray, int]:
+                   should_print: bool,
+                   max_iter: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, int]:
         """
         Fits the optimizer to the given predictions of the logistic regression model and neural network model.
 
@@ -345,6 +901,7 @@ class BudgetOptimizer:
             valid_data: A pair of arrays containing the validation set. Same structure as train_data.
             init_thresholds: An [S, L] of initial thresholds for each budget (S) and level (L)
             should_print: Whether we should print intermediate results
+            max_iter: The maximum number of iterations. Defaults to the value given to the constructor.
         Returns:
             A tuple of three elements:
             (1) A [S, L] array of thresholds for each budget
@@ -365,6 +922,7 @@ class BudgetOptimizer:
 
         # The number 1 in fixed point representation with the specific precision
         fp_one = 1 << self._precision
+        candidates = np.arange(fp_one) / fp_one  # [C]
 
         prev_level = None
         budget_array = np.full(fill_value=budget, shape=thresholds.shape[0])
@@ -372,7 +930,9 @@ class BudgetOptimizer:
         num_levels = train_data.model_correct.shape[1]
         completed_iterations = 0
 
-        for i in range(self._max_iter):
+        max_iter = max_iter if max_iter is not None else self._max_iter
+
+        for i in range(max_iter):
 
             # Select a random level to optimize. We skip the top-level because it does
             # not correspond to a trainable threshold.
@@ -382,35 +942,12 @@ class BudgetOptimizer:
             if prev_level is not None and level == prev_level:
                 level = level - 1 if level > 0 else num_levels - 2
 
-            # [S] array of threshold values for the select values
-            best_t = np.copy(thresholds[:, level])  # The 'best' are the current thresholds at this level
-
-            # Initialize best loss and best power for this iteration
-            best_loss, best_power = self.loss_function(thresholds=thresholds,
-                                                       budgets=budget_array,
-                                                       model_correct=train_data.model_correct,
-                                                       stop_probs=train_data.stop_probs)
-
-            # Select best threshold over the (discrete) search space
-            for t in range(fp_one):
-
-                # Set the candidate thresholds
-                candidate_value = t / fp_one
-                thresholds[:, level] = candidate_value
-
-                # Compute the fitness, both return values are [S] arrays
-                loss, avg_power = self.loss_function(thresholds=thresholds,
-                                                     budgets=budget_array,
-                                                     model_correct=train_data.model_correct,
-                                                     stop_probs=train_data.stop_probs)
-
-                has_improved = loss < best_loss
-
-                best_t = np.where(has_improved, candidate_value, best_t)
-                best_power = np.where(has_improved, avg_power, best_power)
-                best_loss = np.where(has_improved, loss, best_loss)
-
-            thresholds[:, level] = best_t  # Set the best thresholds based on the training data
+            # Set the best thresholds at this level based on the training data
+            best_loss, best_power = self.optimize_level(thresholds=thresholds,
+                                                        level=level,
+                                                        candidates=candidates,
+                                                        budgets=budget_array,
+                                                        train_data=train_data)
 
             # Compute the validation loss. The result is a [S] array.
             valid_loss, valid_power = self.loss_function(thresholds=thresholds,
@@ -461,6 +998,62 @@ class BudgetOptimizer:
                     print('Converged.')
                 break
 
+        return self.select_thresholds(best_thresholds=best_thresholds, budgets=budget_array, valid_data=valid_data) + (completed_iterations, )
+
+    def optimize_level(self, thresholds: np.ndarray, level: int, candidates: np.ndarray, budgets: np.ndarray, train_data: ThresholdData) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sets the threshold at the given level to the candidate with the lowest training loss. The
+        thresholds are updated in place.
+
+        Args:
+            thresholds: A [S, L] array of thresholds for each trial (S) and level (L)
+            level: The level to optimize
+            candidates: A [C] array of candidate threshold values
+            budgets: A [S] array of budgets for each trial
+            train_data: The data used for threshold fitting
+        Returns:
+            A tuple of two [S] arrays: the training loss and the avg power of the updated thresholds
+        """
+        # [S] array of threshold values for the select values
+        best_t = np.copy(thresholds[:, level])  # The 'best' are the current thresholds at this level
+
+        # Initialize best loss and best power for this iteration
+        best_loss, best_power = self.loss_function(thresholds=thresholds,
+                                                   budgets=budgets,
+                                                   model_correct=train_data.model_correct,
+                                                   stop_probs=train_data.stop_probs)
+
+        # Select best threshold over the (discrete) search space. The candidates are evaluated
+        # together, and we only accept a candidate if it strictly improves the loss. Taking the first
+        # minimum matches a sequential scan in increasing order of the candidates.
+        for s in range(thresholds.shape[0]):
+            loss, avg_power = self.candidate_losses(thresholds=thresholds[s],
+                                                    level=level,
+                                                    candidates=candidates,
+                                                    budget=budgets[s],
+                                                    model_correct=train_data.model_correct,
+                                                    stop_probs=train_data.stop_probs)
+
+            best_idx = np.argmin(loss)
+            if loss[best_idx] < best_loss[s]:
+                best_t[s] = candidates[best_idx]
+                best_power[s] = avg_power[best_idx]
+                best_loss[s] = loss[best_idx]
+
+        thresholds[:, level] = best_t
+        return best_loss, best_power
+
+    def select_thresholds(self, best_thresholds: np.ndarray, budgets: np.ndarray, valid_data: ThresholdData) -> Tuple[np.ndarray, float]:
+        """
+        Selects the final thresholds from the best thresholds of each trial.
+
+        Args:
+            best_thresholds: A [S, L] array of the best thresholds for each trial (S) and level (L)
+            budgets: A [S] array of budgets for each trial
+            valid_data: The data used to select the thresholds
+        Returns:
+            A tuple of the [L] array of selected thresholds and the validation loss of these thresholds
+        """
         # We zero out the thresholds at all points after the first zero. This does not
         # change the correctness but prevents mistakes during interpolation.
         zero_comparison = np.isclose(best_thresholds, 0)  # [S, L]
@@ -475,7 +1068,7 @@ class BudgetOptimizer:
         # Get the best set of thresholds according to the thresholds with the lowest loss.
         # We break ties by selecting the thresholds with the higher power amount.
         final_loss, final_power = self.loss_function(thresholds=best_thresholds,
-                                                     budgets=budget_array,
+                                                     budgets=budgets,
                                                      model_correct=valid_data.model_correct,
                                                      stop_probs=valid_data.stop_probs)
 
@@ -483,7 +1076,7 @@ class BudgetOptimizer:
         equal_mask = np.isclose(final_loss, best_loss)
         best_idx = np.argmax(final_power * equal_mask)
 
-        return best_thresholds[best_idx], final_loss[best_idx], completed_iterations
+        return best_thresholds[best_idx], final_loss[best_idx]
 
 
 # Model Controllers
@@ -505,6 +1098,29 @@ class Controller:
     def predict_sample(self, stop_probs: np.ndarray, budget: int) -> Tuple[int, Optional[float]]:
         raise NotImplementedError()
 
+    def predict_batch(self, stop_probs: Optional[np.ndarray], budget: float, num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Predicts the number of levels for a block of samples under a fixed budget.
+
+        Args:
+            stop_probs: An optional [T] array of stop probabilities for each sample (T) and level (L)
+            budget: The budget to perform inference under
+            num_samples: The number of samples (T)
+        Returns:
+            A tuple of two [T] arrays: the levels to execute and the power consumed by executing these levels
+        """
+        levels = np.empty(shape=(num_samples, ), dtype=int)
+        power = np.empty(shape=(num_samples, ))
+
+        for idx in range(num_samples):
+            sample_probs = stop_probs[idx] if stop_probs is not None else None
+            level, level_power = self.predict_sample(stop_probs=sample_probs, budget=budget)
+
+            levels[idx] = level
+            power[idx] = level_power if level_power is not None else self._power_system.get_avg_power(level + 1)
+
+        return levels, power
+
 
 class AdaptiveController(Controller):
 
@@ -515,18 +1131,29 @@ class AdaptiveController(Controller):
                  trials: int,
                  patience: int,
                  max_iter: int,
-                 power_system_type: PowerType):
+                 power_system_type: PowerType,
+                 num_workers: int = 1,
+                 continuation: bool = False,
+                 refine_iter: int = 20,
+                 bidirectional: bool = False,
+                 num_islands: int = 1,
+                 intra_op_threads: Optional[int] = None,
+                 inter_op_threads: int = 1,
+                 placement: str = 'compact'):
         self._model_path = model_path
         self._dataset_folder = dataset_folder
 
-        # Load the model and dataset
-        model, dataset = restore_neural_network(model_path, dataset_folder=dataset_folder)
-        self._model = model
-        self._dataset = dataset
+        # The model and dataset are only needed to fit the thresholds, so we restore them on first use.
+        # The remaining properties come from the saved hyperparameters and metadata.
+        self._model: Optional[AdaptiveModel] = None
+        self._dataset: Optional[Dataset] = None
+
+        hypers = get_hyperparameters(model_path)
+        metadata = get_metadata(model_path)
 
-        self._num_levels = model.num_outputs
-        self._seq_length = model.metadata[SEQ_LENGTH]
-        self._num_classes = model.metadata[NUM_CLASSES]
+        self._num_levels = hypers.model_params['num_outputs']
+        self._seq_length = metadata[SEQ_LENGTH]
+        self._num_classes = metadata[NUM_CLASSES]
         self._budgets = np.array(list(sorted(budgets)))
         self._num_budgets = len(self._budgets)
         self._precision = precision
@@ -542,6 +1169,12 @@ class AdaptiveController(Controller):
         self._is_fitted = False
         self._training_iters = 0
 
+        # Lookup tables for the thresholds of unseen budgets. Built by _build_interpolation_tables().
+        self._interpolator: Optional[BudgetInterpolator] = None
+        self._threshold_table: Optional[np.ndarray] = None
+        self._max_accuracy_budget = float('inf')
+        self._thresholds_cache: Optional[Tuple[float, np.ndarray]] = None
+
         # Create the budget optimizer and power system
         self._power_system = make_power_system(mode=power_system_type,
                                                num_levels=self._num_levels,
@@ -552,7 +1185,15 @@ class AdaptiveController(Controller):
                                                  precision=self._precision,
                                                  trials=self._trials,
                                                  patience=patience,
-                                                 max_iter=max_iter)
+                                                 max_iter=max_iter,
+                                                 num_workers=num_workers,
+                                                 continuation=continuation,
+                                                 refine_iter=refine_iter,
+                                                 bidirectional=bidirectional,
+                                                 num_islands=num_islands,
+                                                 intra_op_threads=intra_op_threads,
+                                                 inter_op_threads=inter_op_threads,
+                                                 placement=placement)
 
     @property
     def thresholds(self) -> np.ndarray:
@@ -562,6 +1203,21 @@ class AdaptiveController(Controller):
     def budgets(self) -> np.ndarray:
         return self._budgets
 
+    @property
+    def model(self) -> AdaptiveModel:
+        if self._model is None:
+            self._restore_model()
+        return self._model
+
+    @property
+    def dataset(self) -> Dataset:
+        if self._dataset is None:
+            self._restore_model()
+        return self._dataset
+
+    def _restore_model(self):
+        self._model, self._dataset = restore_neural_network(self._model_path, dataset_folder=self._dataset_folder)
+
     def load_validation_accuracy(self, validation_accuracy: np.ndarray):
         self._validation_accuracy = validation_accuracy  # [L]
 
@@ -579,10 +1235,11 @@ class AdaptiveController(Controller):
     def fit(self, series: DataSeries, should_print: bool):
         start_time = datetime.now()
 
-        # Execute the model on the training, validation, and testing sets
-        train_results = execute_adaptive_model(self._model, self._dataset, series=DataSeries.TEST)
-        valid_results = execute_adaptive_model(self._model, self._dataset, series=DataSeries.VALID)
-        test_results = execute_adaptive_model(self._model, self._dataset, series=DataSeries.TEST)
+        # Execute the model on the validation and testing sets. The testing results double
+        # as the 'training' results, so we only execute the model once per series.
+        valid_results = execute_adaptive_model(self.model, self.dataset, series=DataSeries.VALID)
+        test_results = execute_adaptive_model(self.model, self.dataset, series=DataSeries.TEST)
+        train_results = test_results
 
         train_correct = train_results.predictions == train_results.labels  # [N, L]
         valid_correct = valid_results.predictions == valid_results.labels  # [K, L]
@@ -675,16 +1332,33 @@ class AdaptiveController(Controller):
             class_level_counts = np.bincount(levels[1], minlength=self._num_levels, weights=class_mask)
             self._highest_distribution[class_idx] = class_level_counts
 
+        self._build_interpolation_tables()
         self._is_fitted = True
 
+    def _build_interpolation_tables(self):
+        """
+        Precomputes the tables used to look up the thresholds of arbitrary budgets.
+        """
+        self._interpolator = BudgetInterpolator(budgets=self._budgets,
+                                                avg_level_counts=self._avg_level_counts,
+                                                power_system=self._power_system)
+
+        # [S + 2, L] table of thresholds. The first and last rows are the fixed policies on the lowest and highest
+        # levels, so the interpolation index i maps to the row i + 1.
+        num_levels = self._thresholds.shape[1]
+        self._threshold_table = np.vstack([np.zeros((1, num_levels)), self._thresholds, np.ones((1, num_levels))])
+
+        # Budgets above the budget with the highest validation accuracy use the thresholds of this budget
+        if self._est_accuracy is not None:
+            self._max_accuracy_budget = self._budgets[np.argmax(self._est_accuracy)]
+
+        self._thresholds_cache = None
+
     def estimate_level_distribution(self, budget: float) -> Dict[int, np.ndarray]:
         assert self._label_distribution is not None, 'Must call fit() first'
         assert self._thresholds is not None, 'Must call fit() first'
 
-        lower_idx, upper_idx, weight = get_budget_interpolation_values(target=budget,
-                                                                       budgets=self._budgets,
-                                                                       avg_level_counts=self._avg_level_counts,
-                                                                       power_system=self._power_system)
+        lower_idx, upper_idx, weight = self._interpolator.lookup(budget)
         num_thresholds = self._thresholds.shape[0]
 
         if lower_idx < 0:
@@ -708,57 +1382,37 @@ class AdaptiveController(Controller):
         return result
 
     def get_thresholds(self, budget: float) -> np.ndarray:
+        """
+        Returns the [L] array of thresholds for the given budget. Budgets between the fitted budgets use interpolated
+        thresholds. The result is read-only because the thresholds of the last budget are cached (simulations
+        query the same budget at every step).
+        """
         assert self._thresholds is not None, 'Must call fit() first'
 
-        power_multiplier = int(self._seq_length / self._num_levels)
+        if self._thresholds_cache is not None and self._thresholds_cache[0] == budget:
+            return self._thresholds_cache[1]
 
         # If the budget is above the power needed for the highest validation accuracy
         # we cap the execution to these thresholds. This makes the execution more amenable
         # to the controller, as the controller will force power as close as possible to the
         # budget. This doesn't work when the model has out-of-order accuracy.
+        target = min(budget, self._max_accuracy_budget)
 
-        best_idx = np.argmax(self._est_accuracy)
-        if self._budgets[best_idx] <= budget:
-            return self._thresholds[best_idx]
-
-        # Check if this budget is known based from the optimization phase
-        budget_idx = index_of(self._budgets, value=budget)
-
-        min_power = self._power_system.get_min_power()
-        max_power = self._power_system.get_max_power()
-
-        # If we already have the budget, then use the corresponding thresholds
-        if budget_idx >= 0:
-            return self._thresholds[budget_idx]
+        # Known budgets use their own thresholds. Otherwise, we interpolate between the nearest budgets.
+        lower_idx, upper_idx, weight = self._interpolator.lookup(target)
 
-        lower_idx, upper_idx, weight = get_budget_interpolation_values(budgets=self._budgets,
-                                                                       target=budget,
-                                                                       avg_level_counts=self._avg_level_counts,
-                                                                       power_system=self._power_system)
-        num_thresholds = self._thresholds.shape[0]
-        num_levels = self._thresholds.shape[1]
-
-        if lower_idx < 0:
-            lower_thresh = np.zeros(num_levels)
-        elif lower_idx > num_thresholds:
-            lower_thresh = np.ones(num_levels)
+        if lower_idx == upper_idx and 0 <= lower_idx < self._thresholds.shape[0]:
+            thresholds = np.copy(self._thresholds[lower_idx])
         else:
-            lower_thresh = self._thresholds[lower_idx]
+            # Create thresholds and projected budget
+            thresholds = self._threshold_table[lower_idx + 1] * (1 - weight) + self._threshold_table[upper_idx + 1] * weight
+            thresholds[-1] = 0
 
-        if upper_idx < 0:
-            upper_thresh = np.zeros(num_levels)
-        elif upper_idx > num_thresholds:
-            upper_thresh = np.ones(num_levels)
-        else:
-            upper_thresh = self._thresholds[upper_idx]
-
-        # Create thresholds and projected budget
-        thresholds = lower_thresh * (1 - weight) + upper_thresh * weight
-        thresholds[-1] = 0
-
-        # Round to fixed point representation
-        thresholds = round_to_precision(thresholds, precision=self._precision)
+            # Round to fixed point representation
+            thresholds = round_to_precision(thresholds, precision=self._precision)
 
+        thresholds.setflags(write=False)
+        self._thresholds_cache = (budget, thresholds)
         return thresholds
 
     def get_avg_level_counts(self, budget: int) -> np.ndarray:
@@ -792,6 +1446,15 @@ class AdaptiveController(Controller):
         # By default, we return the top level
         return self._num_levels - 1, self._power_system.get_max_power()
 
+    def predict_batch(self, stop_probs: Optional[np.ndarray], budget: float, num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        assert self._is_fitted, 'Model is not fitted'
+        assert stop_probs is not None, 'Must provide stop probabilities'
+
+        thresholds = np.expand_dims(self.get_thresholds(budget), axis=0)  # [1, L]
+        levels = levels_to_execute(probs=stop_probs, thresholds=thresholds)[0]  # [T]
+
+        return levels, self._power_system.get_power_estimates()[levels]
+
     def evaluate(self, budget: float, model_results: ModelResults) -> Tuple[float, float]:
         assert self._thresholds is not None, 'Must call fit() first'
 
@@ -888,6 +1551,9 @@ class AdaptiveController(Controller):
         controller._highest_distribution = serialized_info.get('highest_distribution')
         controller._training_iters = serialized_info.get('training_iters', 0)
 
+        if controller._thresholds is not None and controller._avg_level_counts is not None:
+            controller._build_interpolation_tables()
+
         return controller
 
 
@@ -905,6 +1571,11 @@ class FixedController(Controller):
         """
         return self._model_index, self._power_system.get_avg_power(self._model_index + 1)
 
+    def predict_batch(self, stop_probs: Optional[np.ndarray], budget: float, num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        levels = np.full(shape=(num_samples, ), fill_value=self._model_index, dtype=int)
+        power = np.full(shape=(num_samples, ), fill_value=self._power_system.get_avg_power(self._model_index + 1))
+        return levels, power
+
 
 class RandomController(Controller):
 
@@ -927,7 +1598,7 @@ class RandomController(Controller):
     def fit(self, series: DataSeries, should_print: bool = False):
         # Fit a weighted average for each budget
         thresholds: List[np.ndarray] = []
-        power_array = np.array([self._power_system.get_avg_power(i+1) for i in range(self._num_levels)])
+        power_array = self._power_system.get_power_estimates()
 
         for budget in self._budgets:
             distribution = PowerDistribution(power_array, target=budget)
@@ -954,6 +1625,16 @@ class RandomController(Controller):
         chosen_level = self._rand.choice(self._levels, p=thresholds)
         return chosen_level, self._power_system.get_avg_power(chosen_level + 1)
 
+    def predict_batch(self, stop_probs: Optional[np.ndarray], budget: float, num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Draws the levels for all samples at once. The draws match calling predict_sample() on each sample in order.
+        """
+        assert self._is_fitted, 'Model is not fitted'
+
+        thresholds = self._threshold_dict[budget]
+        chosen_levels = self._rand.choice(self._levels, size=num_samples, p=thresholds)
+        return chosen_levels, self._power_system.get_power_estimates()[chosen_levels]
+
 
 class MultiModelController(Controller):
 
@@ -995,6 +1676,10 @@ class MultiModelController(Controller):
 
         return model_idx, self._model_power[model_idx]
 
+    def predict_batch(self, stop_probs: Optional[np.ndarray], budget: float, num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        model_idx, power = self.predict_sample(stop_probs=None, budget=budget)
+        return np.full(shape=(num_samples, ), fill_value=model_idx, dtype=int), np.full(shape=(num_samples, ), fill_value=power)
+
 
 class BudgetWrapper:
 
@@ -1063,6 +1748,57 @@ class BudgetWrapper:
 
         return pred, level, power
 
+    def predict_batch(self, stop_probs: Optional[np.ndarray], start_time: int, budget: float, noise: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Predicts the labels for a contiguous block of samples under a fixed budget. The results (and the consumed energy)
+        match calling predict_sample() on each sample in order.
+
+        Args:
+            stop_probs: An optional [T, L] array of the stop probabilities for each sample (T) and level (L)
+            start_time: The time index of the first sample
+            budget: The power budget
+            noise: A [T] array of the noise on the power readings
+        Returns:
+            A tuple of four [T] arrays:
+                (1) The classification for each sample. Only valid where (2) is true.
+                (2) Whether each sample has a classification. Samples after exhausting the energy budget do not.
+                (3) The number of levels used during execution
+                (4) The average power consumed to produce each classification
+        """
+        num_samples = noise.shape[0]
+        levels, model_power = self._controller.predict_batch(stop_probs=stop_probs, budget=budget, num_samples=num_samples)
+        power = model_power + noise  # [T]
+
+        # Energy consumed before each sample when the system uses the controller throughout. The cumulative
+        # sum adds the readings in the same order as predict_sample().
+        energy = np.cumsum(np.concatenate([[self._energy_sum], power]))  # [T + 1]
+
+        # Once the energy exceeds the budget (minus the margin), the system stops and consumes no more energy. Thus,
+        # the controller is only used on a prefix of the samples.
+        is_exhausted = energy[:-1] >= self._energy_budget - self._energy_margin
+        num_active = int(np.argmax(is_exhausted)) if np.any(is_exhausted) else num_samples
+
+        levels[num_active:] = 0
+        power[num_active:] = 0.0
+        energy_sum = energy[num_active]
+
+        # Clip the energy of the last inference if it pushes the system over budget
+        for idx in range(num_active, num_samples):
+            if energy_sum <= self._energy_budget:
+                break
+
+            power[idx] = self._energy_budget - energy_sum
+            energy_sum += power[idx]
+
+        predictions = self._model_predictions[np.arange(start_time, start_time + num_samples), levels]
+        has_prediction = np.arange(num_samples) < num_active
+
+        # Log the energy consumption
+        self._power.extend(power.tolist())
+        self._energy_sum = energy_sum
+
+        return predictions, has_prediction, levels, power
+
     @property
     def power(self) -> List[float]:
         return self._power
@@ -1086,8 +1822,19 @@ if __name__ == '__main__':
     parser.add_argument('--max-iter', type=int, default=100)
     parser.add_argument('--power-system-type', type=str, choices=['bluetooth', 'temp'], default='temp')
     parser.add_argument('--should-print', action='store_true')
+    parser.add_argument('--fit-workers', type=int, default=1, help='Number of processes used to fit the budgets.')
+    parser.add_argument('--continuation', action='store_true', help='Fit the budgets in sorted order, warm-starting each budget from its neighbor.')
+    parser.add_argument('--refine-iter', type=int, default=20, help='Iterations used to refine each warm-started budget.')
+    parser.add_argument('--bidirectional', action='store_true', help='Run the continuation in both directions and keep the better thresholds.')
+    parser.add_argument('--islands', type=int, default=1, help='Number of independent groups of trials per budget. Islands run in parallel with --fit-workers.')
+    add_resource_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
 
+    # Pin the threads and cores when several processes share this host
+    configure_from_args(args)
+    configure_profiling_from_args(args)
+
     for model_path in args.model_paths:
         print('Starting model at {0}'.format(model_path))
 
@@ -1099,7 +1846,15 @@ if __name__ == '__main__':
                                         trials=args.trials,
                                         patience=args.patience,
                                         max_iter=args.max_iter,
-                                        power_system_type=PowerType[args.power_system_type.upper()])
+                                        power_system_type=PowerType[args.power_system_type.upper()],
+                                        num_workers=args.fit_workers,
+                                        continuation=args.continuation,
+                                        refine_iter=args.refine_iter,
+                                        bidirectional=args.bidirectional,
+                                        num_islands=args.islands,
+                                        intra_op_threads=args.intra_op_threads,
+                                        inter_op_threads=args.inter_op_threads,
+                                        placement=args.placement)
 
         # Fit the model on the validation set
         controller.fit(series=DataSeries.VALID, should_print=args.should_print)
@@ -1,5 +1,6 @@
 import numpy as np
 from enum import Enum, auto
+from functools import lru_cache
 from typing import List
 
 # Constants from taking readings from the DHT-11 sensor
@@ -26,6 +27,14 @@ class PowerSystem:
         self._seq_length = seq_length
         self._multiplier = int(seq_length / total_levels)
 
+        # Lookup tables for the energy and average power of each level. The tables are read-only
+        # because they are shared by all callers.
+        self._energy_table = np.array([self.get_energy(num_samples=(level_idx + 1) * self._multiplier) for level_idx in range(total_levels)])
+        self._power_table = np.array([self._compute_avg_power(num_levels=level_idx + 1) for level_idx in range(total_levels)])
+
+        self._energy_table.setflags(write=False)
+        self._power_table.setflags(write=False)
+
     @property
     def total_levels(self) -> int:
         return self._total_levels
@@ -47,14 +56,16 @@ class PowerSystem:
     def get_min_power(self) -> float:
         return self.get_avg_power(1)
 
-    def get_avg_power(self, num_levels: int) -> float:
-        assert num_levels > 0, 'Must have a positive number of levels'
-
+    def _compute_avg_power(self, num_levels: int) -> float:
         total_time = self.sample_period * self._seq_length
         num_samples = num_levels * self._multiplier
 
         return self.get_energy(num_samples=num_samples) / total_time
 
+    def get_avg_power(self, num_levels: int) -> float:
+        assert num_levels > 0, 'Must have a positive number of levels'
+        return self._power_table[num_levels - 1]
+
     def get_avg_power_multiple(self, num_levels: np.ndarray) -> float:
         """
         Computes the weighted average power over the
@@ -72,10 +83,36 @@ class PowerSystem:
         max_num_samples = np.max(num_levels) * self._multiplier
         assert max_num_samples <= self._seq_length, 'Can have at most {0} samples'.format(self._seq_length)
 
-        counts = np.bincount(num_levels, minlength=self._total_levels + 1)  # [L + 1]
-        weights = counts.astype(float) / np.sum(counts)  # [L + 1]
+        # Episodes without any levels add no power but still count towards the average
+        num_levels = np.asarray(num_levels)
+        is_executed = num_levels > 0
+
+        num_executed = np.count_nonzero(is_executed)
+        if num_executed == 0:
+            return 0.0
+
+        avg_power = self.avg_power_for_levels(np.expand_dims(num_levels[is_executed] - 1, axis=0))[0]
+
+        return avg_power * (num_executed / num_levels.size)
+
+    def avg_power_for_levels(self, levels: np.ndarray) -> np.ndarray:
+        """
+        Computes the average power of each row of executed levels.
+
+        Args:
+            levels: A [S, B] array of the (zero-based) level executed for each batch element (B) under each setting (S)
+        Returns:
+            A [S] array of the average power for each setting
+        """
+        num_settings, num_samples = levels.shape
 
-        return self.get_weighted_avg_power(weights[1:])
+        # Count the levels of each row with a single bincount by offsetting the rows
+        offsets = np.expand_dims(np.arange(num_settings) * self._total_levels, axis=1)  # [S, 1]
+        counts = np.bincount((levels + offsets).reshape(-1), minlength=num_settings * self._total_levels)  # [S * L]
+        counts = counts.reshape(num_settings, self._total_levels)  # [S, L]
+
+        weights = counts.astype(float) / num_samples  # [S, L]
+        return np.sum(weights * self._power_table, axis=-1)  # [S]
 
     def get_weighted_avg_power(self, weights: np.ndarray) -> float:
         """
@@ -87,20 +124,25 @@ class PowerSystem:
             The weighted average power
         """
         assert len(weights.shape) == 1 and weights.shape[0] == self._total_levels, 'Invalid shape: {0}'.format(weights.shape)
-
-        estimates = self.get_power_estimates()
-        weighted_avg = np.sum(weights * estimates)
-
-        return weighted_avg
+        return np.sum(weights * self._power_table)
 
     def get_power_estimates(self) -> np.ndarray:
-        estimates: List[float] = []
+        """
+        Returns the (read-only) [L] array of the average power for each level.
+        """
+        return self._power_table
 
-        for level_idx in range(1, self._total_levels + 1):
-            power = self.get_avg_power(num_levels=level_idx)
-            estimates.append(power)
+    def get_energy_estimates(self) -> np.ndarray:
+        """
+        Returns the (read-only) [L] array of the energy for each level over one sequence.
+        """
+        return self._energy_table
 
-        return np.array(estimates)
+    def energy_for_levels(self, levels: np.ndarray) -> np.ndarray:
+        """
+        Returns the energy of executing the given (zero-based) levels. The output has the same shape as the input.
+        """
+        return self._energy_table[levels]
 
 
 class BluetoothPowerSystem(PowerSystem):
@@ -138,6 +180,7 @@ class TemperaturePowerSystem(PowerSystem):
         return TEMP_VCC * self.sample_period * (current_on + current_off)
 
 
+@lru_cache(maxsize=None)
 def make_power_system(mode: PowerType, num_levels: int, seq_length: int) -> PowerSystem:
     if mode == PowerType.BLUETOOTH:
         return BluetoothPowerSystem(total_levels=num_levels, seq_length=seq_length)
@@ -13,6 +13,9 @@ SMOOTHING_FACTOR = 1
 POWER_PRIOR_COUNT = 1
 POWER_WINDOW = 100
 
+# SciPy renamed trapz to trapezoid (1.6) and later removed the old name
+trapezoid = getattr(integrate, 'trapezoid', None) or integrate.trapz
+
 
 class PIDController:
 
@@ -51,7 +54,7 @@ class PIDController:
             self._times.popleft()
 
         # Approximate the integral term using a trapezoid rule approximation
-        integral = integrate.trapz(self._errors, dx=1)
+        integral = trapezoid(self._errors, dx=1)
         integral = clip(integral, bounds=self._integral_bounds)
 
         # Approximate the derivative term using the average over the window
@@ -72,6 +75,23 @@ class PIDController:
 
         return self.plant_function(y_true, y_pred, control_error)
 
+    def observe(self, y_true: Tuple[float, float], y_pred: np.ndarray, times: np.ndarray):
+        """
+        Records the errors of several steps without computing the control signals. This matches calling
+        step() on each element and ignoring the outputs.
+        """
+        lower, upper = y_true
+        errors = np.where(y_pred < lower - SMALL_NUMBER, lower - y_pred, np.where(y_pred > upper + SMALL_NUMBER, upper - y_pred, 0.0))
+
+        self._errors.extend(errors.tolist())
+        self._times.extend(times.tolist())
+
+        while len(self._errors) > self._integral_window:
+            self._errors.popleft()
+
+        while len(self._times) > self._integral_window:
+            self._times.popleft()
+
     def reset(self):
         """
         Resets the PI Controller.
@@ -182,3 +202,17 @@ class BudgetDistribution:
         self._observed_power.append((level, power))
         if len(self._observed_power) > POWER_WINDOW:
             self._observed_power.popleft()
+
+    def update_batch(self, labels: np.ndarray, levels: np.ndarray, powers: np.ndarray):
+        """
+        Updates the distribution with several samples. This matches calling update() on each sample in order.
+        """
+        # Unbuffered additions apply repeated indices in order
+        np.add.at(self._observed_label_counts, labels, 1)
+
+        for label in np.unique(labels):
+            np.add.at(self._prior_counts[label], levels[labels == label], 1)
+
+        self._observed_power.extend(zip(levels.tolist(), powers.tolist()))
+        while len(self._observed_power) > POWER_WINDOW:
+            self._observed_power.popleft()
@@ -16,6 +16,7 @@ from models.adaptive_model import AdaptiveModel
 from models.tf_model import TFModel
 from utils.file_utils import extract_model_name
 from utils.loading_utils import get_hyperparameters
+from utils.profiling import timed
 from utils.constants import INPUTS, OUTPUT, SEQ_LENGTH, NUM_CLASSES, SEQ_LENGTH, SMALL_NUMBER
 
 
@@ -120,6 +121,26 @@ class RuntimeSystem:
     def system_type(self) -> SystemType:
         return self._system_type
 
+    @property
+    def valid_results(self) -> ModelResults:
+        return self._valid_results
+
+    @property
+    def test_results(self) -> ModelResults:
+        return self._test_results
+
+    def get_config(self) -> Dict[str, Any]:
+        """
+        Returns the arguments (other than the model results) needed to re-create this system.
+        """
+        return dict(system_type=self._system_type,
+                    model_path=self._model_path,
+                    dataset_folder=self._dataset_folder,
+                    num_classes=self._num_classes,
+                    num_levels=self._num_levels,
+                    seq_length=self._seq_length,
+                    power_system_type=self._power_system_type)
+
     def get_power(self) -> np.ndarray:
         assert self._budget_controller is not None, 'Must have a budget controller'
         return np.array(self._budget_controller.power)
@@ -214,6 +235,7 @@ class RuntimeSystem:
         self._target_budgets: List[float] = []
         self._levels: List[int] = []
 
+    @timed('runtime.step')
     def step(self, budget: float, power_noise: float, t: int):
         assert self._budget_controller is not None, 'Must call init_for_budget() first'
         stop_probs = self._stop_probs[t] if self._stop_probs is not None and t < len(self._stop_probs) else None
@@ -253,6 +275,68 @@ class RuntimeSystem:
                 if is_end_of_window:
                     self._budget_step = budget_step
 
+    @timed('runtime.simulate')
+    def simulate(self, budget: float, noise: np.ndarray, max_time: int):
+        """
+        Runs the system on the first max_time test samples. The results match calling step() at each time
+        step, but the samples are processed in blocks. Systems without feedback use a single block. The
+        adaptive system only changes its budget at the end of each window, so it uses one block per window.
+
+        Args:
+            budget: The power budget
+            noise: A [max_time] array of the noise on the power readings
+            max_time: The number of time steps
+        """
+        self.init_for_budget(budget=budget, max_time=max_time)
+
+        block_size = WINDOW_SIZE if self._system_type == SystemType.ADAPTIVE else max_time
+        for start in range(0, max_time, block_size):
+            end = min(start + block_size, max_time)
+            self._step_block(budget=budget, noise=noise[start:end], start_time=start)
+
+    def _step_block(self, budget: float, noise: np.ndarray, start_time: int):
+        num_samples = noise.shape[0]
+        end_time = start_time + num_samples
+
+        stop_probs = self._stop_probs[start_time:end_time] if self._stop_probs is not None else None
+        start_energy = self._budget_controller.get_consumed_energy()
+
+        budget += self._budget_step
+        pred, has_pred, levels, power = self._budget_controller.predict_batch(stop_probs=stop_probs,
+                                                                              start_time=start_time,
+                                                                              budget=budget,
+                                                                              noise=noise)
+        labels = self._labels[start_time:end_time].reshape(-1)
+        is_correct = np.logical_and(has_pred, np.abs(labels - pred) < SMALL_NUMBER).astype(float)
+
+        self._num_correct.extend(is_correct.tolist())
+        self._target_budgets.extend([budget] * num_samples)
+        self._levels.extend(levels.tolist())
+
+        # Update the adaptive controller parameters
+        if self._system_type != SystemType.ADAPTIVE:
+            return
+
+        self._budget_distribution.update_batch(labels=pred[has_pred], levels=levels[has_pred], powers=power[has_pred])
+
+        times = np.arange(start_time, end_time)
+        power_so_far = np.cumsum(np.concatenate([[start_energy], power]))[1:] / (times + 1)
+
+        # The PID controller only sets the budget step at the end of the window. The earlier steps only update its state.
+        is_end_of_window = end_time % WINDOW_SIZE == 0
+        num_observed = num_samples - 1 if is_end_of_window else num_samples
+
+        pid_mask = times[:num_observed] >= WINDOW_SIZE - 1
+        self._pid_controller.observe(y_true=self._current_budget,
+                                     y_pred=power_so_far[:num_observed][pid_mask],
+                                     times=times[:num_observed][pid_mask])
+
+        if is_end_of_window:
+            self._current_budget = self._budget_distribution.get_budget(end_time)
+
+            if end_time >= WINDOW_SIZE:
+                self._budget_step = self._pid_controller.step(y_true=self._current_budget, y_pred=power_so_far[-1], time=end_time - 1)
+
     def estimate_validation_results(self, budget: float, max_time: int) -> Tuple[float, float]:
         assert self._controller is not None, 'Must have an internal controller'
         assert isinstance(self._controller, AdaptiveController), 'Can only estimate validation results for adaptive controllers'
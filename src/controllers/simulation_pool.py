@@ -0,0 +1,155 @@
+"""
+Process pool for running simulations in parallel. The model results of the runtime systems are written once
+to memory-mapped files, so the workers share them without copying. Each worker re-creates the runtime
+systems, and tasks run on the worker's systems. Simulations seed all randomness (the noise traces and the
+randomized controllers) when they start, so the results do not depend on which worker runs a task or in which order.
+"""
+import multiprocessing
+import os.path
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from controllers.controller_utils import ModelResults
+from controllers.power_utils import PowerType
+from controllers.runtime_system import RuntimeSystem, SystemType
+from utils.resource_utils import init_pool_worker
+
+
+ResultPaths = Dict[str, Optional[str]]
+
+# Runtime systems of this (worker) process, in the same order as in the parent
+_worker_systems: List[RuntimeSystem] = []
+
+
+def _save_results(results: ModelResults, folder: str, prefix: str) -> ResultPaths:
+    paths: ResultPaths = dict()
+    for field, array in zip(results._fields, results):
+        if array is None:
+            paths[field] = None
+            continue
+
+        path = os.path.join(folder, '{0}-{1}.npy'.format(prefix, field))
+        np.save(path, np.asarray(array))
+        paths[field] = path
+
+    return paths
+
+
+def _load_results(paths: ResultPaths) -> ModelResults:
+    return ModelResults(**{field: (np.load(path, mmap_mode='r') if path is not None else None) for field, path in paths.items()})
+
+
+def _init_simulation_worker(system_specs: List[Tuple[Dict[str, Any], ResultPaths, ResultPaths]],
+                            counter: Any,
+                            num_workers: int,
+                            intra_op_threads: Optional[int],
+                            inter_op_threads: int,
+                            policy_name: str):
+    init_pool_worker(counter=counter,
+                     num_workers=num_workers,
+                     intra_op_threads=intra_op_threads,
+                     inter_op_threads=inter_op_threads,
+                     policy_name=policy_name)
+
+    # Systems which share results in the parent also share the loaded results
+    loaded: Dict[str, ModelResults] = dict()
+
+    for config, valid_paths, test_paths in system_specs:
+        for paths in (valid_paths, test_paths):
+            key = paths['predictions']
+            if key not in loaded:
+                loaded[key] = _load_results(paths)
+
+        config = dict(config)
+        config['system_type'] = SystemType[config['system_type']]
+        config['power_system_type'] = PowerType[config['power_system_type']]
+
+        system = RuntimeSystem(valid_results=loaded[valid_paths['predictions']],
+                               test_results=loaded[test_paths['predictions']],
+                               **config)
+        _worker_systems.append(system)
+
+
+def _run_task(func: Callable[..., Any], args: Tuple[Any, ...]) -> Any:
+    return func(_worker_systems, *args)
+
+
+class SimulationPool:
+    """
+    Runs tasks on copies of the given runtime systems. Each task is a function taking the list of runtime systems
+    (in the given order) followed by the task arguments. The function must be defined at the top level of a module.
+    With a single worker, tasks run in this process on the given systems.
+    """
+
+    def __init__(self,
+                 runtime_systems: List[RuntimeSystem],
+                 num_workers: int,
+                 intra_op_threads: Optional[int] = None,
+                 inter_op_threads: int = 1,
+                 placement: str = 'compact'):
+        assert num_workers > 0, 'Must provide a positive number of workers'
+
+        self._runtime_systems = runtime_systems
+        self._num_workers = num_workers
+        self._intra_op_threads = intra_op_threads
+        self._inter_op_threads = inter_op_threads
+        self._placement = placement
+
+        self._data_folder: Optional[tempfile.TemporaryDirectory] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> 'SimulationPool':
+        if self._num_workers <= 1:
+            return self
+
+        self._data_folder = tempfile.TemporaryDirectory(prefix='simulation-results-')
+
+        # Write each set of results once, even when several systems share it
+        saved: Dict[int, ResultPaths] = dict()
+        system_specs: List[Tuple[Dict[str, Any], ResultPaths, ResultPaths]] = []
+
+        for system in self._runtime_systems:
+            for results in (system.valid_results, system.test_results):
+                if id(results) not in saved:
+                    saved[id(results)] = _save_results(results, folder=self._data_folder.name, prefix='results-{0}'.format(len(saved)))
+
+            # Enums are sent by name. Some scripts import the controller modules under a different name, and
+            # their enum members do not compare equal to those of the workers.
+            config = system.get_config()
+            config['system_type'] = config['system_type'].name
+            config['power_system_type'] = config['power_system_type'].name
+
+            system_specs.append((config, saved[id(system.valid_results)], saved[id(system.test_results)]))
+
+        # Use spawned processes to avoid forking an initialized Tensorflow runtime
+        mp_context = multiprocessing.get_context('spawn')
+
+        self._executor = ProcessPoolExecutor(max_workers=self._num_workers,
+                                             mp_context=mp_context,
+                                             initializer=_init_simulation_worker,
+                                             initargs=(system_specs, mp_context.Value('i', 0), self._num_workers, self._intra_op_threads, self._inter_op_threads, self._placement))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        if self._data_folder is not None:
+            self._data_folder.cleanup()
+            self._data_folder = None
+
+    def map(self, func: Callable[..., Any], tasks: List[Tuple[Any, ...]]) -> Iterator[Any]:
+        """
+        Runs func(runtime_systems, *args) for each tuple of arguments. The results are yielded in the order of the tasks.
+        """
+        if self._executor is None:
+            for args in tasks:
+                yield func(self._runtime_systems, *args)
+            return
+
+        futures = [self._executor.submit(_run_task, func, args) for args in tasks]
+        for future in futures:
+            yield future.result()
@@ -6,13 +6,15 @@ import time
 from argparse import ArgumentParser
 from collections import defaultdict, namedtuple
 from scipy import integrate
-from typing import Tuple, List, Union, Optional, Dict, Any, Set
+from typing import Tuple, List, Union, Optional, Dict, Any, Set, Iterable
 
 from controllers.runtime_system import RuntimeSystem, SystemType
 from controllers.controller_utils import execute_adaptive_model, execute_standard_model, concat_model_results, LOG_FILE_FMT
 from controllers.controller_utils import save_test_log, execute_skip_rnn_model, ModelResults, execute_phased_rnn_model
+from controllers.controller_utils import execute_models
 from controllers.noise_generators import get_noise_generator, NoiseGenerator
 from controllers.power_utils import PowerType
+from controllers.simulation_pool import SimulationPool
 from models.base_model import Model
 from models.model_factory import get_model
 from models.adaptive_model import AdaptiveModel
@@ -22,7 +24,9 @@ from dataset.dataset_factory import get_dataset
 from utils.hyperparameters import HyperParameters
 from utils.file_utils import extract_model_name, read_by_file_suffix, save_by_file_suffix, make_dir, iterate_files
 from utils.constants import SMALL_NUMBER, METADATA_PATH, HYPERS_PATH, SEQ_LENGTH, NUM_CLASSES
-from utils.loading_utils import restore_neural_network
+from utils.loading_utils import restore_neural_network, get_hyperparameters, make_dataset, make_model
+from utils.resource_utils import add_resource_args, configure_from_args
+from utils.profiling import add_profiling_args, configure_profiling_from_args
 
 
 SimulationResult = namedtuple('SimulationResult', ['accuracy', 'power', 'target_budgets', 'energy'])
@@ -44,7 +48,50 @@ def run_simulation(runtime_systems: List[RuntimeSystem], budget: float, max_time
         for system in runtime_systems:
             system.step(budget=budget, power_noise=power_noise, t=t)
 
-    # Create the final result
+    return get_simulation_results(runtime_systems, max_time=max_time), noise_terms
+
+
+def run_batched_simulation(runtime_systems: List[RuntimeSystem], budgets: List[float], max_time: int, noise_generator: NoiseGenerator) -> Iterable[Tuple[float, Dict[str, SimulationResult], List[float]]]:
+    """
+    Simulates each system on each budget. The results match run_simulation(), but each system processes the
+    samples in blocks (see RuntimeSystem.simulate()). The results of each budget are yielded before moving to the
+    next budget because the systems only hold the state of one budget.
+    """
+    # The noise trace does not depend on the budget
+    noise_terms = [noise_generator.get_noise(t=t) for t in range(max_time)]
+    noise = np.array(noise_terms)
+
+    for budget in budgets:
+        for system in runtime_systems:
+            system.simulate(budget=budget, noise=noise, max_time=max_time)
+
+        yield budget, get_simulation_results(runtime_systems, max_time=max_time), noise_terms
+
+
+def simulate_cell(runtime_systems: List[RuntimeSystem], budget: float, max_time: int, noise_generator: NoiseGenerator) -> Tuple[Dict[str, SimulationResult], List[float]]:
+    """
+    Simulates the systems on a single (noise generator, budget) cell.
+    """
+    _, result, noise_terms = next(run_batched_simulation(runtime_systems=runtime_systems,
+                                                         budgets=[budget],
+                                                         max_time=max_time,
+                                                         noise_generator=noise_generator))
+    return result, noise_terms
+
+
+def run_simulation_sweep(pool: SimulationPool, budgets: List[float], noise_generators: List[NoiseGenerator], max_time: int) -> Iterable[Tuple[NoiseGenerator, float, Dict[str, SimulationResult], List[float]]]:
+    """
+    Simulates every (noise generator, budget) cell using the given pool. The results are yielded in the order
+    of the noise generators and then the budgets.
+    """
+    cells = [(noise_generator, budget) for noise_generator in noise_generators for budget in budgets]
+    cell_results = pool.map(simulate_cell, [(budget, max_time, noise_generator) for noise_generator, budget in cells])
+
+    for (noise_generator, budget), (result, noise_terms) in zip(cells, cell_results):
+        yield noise_generator, budget, result, noise_terms
+
+
+def get_simulation_results(runtime_systems: List[RuntimeSystem], max_time: int) -> Dict[str, SimulationResult]:
     times = np.arange(max_time) + 1
     result: Dict[str, SimulationResult] = dict()
 
@@ -57,7 +104,7 @@ def run_simulation(runtime_systems: List[RuntimeSystem], budget: float, max_time
                                          target_budgets=system.get_target_budgets())
         result[system.name] = system_result
 
-    return result, noise_terms
+    return result
 
 
 def moving_avg_power(energy: np.ndarray, window: int) -> np.ndarray:
@@ -177,23 +224,30 @@ def create_multi_model_systems(folder: str, model_type: str, power_system_type:
 
     runtime_systems: List[RuntimeSystem] = []
 
-    valid_results: List[ModelResults] = []
-    test_results: List[ModelResults] = []
-    model_paths: List[str] = []
-    for model_path in iterate_files(folder, pattern=r'model-{0}-.*model_best\.pkl\.gz'.format(model_type)):
-        model, dataset = restore_neural_network(model_path, dataset_folder=dataset_folder)
+    model_paths = list(iterate_files(folder, pattern=r'model-{0}-.*model_best\.pkl\.gz'.format(model_type)))
+    assert len(model_paths) > 0, 'No {0} models in {1}'.format(model_type, folder)
 
-        if model_type == 'SKIP_RNN':
-            valid_result = execute_skip_rnn_model(model, dataset, series=DataSeries.VALID)
-            test_result = execute_skip_rnn_model(model, dataset, series=DataSeries.TEST)
-        else:
-            valid_result = execute_phased_rnn_model(model, dataset, series=DataSeries.VALID)
-            test_result = execute_phased_rnn_model(model, dataset, series=DataSeries.TEST)
+    # All models share one dataset, so each series is read (and tensorized) once for all models
+    models: List[Model] = []
+    dataset: Optional[Dataset] = None
+    for model_path in model_paths:
+        save_folder, model_file = os.path.split(model_path)
+        model_name = extract_model_name(model_file)
+        hypers = get_hyperparameters(model_path)
+
+        if dataset is None:
+            dataset = make_dataset(model_name, save_folder, hypers.dataset_type, dataset_folder)
 
-        valid_results.append(valid_result)
-        test_results.append(test_result)
+        models.append(make_model(model_name, hypers, save_folder))
 
-        model_paths.append(model_path)
+    kind = model_type.lower()
+    valid_results = execute_models(models, dataset, series=DataSeries.VALID, kind=kind)
+    test_results = execute_models(models, dataset, series=DataSeries.TEST, kind=kind)
+
+    for model in models:
+        model.sess.close()
+
+    dataset.close()
 
     # Concatenate the results from each model
     test_results_concat = concat_model_results(test_results)
@@ -240,8 +294,16 @@ if __name__ == '__main__':
     parser.add_argument('--skip-plotting', action='store_true')
     parser.add_argument('--save-plots', action='store_true')
     parser.add_argument('--baseline-to-plot', type=str, choices=['all', 'under_budget', 'max_accuracy'], default='all')
+    parser.add_argument('--step-wise', action='store_true', help='Simulate one time step at a time instead of in blocks.')
+    parser.add_argument('--sim-workers', type=int, default=1, help='Number of processes used to simulate the (noise, budget) cells.')
+    add_resource_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
 
+    # Pin the threads and cores when several processes share this host
+    configure_from_args(args)
+    configure_profiling_from_args(args)
+
     # Validate arguments
     budget_start, budget_end, budget_step = args.budget_start, args.budget_end, args.budget_step
     assert budget_start > 0, 'Must have a positive budget'
@@ -371,29 +433,42 @@ if __name__ == '__main__':
     # Max time equals the number of test samples
     max_time = dataset.dataset[DataSeries.TEST].length
 
+    # Create the noise generators for the given parameters
+    noise_generators: List[NoiseGenerator] = []
     for noise_params_path in args.noise_params:
         noise_params = read_by_file_suffix(noise_params_path)
-
-        # Create the noise generator for the given parameters
-        for noise_generator in get_noise_generator(noise_params=noise_params, max_time=max_time):
-
-            # Run the simulation on each budget
-            for budget in sorted(budgets):
-                print('===== Starting budget: {0:.4f} ====='.format(budget))
-
-                result, noise_terms = run_simulation(runtime_systems=runtime_systems,
-                                                     max_time=max_time,
-                                                     noise_generator=noise_generator,
-                                                     budget=budget)
-
-                plot_and_save(sim_results=result,
-                              runtime_systems=runtime_systems,
-                              budget=budget,
-                              max_time=max_time,
-                              noise_generator=noise_generator,
-                              noise_terms=noise_terms,
-                              output_folder=args.output_folder,
-                              should_plot=not args.skip_plotting,
-                              save_plots=args.save_plots,
-                              power_system_type=power_system_type,
-                              baseline_to_plot=args.baseline_to_plot)
+        noise_generators.extend(get_noise_generator(noise_params=noise_params, max_time=max_time))
+
+    with SimulationPool(runtime_systems=runtime_systems,
+                        num_workers=args.sim_workers if not args.step_wise else 1,
+                        intra_op_threads=args.intra_op_threads,
+                        inter_op_threads=args.inter_op_threads,
+                        placement=args.placement) as pool:
+
+        if args.step_wise:
+            sweep_results = ((noise_generator, budget) + run_simulation(runtime_systems=runtime_systems,
+                                                                        max_time=max_time,
+                                                                        noise_generator=noise_generator,
+                                                                        budget=budget)
+                             for noise_generator in noise_generators for budget in sorted(budgets))
+        else:
+            sweep_results = run_simulation_sweep(pool=pool,
+                                                 budgets=sorted(budgets),
+                                                 noise_generators=noise_generators,
+                                                 max_time=max_time)
+
+        # The logs and plots are written by this process only
+        for noise_generator, budget, result, noise_terms in sweep_results:
+            print('===== Finished budget: {0:.4f} ====='.format(budget))
+
+            plot_and_save(sim_results=result,
+                          runtime_systems=runtime_systems,
+                          budget=budget,
+                          max_time=max_time,
+                          noise_generator=noise_generator,
+                          noise_terms=noise_terms,
+                          output_folder=args.output_folder,
+                          should_plot=not args.skip_plotting,
+                          save_plots=args.save_plots,
+                          power_system_type=power_system_type,
+                          baseline_to_plot=args.baseline_to_plot)
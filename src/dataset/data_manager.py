@@ -1,11 +1,12 @@
 import numpy as np
 import os
 
-from collections import Counter
-from typing import Iterable, List, Any, Dict, Optional
+from collections import Counter, defaultdict
+from typing import Iterable, List, Any, Dict, Optional, Callable
 
 from utils.constants import DATA_FIELD_FORMAT, INDEX_FILE
 from utils.file_utils import read_by_file_suffix, iterate_files
+from utils.profiling import timed
 
 
 class DataManager:
@@ -62,6 +63,33 @@ class DataManager:
     def iterate(self, should_shuffle: bool, batch_size: int) -> Iterable[Dict[str, Any]]:
         raise NotImplementedError()
 
+    @timed('data.read_arrays')
+    def read_arrays(self, should_include: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Dict[str, np.ndarray]:
+        """
+        Reads all samples (in order) into one array per field. The first dimension
+        of each array indexes the samples.
+
+        Args:
+            should_include: Optional predicate over raw samples. Samples for which it returns False
+                are skipped before the fields are stacked.
+        Returns:
+            A dictionary mapping each field to the array of its values.
+        """
+        if not self.is_loaded:
+            self.load()
+
+        fields = [self.sample_id_name] + self._fields
+
+        values: Dict[str, List[Any]] = defaultdict(list)
+        for sample in self.iterate(should_shuffle=False, batch_size=max(self.length, 1)):
+            if should_include is not None and not should_include(sample):
+                continue
+
+            for field in fields:
+                values[field].append(sample.get(field))
+
+        return {field: np.array(values[field]) for field in fields}
+
 
 class InMemoryDataManager(DataManager):
 
@@ -71,6 +99,7 @@ class InMemoryDataManager(DataManager):
         self._dataset: List[Dict[str, Any]] = []
         self._ids: List[int] = []
 
+    @timed('data.load')
     def load(self):
         if self.is_loaded:
             return  # Prevent double loading
@@ -88,6 +117,7 @@ class InMemoryDataManager(DataManager):
         assert self.is_loaded, 'Must load the data before shuffling.'
         np.random.shuffle(self._ids)
 
+    @timed('data.iterate')
     def iterate(self, should_shuffle: bool, batch_size: int) -> Iterable[Dict[str, Any]]:
         assert self.is_loaded, 'Must load the data before iterating.'
 
@@ -115,6 +145,7 @@ class NpzDataManager(DataManager):
         self._ids: List[int] = []
         self._index: Dict[int, int] = dict()
 
+    @timed('data.load')
     def load(self):
         # Prevent double-loading the dataset
         if self.is_loaded:
@@ -172,6 +203,7 @@ class NpzDataManager(DataManager):
 
         return len(self._array_lengths) - 1
 
+    @timed('data.iterate')
     def iterate(self, should_shuffle: bool, batch_size: int) -> Iterable[Dict[str, Any]]:
         assert self._is_loaded, 'Must load the data before iterating'
 
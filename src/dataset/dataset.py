@@ -1,11 +1,16 @@
 import numpy as np
+import hashlib
+import os
+import pickle
 import re
+import shutil
 from enum import Enum, auto
-from typing import Union, Dict, Any, DefaultDict, List, Generator, Iterable
+from typing import Union, Dict, Any, DefaultDict, List, Generator, Iterable, Optional, Tuple, Callable
 from collections import defaultdict
 from more_itertools import ichunked
 
-from utils.constants import SAMPLE_ID, DATA_FIELDS, OUTPUT
+from utils.constants import SAMPLE_ID, DATA_FIELDS, OUTPUT, EVAL_CACHE_PATH
+from utils.profiling import timed, increment, get_profiler
 from .data_manager import get_data_manager
 
 
@@ -20,7 +25,7 @@ DEFAULT_BATCH_SIZE = 100
 
 class Dataset:
 
-    def __init__(self, train_folder: str, valid_folder: str, test_folder: str):
+    def __init__(self, train_folder: str, valid_folder: str, test_folder: str, cache_folder: Optional[str] = None):
         self.data_folders = {
                 DataSeries.TRAIN: train_folder,
                 DataSeries.VALID: valid_folder,
@@ -39,9 +44,152 @@ class Dataset:
             DataSeries.TEST: get_data_manager(self.data_folders[DataSeries.TEST], SAMPLE_ID, DATA_FIELDS)
         }
 
+        # Tensorized evaluation series keyed by (series, data and metadata fingerprint). When a cache
+        # folder is given, the tensors are also stored on disk and loaded as memory-mapped arrays.
+        self._cache_folder = cache_folder
+        self._eval_cache: Dict[Tuple[DataSeries, str], Dict[str, np.ndarray]] = dict()
+
     def tensorize(self, sample: Dict[str, Any], metadata: Dict[str, Any], is_train: bool) -> Dict[str, np.ndarray]:
         pass
 
+    def copy(self) -> 'Dataset':
+        """
+        Returns a new dataset over the same folders. The copy has its own data managers and evaluation
+        cache, so it can be read from another thread while this dataset is in use.
+        """
+        return type(self)(self.data_folders[DataSeries.TRAIN],
+                          self.data_folders[DataSeries.VALID],
+                          self.data_folders[DataSeries.TEST],
+                          cache_folder=self._cache_folder)
+
+    def fingerprint(self, series: DataSeries) -> str:
+        """
+        Returns a fingerprint of the data files in the given series. The fingerprint uses the file
+        names, sizes and modification times, so it changes whenever the underlying data changes.
+        """
+        folder = self.data_folders[series]
+
+        hasher = hashlib.sha1()
+        hasher.update(type(self).__name__.encode('utf-8'))
+
+        for file_name in sorted(os.listdir(folder)):
+            stat = os.stat(os.path.join(folder, file_name))
+            hasher.update('{0}:{1}:{2};'.format(file_name, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+
+        return hasher.hexdigest()
+
+    def eval_cache_key(self, series: DataSeries, metadata: Dict[str, Any]) -> str:
+        """
+        Returns the key of the tensorized series. The key changes with either the data files
+        or the metadata (e.g. scalers and label maps) used during tensorization.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(self.fingerprint(series).encode('utf-8'))
+        hasher.update(pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL))
+        return hasher.hexdigest()
+
+    @timed('dataset.tensorize_series')
+    def tensorize_series(self, series: DataSeries, metadata: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """
+        Returns all (valid) tensorized samples in the given evaluation series, stacked into arrays. The
+        arrays are computed once per (series, metadata) and reused by later calls.
+
+        Args:
+            series: The series to tensorize. Must be an evaluation series.
+            metadata: Metadata used during tensorization
+        Returns:
+            A dictionary mapping each field to an array with one entry per sample.
+        """
+        assert series != DataSeries.TRAIN, 'Can only cache evaluation series'
+
+        cache_key = (series, self.eval_cache_key(series, metadata))
+        if cache_key in self._eval_cache:
+            return self._eval_cache[cache_key]
+
+        cache_path = None
+        if self._cache_folder is not None:
+            cache_path = os.path.join(self._cache_folder, EVAL_CACHE_PATH.format(series.name.lower(), cache_key[1]))
+
+        if cache_path is not None and os.path.exists(cache_path):
+            tensors = self._load_cached_tensors(cache_path)
+        else:
+            tensors = self._tensorize_all(series, metadata)
+
+            if cache_path is not None:
+                self._save_cached_tensors(tensors, cache_path)
+                tensors = self._load_cached_tensors(cache_path)
+
+        self._eval_cache[cache_key] = tensors
+        return tensors
+
+    def _tensorize_all(self, series: DataSeries, metadata: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        data_series = self.dataset[series]
+        if not data_series.is_loaded:
+            data_series.load()
+
+        tensorize = self._get_tensorize_fn()
+
+        samples: DefaultDict[str, List[Any]] = defaultdict(list)
+        for sample in data_series.iterate(should_shuffle=False, batch_size=DEFAULT_BATCH_SIZE):
+            tensorized_sample = tensorize(sample, metadata, is_train=False)
+
+            if self.is_valid_sample(tensorized_sample):
+                for key, tensor in tensorized_sample.items():
+                    samples[key].append(tensor)
+
+        return {key: np.array(tensors) for key, tensors in samples.items()}
+
+    def _get_tensorize_fn(self) -> Callable[..., Dict[str, np.ndarray]]:
+        # Check for the profiler once per pass instead of once per sample, so unprofiled runs skip the timer entirely
+        if get_profiler() is None:
+            return self.tensorize
+
+        return timed('dataset.tensorize')(self.tensorize)
+
+    def _save_cached_tensors(self, tensors: Dict[str, np.ndarray], cache_path: str):
+        # Write to a temporary folder and rename so readers never observe a partial cache
+        temp_path = '{0}.tmp-{1}'.format(cache_path, os.getpid())
+        os.makedirs(temp_path, exist_ok=True)
+
+        for key, array in tensors.items():
+            np.save(os.path.join(temp_path, '{0}.npy'.format(key)), array, allow_pickle=(array.dtype == object))
+
+        try:
+            os.rename(temp_path, cache_path)
+        except OSError:
+            # Another process already wrote the same cache
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def _load_cached_tensors(self, cache_path: str) -> Dict[str, np.ndarray]:
+        tensors: Dict[str, np.ndarray] = dict()
+        for file_name in os.listdir(cache_path):
+            key = file_name[:-len('.npy')]
+
+            # Object arrays (e.g. string ids) cannot be memory-mapped
+            array = np.load(os.path.join(cache_path, file_name), mmap_mode='r')
+            if array.dtype == object:
+                array = np.load(os.path.join(cache_path, file_name), allow_pickle=True)
+
+            tensors[key] = array
+
+        return tensors
+
+    def is_valid_sample(self, tensorized_sample: Dict[str, Any]) -> bool:
+        """
+        Returns whether the tensorized sample contains no NoneType or NaN values.
+        """
+        for tensor in tensorized_sample.values():
+            if isinstance(tensor, list) or isinstance(tensor, np.ndarray):
+                tensor_array = np.array(tensor)
+
+                if np.any(np.isnan(tensor_array)) or np.any(tensor_array == None):
+                    return False
+            else:
+                if tensor is None or np.isnan(tensor):
+                    return False
+
+        return True
+
     def process_raw_sample(self, raw_sample: Dict[str, Any]) -> Dict[str, Any]:
         """
         Transforms a raw sample into a data sample to be fed into the model.
@@ -64,6 +212,14 @@ class Dataset:
 
         return data_series.iterate(should_shuffle=False, batch_size=DEFAULT_BATCH_SIZE)
 
+    def read_series(self, series: DataSeries, should_include: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Dict[str, np.ndarray]:
+        """
+        Returns the raw (untensorized) samples of the given series as one array per field.
+        Samples rejected by the optional should_include predicate are skipped.
+        """
+        return self.dataset[series].read_arrays(should_include=should_include)
+
+    @timed('dataset.minibatch')
     def minibatch_generator(self,
                             series: DataSeries,
                             batch_size: int,
@@ -84,6 +240,15 @@ class Dataset:
         Returns:
             A generator a feed dicts, each one representing an entire minibatch.
         """
+        # Evaluation series do not use any randomness, so we tensorize them once and slice the result
+        if series != DataSeries.TRAIN:
+            yield from self._cached_minibatch_generator(series=series,
+                                                        batch_size=batch_size,
+                                                        metadata=metadata,
+                                                        should_shuffle=should_shuffle,
+                                                        drop_incomplete_batches=drop_incomplete_batches)
+            return
+
         data_series = self.dataset[series]
 
         # Load dataset if needed
@@ -92,9 +257,7 @@ class Dataset:
 
         # Create iterator over the data
         data_iterator = data_series.iterate(should_shuffle=should_shuffle, batch_size=batch_size)
-
-        # Set training flag
-        is_train = series == DataSeries.TRAIN
+        tensorize = self._get_tensorize_fn()
 
         # Generate minibatches
         for minibatch in ichunked(data_iterator, batch_size):
@@ -102,25 +265,10 @@ class Dataset:
             feed_dict: DefaultDict[str, List[Any]] = defaultdict(list)
             num_samples = 0
             for sample in minibatch:
-                tensorized_sample = self.tensorize(sample, metadata, is_train=is_train)
-
-                # Ensure that there are no NoneType or NaN values in the tensorized sample
-                should_include = True
-                for tensor in tensorized_sample.values():
-                    if isinstance(tensor, list) or isinstance(tensor, np.ndarray):
-                        tensor_array = np.array(tensor)
-
-                        if np.any(np.isnan(tensor_array)) or np.any(tensor_array == None):
-                            should_include = False
-                    else:
-                        if tensor is None or np.isnan(tensor):
-                            should_include = False
-
-                    if not should_include:
-                        break
+                tensorized_sample = tensorize(sample, metadata, is_train=True)
 
                 # Only include validated samples
-                if should_include:
+                if self.is_valid_sample(tensorized_sample):
                     for key, tensor in tensorized_sample.items():
                         feed_dict[key].append(tensor)
                     num_samples += 1
@@ -128,8 +276,34 @@ class Dataset:
             if drop_incomplete_batches and num_samples < batch_size:
                 continue
 
+            increment('dataset.samples', num_samples)
+            yield feed_dict
+
+    def _cached_minibatch_generator(self,
+                                    series: DataSeries,
+                                    batch_size: int,
+                                    metadata: Dict[str, Any],
+                                    should_shuffle: bool,
+                                    drop_incomplete_batches: bool) -> Generator[DefaultDict[str, np.ndarray], None, None]:
+        tensors = self.tensorize_series(series, metadata)
+        num_samples = len(tensors[OUTPUT]) if OUTPUT in tensors else 0
+
+        indices = np.random.permutation(num_samples) if should_shuffle else None
+
+        for start in range(0, num_samples, batch_size):
+            end = min(start + batch_size, num_samples)
+            if drop_incomplete_batches and end - start < batch_size:
+                continue
+
+            feed_dict: DefaultDict[str, np.ndarray] = defaultdict(list)
+            for key, array in tensors.items():
+                feed_dict[key] = array[start:end] if indices is None else array[indices[start:end]]
+
+            increment('dataset.samples', end - start)
             yield feed_dict
 
     def close(self):
         for data_series in self.dataset.values():
             data_series.close()
+
+        self._eval_cache = dict()
@@ -1,4 +1,5 @@
 import os.path
+from typing import Optional
 
 from utils.constants import TRAIN, VALID, TEST
 from .dataset import Dataset
@@ -6,10 +7,11 @@ from .sequence_dataset import SequenceDataset
 from .single_dataset import SingleDataset
 
 
-def get_dataset(dataset_type: str, data_folder: str) -> Dataset:
+def get_dataset(dataset_type: str, data_folder: str, cache_folder: Optional[str] = None) -> Dataset:
     """
     Creates a dataset of the given type with the given base folder.
-    This factory infers the training, validation and test folders.
+    This factory infers the training, validation and test folders. Tensorized evaluation
+    series are stored in the (optional) cache folder.
     """
     dataset_type = dataset_type.lower()
 
@@ -19,8 +21,8 @@ def get_dataset(dataset_type: str, data_folder: str) -> Dataset:
     test_folder = os.path.join(data_folder, TEST)
 
     if dataset_type in ('standard', 'sequence'):
-        return SequenceDataset(train_folder, valid_folder, test_folder)
+        return SequenceDataset(train_folder, valid_folder, test_folder, cache_folder=cache_folder)
     elif dataset_type == 'single':
-        return SingleDataset(train_folder, valid_folder, test_folder)
+        return SingleDataset(train_folder, valid_folder, test_folder, cache_folder=cache_folder)
     else:
         raise ValueError(f'Unknown dataset type: {dataset_type}')
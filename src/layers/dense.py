@@ -1,7 +1,7 @@
 import tensorflow as tf
 from typing import Optional, List, Union, Any, Tuple
 
-from utils.tfutils import get_activation, apply_noise
+from utils.tfutils import get_activation, apply_noise, apply_dropout
 
 
 def dense(inputs: tf.Tensor,
@@ -58,7 +58,7 @@ def dense(inputs: tf.Tensor,
     transformed = apply_noise(transformed, scale=activation_noise)
     
     if dropout_keep_rate is not None:
-        transformed = tf.nn.dropout(transformed, keep_prob=dropout_keep_rate)
+        transformed = apply_dropout(transformed, keep_rate=dropout_keep_rate)
 
     return transformed, pre_activation
 
@@ -18,6 +18,7 @@ from utils.constants import STOP_OUTPUT_NAME, STOP_OUTPUT_LOGITS, STOP_PREDICTIO
 from utils.loss_utils import get_loss_weights, get_temperate_loss_weight
 from utils.sequence_model_utils import SequenceModelType, is_rnn, is_nbow, is_sample
 from utils.testing_utils import ClassificationMetric, RegressionMetric, get_binary_classification_metric, get_regression_metric, get_multi_classification_metric
+from utils.profiling import timed
 
 
 class AdaptiveModel(TFModel):
@@ -64,6 +65,7 @@ class AdaptiveModel(TFModel):
     def output_op_name(self) -> str:
         return self.prediction_op_name
 
+    @timed('model.batch_to_feed_dict')
     def batch_to_feed_dict(self, batch: Dict[str, List[Any]], is_train: bool, epoch_num: int) -> Dict[tf.Tensor, np.ndarray]:
         dropout = self.hypers.dropout_keep_rate if is_train else 1.0
         activation_noise = self.hypers.input_noise if is_train else 0.0
@@ -101,7 +103,7 @@ class AdaptiveModel(TFModel):
 
         return feed_dict
 
-    def make_placeholders(self, is_frozen: bool = False):
+    def make_placeholders(self, is_frozen: bool = False, is_inference: bool = False):
         """
         Create model placeholders.
         """
@@ -119,18 +121,27 @@ class AdaptiveModel(TFModel):
             self._placeholders[OUTPUT] = tf.placeholder(shape=[None, num_output_features],
                                                         dtype=output_dtype,
                                                         name=OUTPUT)
-            self._placeholders[DROPOUT_KEEP_RATE] = tf.placeholder(shape=[],
-                                                                   dtype=tf.float32,
-                                                                   name=DROPOUT_KEEP_RATE)
-            self._placeholders[LOSS_WEIGHTS] = tf.placeholder(shape=[self.num_outputs],
-                                                              dtype=tf.float32,
-                                                              name=LOSS_WEIGHTS)
-            self._placeholders[STOP_LOSS_WEIGHT] = tf.placeholder(shape=[],
-                                                                  dtype=tf.float32,
-                                                                  name=STOP_LOSS_WEIGHT)
-            self._placeholders[ACTIVATION_NOISE] = tf.placeholder(shape=[],
+
+            # Inference-only graphs never use dropout, noise or the loss weights. We hold these values
+            # as constants to allow Tensorflow to prune the corresponding operations.
+            if is_inference:
+                self._placeholders[DROPOUT_KEEP_RATE] = tf.constant(1.0, dtype=tf.float32, name=DROPOUT_KEEP_RATE)
+                self._placeholders[LOSS_WEIGHTS] = tf.ones(shape=[self.num_outputs], dtype=tf.float32, name=LOSS_WEIGHTS)
+                self._placeholders[STOP_LOSS_WEIGHT] = tf.constant(0.0, dtype=tf.float32, name=STOP_LOSS_WEIGHT)
+                self._placeholders[ACTIVATION_NOISE] = tf.constant(0.0, dtype=tf.float32, name=ACTIVATION_NOISE)
+            else:
+                self._placeholders[DROPOUT_KEEP_RATE] = tf.placeholder(shape=[],
+                                                                       dtype=tf.float32,
+                                                                       name=DROPOUT_KEEP_RATE)
+                self._placeholders[LOSS_WEIGHTS] = tf.placeholder(shape=[self.num_outputs],
                                                                   dtype=tf.float32,
-                                                                  name=ACTIVATION_NOISE)
+                                                                  name=LOSS_WEIGHTS)
+                self._placeholders[STOP_LOSS_WEIGHT] = tf.placeholder(shape=[],
+                                                                      dtype=tf.float32,
+                                                                      name=STOP_LOSS_WEIGHT)
+                self._placeholders[ACTIVATION_NOISE] = tf.placeholder(shape=[],
+                                                                      dtype=tf.float32,
+                                                                      name=ACTIVATION_NOISE)
         else:
             self._placeholders[INPUTS] = tf.ones(shape=[1, self.seq_length] + list(input_features_shape), dtype=tf.float32, name=INPUTS)
             self._placeholders[OUTPUT] = tf.ones(shape=[1, num_output_features], dtype=output_dtype, name=OUTPUT)
@@ -38,7 +38,8 @@ class DecisionTreeModel(TraditionalModel):
         elif self.tree_type == DecisionTreeType.RANDOM_FOREST:
             self._model = RandomForestClassifier(n_estimators=self.hypers.model_params['num_estimators'],
                                                  criterion=self.hypers.model_params['criterion'],
-                                                 max_depth=self.hypers.model_params['max_depth'])
+                                                 max_depth=self.hypers.model_params['max_depth'],
+                                                 n_jobs=self.n_jobs)
         elif self.tree_type == DecisionTreeType.ADA_BOOST:
             base_estimator = DecisionTreeClassifier(criterion=self.hypers.model_params['criterion'],
                                                     max_depth=self.hypers.model_params['max_depth'])
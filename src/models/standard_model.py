@@ -19,6 +19,7 @@ from utils.constants import INPUT_SHAPE, NUM_OUTPUT_FEATURES, SEQ_LENGTH, DROPOU
 from utils.constants import EMBEDDING_NAME, TRANSFORM_NAME, AGGREGATION_NAME, OUTPUT_LAYER_NAME, RNN_NAME, SKIP_GATES, RNN_CELL_NAME
 from utils.testing_utils import ClassificationMetric, RegressionMetric, get_binary_classification_metric, get_regression_metric, get_multi_classification_metric
 from utils.loss_utils import binary_classification_loss, get_loss_weights
+from utils.profiling import timed
 from .base_model import Model
 
 
@@ -54,6 +55,7 @@ class StandardModel(TFModel):
             return int(self.metadata[NUM_CLASSES])
         return int(self.metadata[NUM_OUTPUT_FEATURES])
 
+    @timed('model.batch_to_feed_dict')
     def batch_to_feed_dict(self, batch: Dict[str, List[Any]], is_train: bool, epoch_num: int) -> Dict[tf.Tensor, np.ndarray]:
         dropout = self.hypers.dropout_keep_rate if is_train else 1.0
         activation_noise = self.hypers.input_noise if is_train else 0.0
@@ -79,7 +81,7 @@ class StandardModel(TFModel):
 
         return feed_dict
 
-    def make_placeholders(self, is_frozen: bool = False):
+    def make_placeholders(self, is_frozen: bool = False, is_inference: bool = False):
         input_features_shape = self.metadata[INPUT_SHAPE]
         num_output_features = self.metadata[NUM_OUTPUT_FEATURES]
         seq_length = self.metadata[SEQ_LENGTH]
@@ -94,17 +96,26 @@ class StandardModel(TFModel):
             self._placeholders[OUTPUT] = tf.placeholder(shape=(None, num_output_features),
                                                         dtype=output_dtype,
                                                         name=OUTPUT)
-            self._placeholders[DROPOUT_KEEP_RATE] = tf.placeholder(shape=(),
+
+            # Inference-only graphs hold the training inputs as constants
+            if is_inference:
+                self._placeholders[DROPOUT_KEEP_RATE] = tf.constant(1.0, dtype=tf.float32, name=DROPOUT_KEEP_RATE)
+                self._placeholders[ACTIVATION_NOISE] = tf.constant(0.0, dtype=tf.float32, name=ACTIVATION_NOISE)
+
+                if self.model_type == SequenceModelType.PHASED_RNN:
+                    self._placeholders[LEAK_RATE] = tf.constant(0.0, dtype=tf.float32, name=LEAK_RATE)
+            else:
+                self._placeholders[DROPOUT_KEEP_RATE] = tf.placeholder(shape=(),
+                                                                       dtype=tf.float32,
+                                                                       name=DROPOUT_KEEP_RATE)
+                self._placeholders[ACTIVATION_NOISE] = tf.placeholder(shape=(),
+                                                                      dtype=tf.float32,
+                                                                      name=ACTIVATION_NOISE)
+                # Phased RNNs have an extra leak rate placeholder
+                if self.model_type == SequenceModelType.PHASED_RNN:
+                    self._placeholders[LEAK_RATE] = tf.placeholder(shape=(),
                                                                    dtype=tf.float32,
-                                                                   name=DROPOUT_KEEP_RATE)
-            self._placeholders[ACTIVATION_NOISE] = tf.placeholder(shape=(),
-                                                                  dtype=tf.float32,
-                                                                  name=ACTIVATION_NOISE)
-            # Phased RNNs have an extra leak rate placeholder
-            if self.model_type == SequenceModelType.PHASED_RNN:
-                self._placeholders[LEAK_RATE] = tf.placeholder(shape=(),
-                                                               dtype=tf.float32,
-                                                               name=LEAK_RATE)
+                                                                   name=LEAK_RATE)
         else:
             self._placeholders[INPUTS] = tf.ones(shape=(1,) + input_shape[1:], dtype=tf.float32, name=INPUTS)
             self._placeholders[OUTPUT] = tf.ones(shape=(1, num_output_features), dtype=output_dtype, name=OUTPUT)
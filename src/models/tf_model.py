@@ -2,36 +2,122 @@ import tensorflow as tf
 import numpy as np
 import re
 import os
+import sys
 import gc
-from datetime import datetime
-from collections import defaultdict
-from typing import Optional, Iterable, Dict, Any, Union, List, DefaultDict, Set
+import hashlib
+import pickle
+from datetime import datetime, timedelta
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Iterable, Dict, Any, Union, List, DefaultDict, Set, Tuple
 from sklearn.preprocessing import StandardScaler
 
 from models.base_model import Model
 from dataset.dataset import Dataset, DataSeries
 from layers.output_layers import OutputType, is_classification
 from utils.hyperparameters import HyperParameters
-from utils.tfutils import get_optimizer, variables_for_loss_op
-from utils.file_utils import read_by_file_suffix, save_by_file_suffix, make_dir
+from utils.tfutils import get_optimizer, variables_for_loss_op, get_session_config, optimize_graph_def
+from utils.file_utils import read_by_file_suffix, save_by_file_suffix, make_dir, iterate_files
+from utils.checkpoint_utils import AsyncCheckpointWriter, atomic_save
+from utils.profiling import timed
 from utils.constants import BIG_NUMBER, NAME_FMT, HYPERS_PATH, GLOBAL_STEP
-from utils.constants import METADATA_PATH, MODEL_PATH, TRAIN_LOG_PATH
+from utils.constants import METADATA_PATH, MODEL_PATH, TRAIN_LOG_PATH, INFERENCE_GRAPH_PATH
+from utils.constants import TRAIN_STATE_PATH, TRAIN_CHECKPOINT_PATH
 from utils.constants import LOSS, ACCURACY, OPTIMIZER_OP, INPUTS, OUTPUT, SAMPLE_ID
 from utils.constants import TRAIN, VALID, LABEL_MAP, NUM_CLASSES, REV_LABEL_MAP
 from utils.constants import INPUT_SHAPE, NUM_OUTPUT_FEATURES, INPUT_SCALER, OUTPUT_SCALER
 from utils.constants import SEQ_LENGTH, DROPOUT_KEEP_RATE, MODEL, INPUT_NOISE, SMALL_NUMBER
 
 
+ValidationResult = namedtuple('ValidationResult', ['loss', 'accuracy', 'snapshot'])
+
+# Source folder and the (source-relative) modules which define the structure of the inference graph
+SOURCE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INFERENCE_GRAPH_SOURCES = ['layers', os.path.join('utils', 'tfutils.py')]
+
+
+class TrainProgress:
+    """
+    Tracks the early stopping state and the training logs.
+    """
+
+    def __init__(self, best_valid_metric: float, num_not_improved: int, loss_dict: DefaultDict[str, List[float]], acc_dict: DefaultDict[str, List[float]]):
+        self.best_valid_metric = best_valid_metric
+        self.num_not_improved = num_not_improved  # Number of epochs since the last improvement
+        self.loss_dict = loss_dict
+        self.acc_dict = acc_dict
+        self.has_improved = False  # Whether a validation improved during the current epoch
+
+
+class ConcurrentValidator:
+    """
+    Validates weight snapshots on a background thread using a separate copy of the model and its
+    own copy of the dataset, since the data managers are not thread-safe. At most one validation
+    is in flight, so training runs at most one validation behind.
+    """
+
+    def __init__(self, model: 'TFModel', dataset: Dataset):
+        self._model = model
+        self._dataset = dataset.copy()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future: Optional[Future] = None
+        self._snapshot: Optional[Dict[str, np.ndarray]] = None
+
+    def submit(self, snapshot: Dict[str, np.ndarray], epoch_num: int, drop_incomplete_batches: bool) -> Optional[ValidationResult]:
+        """
+        Starts validating the given snapshot. Returns the result of the previous validation (if any).
+        """
+        previous = self.wait()
+
+        self._snapshot = snapshot
+        self._future = self._executor.submit(self._validate, snapshot, epoch_num, drop_incomplete_batches)
+        return previous
+
+    def wait(self) -> Optional[ValidationResult]:
+        if self._future is None:
+            return None
+
+        valid_loss, valid_accuracy = self._future.result()
+        result = ValidationResult(loss=valid_loss, accuracy=valid_accuracy, snapshot=self._snapshot)
+
+        self._future = None
+        self._snapshot = None
+        return result
+
+    def close(self) -> Optional[ValidationResult]:
+        result = self.wait()
+        self._executor.shutdown()
+        self._model.sess.close()
+        self._dataset.close()
+        return result
+
+    def _validate(self, snapshot: Dict[str, np.ndarray], epoch_num: int, drop_incomplete_batches: bool) -> Tuple[float, float]:
+        self._model.load_variables(snapshot)
+        return self._model.validate(dataset=self._dataset, epoch_num=epoch_num, should_print=False, drop_incomplete_batches=drop_incomplete_batches)
+
+
 class TFModel(Model):
 
     def __init__(self, hyper_parameters: HyperParameters, save_folder: str, is_train: bool):
         super().__init__(hyper_parameters, save_folder, is_train)
 
-        self._sess = tf.Session(graph=tf.Graph())
+        self._sess = self._make_session()
 
         self._ops: Dict[str, tf.Tensor] = dict()
         self._placeholders: Dict[str, tf.Tensor] = dict()
         self._is_made = False
+        self._is_inference = False
+        self._restore_name: Optional[str] = None
+        self._saver: Optional[tf.train.Saver] = None
+
+        # Digests of the last data saved to each file
+        self._saved_digests: Dict[str, str] = dict()
+
+        # Values of the trainable variables at the best validation epoch
+        self._best_snapshot: Optional[Dict[str, np.ndarray]] = None
+
+        # Reusable assignment operations for loading variable values
+        self._load_ops: Optional[Dict[str, Tuple[tf.Tensor, tf.Operation]]] = None
 
         # Get the model output type
         self._output_type = OutputType[self.hypers.model_params['output_type'].upper()]
@@ -71,6 +157,18 @@ class TFModel(Model):
     def is_made(self) -> bool:
         return self._is_made
 
+    @property
+    def is_inference(self) -> bool:
+        return self._is_inference
+
+    @property
+    def restore_name(self) -> Optional[str]:
+        return self._restore_name
+
+    @property
+    def best_snapshot(self) -> Optional[Dict[str, np.ndarray]]:
+        return self._best_snapshot
+
     @property
     def trainable_vars(self) -> List[tf.Variable]:
         return list(self.sess.graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES))
@@ -142,9 +240,14 @@ class TFModel(Model):
         self.metadata[LABEL_MAP] = label_map
         self.metadata[REV_LABEL_MAP] = reverse_label_map
 
-    def make_placeholders(self, is_frozen: bool):
+    def make_placeholders(self, is_frozen: bool, is_inference: bool = False):
         """
         Creates placeholders for this model.
+
+        Args:
+            is_frozen: Whether to replace all inputs with constants.
+            is_inference: Whether to replace the training-only inputs (e.g. dropout and noise)
+                with constants. The inputs and outputs remain as placeholders.
         """
         pass
 
@@ -228,38 +331,43 @@ class TFModel(Model):
             num_parameters += np.prod(var.shape)
         return int(num_parameters)
 
-    def make(self, is_train: bool, is_frozen: bool):
+    def make(self, is_train: bool, is_frozen: bool, is_inference: bool = False):
         """
         Creates model and optimizer op.
 
         Args:
             is_train: Whether the model is built for training or just for inference.
             is_frozen: Whether the mode ls built with frozen inputs.
+            is_inference: Whether to build an inference-only graph. Training-only inputs
+                become constants and the optimizer is never created.
         """
         if self.is_made:
             return  # Prevent building twice
 
+        assert not (is_train and is_inference), 'Cannot build an inference-only graph for training'
+
         with self.sess.graph.as_default():
-            self.make_placeholders(is_frozen=is_frozen)
+            self.make_placeholders(is_frozen=is_frozen, is_inference=is_inference)
             self.make_model(is_train=is_train)
 
-            # Create the global step variable for learning rate decay
-            self._global_step = tf.Variable(0, trainable=False)
-
-            # Create the gradient descent optimizer
-            self._optimizer = get_optimizer(name=self.hypers.optimizer,
-                                            learning_rate=self.hypers.learning_rate,
-                                            learning_rate_decay=self.hypers.learning_rate_decay,
-                                            global_step=self._global_step,
-                                            decay_steps=self.hypers.decay_steps)
-
             # The loss and optimization criteria are only
             # guaranteed to be defined when the model is built for training
             if is_train:
+                # Create the global step variable for learning rate decay
+                self._global_step = tf.Variable(0, trainable=False)
+
+                # Create the gradient descent optimizer
+                self._optimizer = get_optimizer(name=self.hypers.optimizer,
+                                                learning_rate=self.hypers.learning_rate,
+                                                learning_rate_decay=self.hypers.learning_rate_decay,
+                                                global_step=self._global_step,
+                                                decay_steps=self.hypers.decay_steps)
+
                 self.make_loss()
                 self.make_training_step()
 
         self._is_made = True
+        self._is_inference = is_inference
 
     def make_training_step(self):
         """
@@ -287,6 +395,7 @@ class TFModel(Model):
         # to worry about applying these operations separately.
         self._ops[self.optimizer_op_name] = tf.group(optimizer_op, global_step_op)
 
+    @timed('model.execute')
     def execute(self, feed_dict: Dict[tf.Tensor, List[Any]], ops: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Executes the model using the given feed dictionary. An optional set of operation names
@@ -302,29 +411,44 @@ class TFModel(Model):
         if ops is not None:
             ops_to_run = {op_name: op_val for op_name, op_val in self._ops.items() if op_name in ops}
 
+        # Inference-only graphs hold the training inputs as constants. We remove these
+        # values to avoid overriding the (folded) constants.
+        if self._is_inference:
+            feed_dict = {tensor: value for tensor, value in feed_dict.items() if tensor.op.type == 'Placeholder'}
+
         with self._sess.graph.as_default():
             op_results = self._sess.run(ops_to_run, feed_dict=feed_dict)
             return op_results
 
-    def freeze(self):
+    def freeze(self, output_nodes: Optional[List[str]] = None) -> tf.GraphDef:
         """
         Freezes the Tensorflow computation graph by converting all variables to constants.
+
+        Args:
+            output_nodes: Names of the nodes to keep. Defaults to the nodes which produce the output operation.
+        Returns:
+            The frozen graph. Nodes which the outputs do not depend on are removed.
         """
         # We need to convert the high-level output names to the corresponding Tensorflow nodes
         # This operation is done by (1) getting output variables and (2) finding the nodes
         # for which these variables are the outputs
-
-        output_nodes: List[str] = []
-        for op in self.sess.graph.get_operations():
-            for output_name in map(lambda t: t.name, op.outputs):
-                if output_name == self.output_op_name:
-                    output_nodes.append(op.name)
+        if output_nodes is None:
+            output_nodes = []
+            for op in self.sess.graph.get_operations():
+                for output_name in map(lambda t: t.name, op.outputs):
+                    if output_name == self.output_op_name:
+                        output_nodes.append(op.name)
 
         # Freeze the corresponding graph
         with self.sess.graph.as_default():
-            tf.graph_util.convert_variables_to_constants(self.sess, self.sess.graph.as_graph_def(), output_nodes)
-
-    def train(self, dataset: Dataset, should_print: bool, drop_incomplete_batches: bool = False) -> str:
+            return tf.graph_util.convert_variables_to_constants(self.sess, self.sess.graph.as_graph_def(), output_nodes)
+
+    def train(self, dataset: Dataset,
+              should_print: bool,
+              drop_incomplete_batches: bool = False,
+              name: Optional[str] = None,
+              max_epochs: Optional[int] = None,
+              warm_start_path: Optional[str] = None) -> str:
         """
         Trains the model on the given dataset.
 
@@ -332,14 +456,30 @@ class TFModel(Model):
             dataset: Dataset object containing training, validation and testing partitions
             should_print: Whether we should print results to stdout
             drop_incomplete_minibatches: Whether to drop incomplete batches
+            name: Optional name of the training run. If a training state exists for this name,
+                then training resumes from the saved state.
+            max_epochs: Optional limit on the total number of epochs (including those from earlier runs). When
+                training stops at this limit, the training state is saved so that training can later resume.
+            warm_start_path: Optional path to the model file of another training run. Variables with a
+                matching name and shape are initialized from this model.
         Returns:
             The name of the training run. Training results are logged to a pickle file with the name
             model-train-log_{name}.pkl.gz.
         """
-        self.load_metadata(dataset)
+        train_state = self.load_train_state(name) if name is not None else None
+
+        # Runs without a training state (e.g. finished runs) resume from the saved model
+        if train_state is None and name is not None:
+            train_state = self.make_train_state_from_model(name)
+
+        # Resumed runs reuse the saved metadata to keep the same normalization
+        if train_state is not None:
+            self.metadata = train_state['metadata']
+        else:
+            self.load_metadata(dataset)
 
-        current_time = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-        name = NAME_FMT.format(self.name, dataset.dataset_name, current_time)
+        if name is None:
+            name = self.reserve_name(dataset)
 
         # Make Model and Initialize variables
         self.make(is_train=True, is_frozen=False)
@@ -347,16 +487,57 @@ class TFModel(Model):
 
         print('Created model with {0} trainable parameters.'.format(self.count_parameters()))
 
-        # Variables for early stopping
-        best_valid_metric = 0.0 if is_classification(self.output_type) else BIG_NUMBER
-        num_not_improved = 0
-
-        # Lists for logging training results
-        loss_dict: DefaultDict[str, List[float]] = defaultdict(list)
-        acc_dict: DefaultDict[str, List[float]] = defaultdict(list)
+        if train_state is not None:
+            if train_state.get('has_checkpoint', True):
+                # Restore all variables, including the optimizer state and global step
+                self.restore_train_checkpoint(name)
+            else:
+                # Only the trainable variables are saved with the model. The optimizer starts from scratch.
+                self._best_snapshot = read_by_file_suffix(os.path.join(self.save_folder, MODEL_PATH.format(name)))
+                self.load_variables(self._best_snapshot)
+
+            start_epoch = train_state['epoch']
+            current_time = train_state['start_time']
+
+            progress = TrainProgress(best_valid_metric=train_state['best_valid_metric'],
+                                     num_not_improved=train_state['num_not_improved'],
+                                     loss_dict=train_state['loss'],
+                                     acc_dict=train_state['accuracy'])
+        else:
+            start_epoch = 0
+            current_time = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+
+            # Variables for early stopping and lists for logging training results
+            progress = TrainProgress(best_valid_metric=0.0 if is_classification(self.output_type) else BIG_NUMBER,
+                                     num_not_improved=0,
+                                     loss_dict=defaultdict(list),
+                                     acc_dict=defaultdict(list))
+
+        # Initialize compatible variables from another model
+        if warm_start_path is not None and train_state is None:
+            loaded_vars = self.warm_start(warm_start_path)
+            print('Warm-started {0} of {1} trainable variables from {2}.'.format(len(loaded_vars), len(self.trainable_vars), warm_start_path))
+
+        end_epoch = self.hypers.epochs if max_epochs is None else min(max_epochs, self.hypers.epochs)
+        checkpoint_frequency = self.hypers.checkpoint_frequency
+        checkpoint_writer = AsyncCheckpointWriter()
+        is_finished = start_epoch >= self.hypers.epochs
+        epoch = start_epoch
+
+        # Validation runs either every few training steps or every few epochs
+        validation_steps = self.hypers.validation_steps
+        validation_epochs = max(self.hypers.validation_frequency, 1)
+
+        # Concurrent validation executes a copy of the model on a background thread
+        validator: Optional[ConcurrentValidator] = None
+        if self.hypers.concurrent_validation:
+            validator = ConcurrentValidator(self.make_evaluation_copy(), dataset=dataset)
+
+        num_steps = 0
+        last_validation_step = 0
 
         # Execute training and validation epochs
-        for epoch in range(self.hypers.epochs):
+        for epoch in range(start_epoch, end_epoch):
             if should_print:
                 print('-------- Epoch {0} --------'.format(epoch))
 
@@ -395,126 +576,505 @@ class TFModel(Model):
                     else:
                         print('Train Batch {0}. Avg loss so far: {1:.4f}'.format(batch_idx, avg_loss_so_far), end='\r')
 
-            if should_print:
-                print()  # Clear the line
-
-            avg_train_loss = train_loss / train_samples
-            avg_train_acc = train_accuracy / train_samples
-
-            loss_dict[TRAIN].append(avg_train_loss)
-            acc_dict[TRAIN].append(avg_train_acc)
-
-            valid_generator = dataset.minibatch_generator(DataSeries.VALID,
-                                                          batch_size=self.hypers.batch_size,
-                                                          metadata=self.metadata,
-                                                          should_shuffle=True,
-                                                          drop_incomplete_batches=drop_incomplete_batches)
-
-            # Collect the training operations. For classification tasks, we also include the accuracy.
-            valid_ops = [self.loss_op_name, self.accuracy_op_name]
-
-            valid_accuracy = 0.0
-            valid_loss = 0.0
-            valid_samples = 0
-
-            for batch_idx, batch in enumerate(valid_generator):
-                feed_dict = self.batch_to_feed_dict(batch, is_train=False, epoch_num=epoch)
-
-                batch_size = len(batch[OUTPUT])
-
-                # Run the training operations
-                valid_results = self.execute(feed_dict, valid_ops)
+                # Step-based validation
+                num_steps += 1
+                if validation_steps is not None and num_steps % validation_steps == 0:
+                    if should_print:
+                        print()  # Clear the line
 
-                # Aggregate the loss and average accuracy
-                valid_loss += valid_results[self.loss_op_name] * batch_size
-                valid_accuracy += valid_results.get(self.accuracy_op_name, 0.0) * batch_size
-                valid_samples += batch_size
+                    last_validation_step = num_steps
 
-                avg_loss_so_far = valid_loss / valid_samples
-                avg_acc_so_far = valid_accuracy / valid_samples
-
-                if should_print:
-                    if is_classification(self.output_type):
-                        print('Validation Batch {0}. Avg loss so far: {1:.4f}, Avg accuracy so far: {2:.4f}'.format(batch_idx, avg_loss_so_far, avg_acc_so_far), end='\r')
-                    else:
-                        print('Validation Batch {0}. Avg loss so far: {1:.4f}'.format(batch_idx, avg_loss_so_far), end='\r')
+                    self._run_validation(dataset=dataset,
+                                         epoch=epoch,
+                                         name=name,
+                                         progress=progress,
+                                         checkpoint_writer=checkpoint_writer,
+                                         validator=validator,
+                                         should_print=should_print,
+                                         drop_incomplete_batches=drop_incomplete_batches)
 
             if should_print:
                 print()  # Clear the line
 
-            avg_valid_loss = valid_loss / valid_samples
-            avg_valid_accuracy = valid_accuracy / valid_samples
+            avg_train_loss = train_loss / max(train_samples, 1)
+            avg_train_acc = train_accuracy / max(train_samples, 1)
 
-            loss_dict[VALID].append(avg_valid_loss)
-            acc_dict[VALID].append(avg_valid_accuracy)
+            progress.loss_dict[TRAIN].append(avg_train_loss)
+            progress.acc_dict[TRAIN].append(avg_train_acc)
 
-            # Detect improvement using the validation set
-            has_improved = False
-            if is_classification(self.output_type):
-                if avg_valid_accuracy > best_valid_metric:
-                    best_valid_metric = avg_valid_accuracy
-                    has_improved = True
+            # Epoch-based validation. We always validate after the final epoch, including
+            # in step-based mode when steps remain since the last validation.
+            is_final_epoch = epoch == end_epoch - 1
+            if validation_steps is None:
+                should_validate = (epoch + 1 - start_epoch) % validation_epochs == 0 or is_final_epoch
             else:
-                if avg_valid_loss < best_valid_metric:
-                    best_valid_metric = avg_valid_loss
-                    has_improved = True
+                should_validate = is_final_epoch and num_steps > last_validation_step
 
-            # Save the model upon improvement
-            if has_improved:
-                if should_print:
-                    print('Saving model...')
+            if should_validate:
+                self._run_validation(dataset=dataset,
+                                     epoch=epoch,
+                                     name=name,
+                                     progress=progress,
+                                     checkpoint_writer=checkpoint_writer,
+                                     validator=validator,
+                                     should_print=should_print,
+                                     drop_incomplete_batches=drop_incomplete_batches)
 
-                self.save(name=name, data_folders=dataset.data_folders)
-                num_not_improved = 0
-            else:
-                num_not_improved += 1
+            # Patience counts epochs (not validations), so it does not depend on the validation cadence
+            if not progress.has_improved:
+                progress.num_not_improved += 1
 
-            if num_not_improved >= self.hypers.patience:
+            progress.has_improved = False
+
+            if progress.num_not_improved >= self.hypers.patience:
                 if should_print:
                     print('Terminating due to early stopping.')
+
+                is_finished = True
                 break
 
+            # Periodically save the training state so that killed runs can resume
+            if checkpoint_frequency is not None and (epoch + 1 - start_epoch) % checkpoint_frequency == 0 and epoch < end_epoch - 1:
+                if validator is not None:
+                    result = validator.wait()
+                    if result is not None:
+                        self._record_validation(result=result,
+                                                name=name,
+                                                dataset=dataset,
+                                                progress=progress,
+                                                checkpoint_writer=checkpoint_writer,
+                                                should_print=should_print)
+
+                self.save_train_state(name=name,
+                                      epoch=epoch + 1,
+                                      best_valid_metric=progress.best_valid_metric,
+                                      num_not_improved=progress.num_not_improved,
+                                      loss_dict=progress.loss_dict,
+                                      acc_dict=progress.acc_dict,
+                                      start_time=current_time)
+        else:
+            # The loop completed without early stopping
+            epoch = end_epoch - 1
+            is_finished = is_finished or end_epoch >= self.hypers.epochs
+
+        # Record the in-flight validation (if any)
+        if validator is not None:
+            result = validator.close()
+            if result is not None:
+                self._record_validation(result=result,
+                                        name=name,
+                                        dataset=dataset,
+                                        progress=progress,
+                                        checkpoint_writer=checkpoint_writer,
+                                        should_print=should_print)
+
+                is_finished = is_finished or progress.num_not_improved >= self.hypers.patience
+
+        num_epochs = max(epoch + 1, start_epoch)
+
+        # Wait for all checkpoints to finish writing
+        checkpoint_writer.close()
+
+        # Save the training state when training can continue. Finished runs do not need this state.
+        if is_finished:
+            self.remove_train_state(name)
+        else:
+            self.save_train_state(name=name,
+                                  epoch=num_epochs,
+                                  best_valid_metric=progress.best_valid_metric,
+                                  num_not_improved=progress.num_not_improved,
+                                  loss_dict=progress.loss_dict,
+                                  acc_dict=progress.acc_dict,
+                                  start_time=current_time)
+
         # Log the ending time. This tracks the time to train this model
         ending_time = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
 
         # Save training metrics
-        metrics_dict = dict(loss=loss_dict, accuracy=acc_dict, start_time=current_time, end_time=ending_time)
+        metrics_dict = dict(loss=progress.loss_dict,
+                            accuracy=progress.acc_dict,
+                            start_time=current_time,
+                            end_time=ending_time,
+                            epochs=num_epochs,
+                            finished=is_finished)
         log_file = os.path.join(self.save_folder, TRAIN_LOG_PATH.format(name))
         save_by_file_suffix(metrics_dict, log_file)
 
         return name
 
-    def save(self, name: str, data_folders: Dict[DataSeries, str]):
+    @timed('model.validate')
+    def validate(self, dataset: Dataset, epoch_num: int, should_print: bool, drop_incomplete_batches: bool = False) -> Tuple[float, float]:
         """
-        Save model weights, hyper-parameters, and metadata
+        Executes the model on the validation set. Batches are generated in a fixed order.
+
+        Args:
+            dataset: Dataset object containing the validation partition
+            epoch_num: The current epoch number
+            should_print: Whether we should print results to stdout
+            drop_incomplete_batches: Whether to drop incomplete batches
+        Returns:
+            A tuple of the average validation loss and accuracy.
+        """
+        valid_generator = dataset.minibatch_generator(DataSeries.VALID,
+                                                      batch_size=self.hypers.batch_size,
+                                                      metadata=self.metadata,
+                                                      should_shuffle=False,
+                                                      drop_incomplete_batches=drop_incomplete_batches)
+
+        # Collect the validation operations. For classification tasks, we also include the accuracy.
+        valid_ops = [self.loss_op_name, self.accuracy_op_name]
+
+        valid_accuracy = 0.0
+        valid_loss = 0.0
+        valid_samples = 0
+
+        for batch_idx, batch in enumerate(valid_generator):
+            feed_dict = self.batch_to_feed_dict(batch, is_train=False, epoch_num=epoch_num)
+
+            batch_size = len(batch[OUTPUT])
+
+            # Run the validation operations
+            valid_results = self.execute(feed_dict, valid_ops)
+
+            # Aggregate the loss and average accuracy
+            valid_loss += valid_results[self.loss_op_name] * batch_size
+            valid_accuracy += valid_results.get(self.accuracy_op_name, 0.0) * batch_size
+            valid_samples += batch_size
+
+            avg_loss_so_far = valid_loss / valid_samples
+            avg_acc_so_far = valid_accuracy / valid_samples
+
+            if should_print:
+                if is_classification(self.output_type):
+                    print('Validation Batch {0}. Avg loss so far: {1:.4f}, Avg accuracy so far: {2:.4f}'.format(batch_idx, avg_loss_so_far, avg_acc_so_far), end='\r')
+                else:
+                    print('Validation Batch {0}. Avg loss so far: {1:.4f}'.format(batch_idx, avg_loss_so_far), end='\r')
+
+        if should_print:
+            print()  # Clear the line
+
+        return valid_loss / max(valid_samples, 1), valid_accuracy / max(valid_samples, 1)
+
+    def _run_validation(self, dataset: Dataset,
+                        epoch: int,
+                        name: str,
+                        progress: TrainProgress,
+                        checkpoint_writer: AsyncCheckpointWriter,
+                        validator: Optional[ConcurrentValidator],
+                        should_print: bool,
+                        drop_incomplete_batches: bool):
+        """
+        Validates the current weights. Concurrent validation evaluates a snapshot of the weights on a
+        background thread; the results are recorded at the next validation (or at the end of training).
+        """
+        if validator is None:
+            valid_loss, valid_accuracy = self.validate(dataset=dataset,
+                                                       epoch_num=epoch,
+                                                       should_print=should_print,
+                                                       drop_incomplete_batches=drop_incomplete_batches)
+            result = ValidationResult(loss=valid_loss, accuracy=valid_accuracy, snapshot=None)
+        else:
+            result = validator.submit(snapshot=self.snapshot_variables(),
+                                      epoch_num=epoch,
+                                      drop_incomplete_batches=drop_incomplete_batches)
+
+        if result is not None:
+            self._record_validation(result=result,
+                                    name=name,
+                                    dataset=dataset,
+                                    progress=progress,
+                                    checkpoint_writer=checkpoint_writer,
+                                    should_print=should_print)
+
+    def _record_validation(self, result: ValidationResult,
+                           name: str,
+                           dataset: Dataset,
+                           progress: TrainProgress,
+                           checkpoint_writer: AsyncCheckpointWriter,
+                           should_print: bool):
+        """
+        Logs the validation result and saves the corresponding weights upon improvement.
+        """
+        progress.loss_dict[VALID].append(result.loss)
+        progress.acc_dict[VALID].append(result.accuracy)
+
+        # Detect improvement using the validation set
+        has_improved = False
+        if is_classification(self.output_type):
+            if result.accuracy > progress.best_valid_metric:
+                progress.best_valid_metric = result.accuracy
+                has_improved = True
+        else:
+            if result.loss < progress.best_valid_metric:
+                progress.best_valid_metric = result.loss
+                has_improved = True
+
+        # Save the model upon improvement
+        if has_improved:
+            if should_print:
+                print('Saving model...')
+
+            # Keep the best weights in memory and write the checkpoint from a background thread
+            self._best_snapshot = result.snapshot if result.snapshot is not None else self.snapshot_variables()
+            self.save(name=name, data_folders=dataset.data_folders, writer=checkpoint_writer, vars_dict=self._best_snapshot)
+            progress.num_not_improved = 0
+            progress.has_improved = True
+
+    def make_evaluation_copy(self) -> 'TFModel':
+        """
+        Creates a copy of this model in a separate graph and session. The copy includes the loss and
+        accuracy operations but no optimizer. Weights are loaded with load_variables().
+        """
+        model = type(self)(self.hypers, self.save_folder, is_train=False)
+        model.metadata = self.metadata
+
+        with model.sess.graph.as_default():
+            model.make_placeholders(is_frozen=False)
+            model.make_model(is_train=True)
+            model.make_loss()
+
+        model._is_made = True
+        model.init()
+        return model
+
+    def load_variables(self, vars_dict: Dict[str, np.ndarray]):
+        """
+        Sets the trainable variables to the given values. The assignment operations are created once and reused.
+        """
+        with self.sess.graph.as_default():
+            if self._load_ops is None:
+                self._load_ops = dict()
+
+                for trainable_var in self.trainable_vars:
+                    value_placeholder = tf.placeholder(dtype=trainable_var.dtype.base_dtype, shape=trainable_var.shape)
+                    assign_op = trainable_var.assign(value_placeholder, use_locking=True, read_value=False)
+                    self._load_ops[trainable_var.name] = (value_placeholder, assign_op)
+
+            assign_ops: List[tf.Operation] = []
+            feed_dict: Dict[tf.Tensor, np.ndarray] = dict()
+            for var_name, value in vars_dict.items():
+                if var_name in self._load_ops:
+                    value_placeholder, assign_op = self._load_ops[var_name]
+                    feed_dict[value_placeholder] = value
+                    assign_ops.append(assign_op)
+
+            self.sess.run(assign_ops, feed_dict=feed_dict)
+
+    def reserve_name(self, dataset: Dataset) -> str:
+        """
+        Creates a unique name for a new training run. Runs which start at the same time (e.g. in parallel
+        sweeps) would otherwise share a name, so we reserve the name by atomically creating the
+        hyper-parameters file and advance the timestamp on collisions.
+        """
+        start_time = datetime.now()
+
+        while True:
+            name = NAME_FMT.format(self.name, dataset.dataset_name, start_time.strftime('%Y-%m-%d-%H-%M-%S'))
+            params_path = os.path.join(self.save_folder, HYPERS_PATH.format(name))
+
+            try:
+                fd = os.open(params_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+            except FileExistsError:
+                start_time += timedelta(seconds=1)
+                continue
+
+            save_by_file_suffix(self.hypers.as_dict(), params_path)
+            return name
+
+    @timed('model.save_train_state')
+    def save_train_state(self, name: str, epoch: int, best_valid_metric: float, num_not_improved: int,
+                         loss_dict: Dict[str, List[float]], acc_dict: Dict[str, List[float]], start_time: str):
+        """
+        Saves the full training state. The state holds a checkpoint of all variables (including the optimizer
+        state) and the training progress.
+
+        Args:
+            name: Name of the training run
+            epoch: The next epoch to execute
+            best_valid_metric: The best validation metric so far
+            num_not_improved: The number of epochs without improvement
+            loss_dict: The training and validation losses for each epoch
+            acc_dict: The training and validation accuracy for each epoch
+            start_time: The starting time of the training run
+        """
+        with self.sess.graph.as_default():
+            checkpoint_prefix = os.path.join(self.save_folder, TRAIN_CHECKPOINT_PATH.format(name))
+            self._get_saver().save(self.sess, checkpoint_prefix, write_meta_graph=False, write_state=False)
+
+        train_state = dict(epoch=epoch,
+                           best_valid_metric=best_valid_metric,
+                           num_not_improved=num_not_improved,
+                           loss=loss_dict,
+                           accuracy=acc_dict,
+                           start_time=start_time,
+                           metadata=self.metadata)
+
+        state_path = os.path.join(self.save_folder, TRAIN_STATE_PATH.format(name))
+        save_by_file_suffix(train_state, state_path)
+
+    def load_train_state(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Loads the training state for the given run. Returns None if no such state exists.
+        """
+        state_path = os.path.join(self.save_folder, TRAIN_STATE_PATH.format(name))
+        if not os.path.exists(state_path):
+            return None
+
+        return read_by_file_suffix(state_path)
+
+    def make_train_state_from_model(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Creates a training state from the saved model and training log of the given run. This state
+        has no checkpoint, so only the trainable variables are restored. Returns None if there is no saved model.
+        """
+        model_path = os.path.join(self.save_folder, MODEL_PATH.format(name))
+        metadata_path = os.path.join(self.save_folder, METADATA_PATH.format(name))
+        if not os.path.exists(model_path) or not os.path.exists(metadata_path):
+            return None
+
+        loss_dict: DefaultDict[str, List[float]] = defaultdict(list)
+        acc_dict: DefaultDict[str, List[float]] = defaultdict(list)
+        start_time = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+
+        log_path = os.path.join(self.save_folder, TRAIN_LOG_PATH.format(name))
+        if os.path.exists(log_path):
+            train_log = read_by_file_suffix(log_path)
+            loss_dict.update(train_log['loss'])
+            acc_dict.update(train_log['accuracy'])
+            start_time = train_log['start_time']
+
+        # Recover the early stopping state from the validation history. The saved model holds the best weights.
+        # The log does not record the epoch of each validation, so the validations since the best result
+        # give a lower bound on the epochs without improvement.
+        if is_classification(self.output_type):
+            valid_history = acc_dict[VALID]
+            best_index = int(np.argmax(valid_history)) if len(valid_history) > 0 else -1
+            best_valid_metric = valid_history[best_index] if len(valid_history) > 0 else 0.0
+        else:
+            valid_history = loss_dict[VALID]
+            best_index = int(np.argmin(valid_history)) if len(valid_history) > 0 else -1
+            best_valid_metric = valid_history[best_index] if len(valid_history) > 0 else BIG_NUMBER
+
+        return dict(epoch=len(loss_dict[TRAIN]),
+                    best_valid_metric=best_valid_metric,
+                    num_not_improved=len(valid_history) - best_index - 1,
+                    loss=loss_dict,
+                    accuracy=acc_dict,
+                    start_time=start_time,
+                    metadata=read_by_file_suffix(metadata_path)['metadata'],
+                    has_checkpoint=False)
+
+    def warm_start(self, model_path: str) -> List[str]:
+        """
+        Initializes the trainable variables from the given saved model. Only variables with
+        the same name and shape are loaded, so the saved model may use a different configuration.
+
+        Args:
+            model_path: Path to the saved model file (model-*.pkl.gz)
+        Returns:
+            The names of the loaded variables.
+        """
+        assert os.path.exists(model_path), 'The model file {0} does not exist!'.format(model_path)
+        saved_vars = read_by_file_suffix(model_path)
+
+        compatible_vars: Dict[str, np.ndarray] = dict()
+        for trainable_var in self.trainable_vars:
+            saved_value = saved_vars.get(trainable_var.name)
+            if saved_value is not None and tuple(np.shape(saved_value)) == tuple(trainable_var.shape.as_list()):
+                compatible_vars[trainable_var.name] = saved_value
+
+        self.load_variables(compatible_vars)
+        return list(sorted(compatible_vars.keys()))
+
+    def restore_train_checkpoint(self, name: str):
+        """
+        Restores all variables from the checkpoint of the given training run.
+        """
+        with self.sess.graph.as_default():
+            checkpoint_prefix = os.path.join(self.save_folder, TRAIN_CHECKPOINT_PATH.format(name))
+            self._get_saver().restore(self.sess, checkpoint_prefix)
+
+    def remove_train_state(self, name: str):
+        """
+        Removes the training state (if any) for the given run.
+        """
+        state_path = os.path.join(self.save_folder, TRAIN_STATE_PATH.format(name))
+        checkpoint_prefix = os.path.join(self.save_folder, TRAIN_CHECKPOINT_PATH.format(name))
+
+        for path in [state_path] + list(iterate_files(self.save_folder, pattern=re.escape(os.path.basename(checkpoint_prefix)) + r'\..+')):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _get_saver(self) -> tf.train.Saver:
+        # The saver must be created after the model so that it tracks all variables
+        if self._saver is None:
+            self._saver = tf.train.Saver(var_list=tf.global_variables(), max_to_keep=1)
+        return self._saver
+
+    @timed('model.save')
+    def save(self, name: str,
+             data_folders: Dict[DataSeries, str],
+             writer: Optional[AsyncCheckpointWriter] = None,
+             vars_dict: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Save model weights, hyper-parameters, and metadata. Hyper-parameters and metadata are only
+        written when they differ from the last saved values.
 
         Args:
             name: Name of the model
             data_folders: Data folders used for training and validation
+            writer: Optional background writer. When given, the files are written asynchronously.
+            vars_dict: Optional snapshot of the variable values. Defaults to the current values.
         """
-        # Save hyperparameters
         params_path = os.path.join(self.save_folder, HYPERS_PATH.format(name))
-        save_by_file_suffix(self.hypers.as_dict(), params_path)
+        metadata_path = os.path.join(self.save_folder, METADATA_PATH.format(name))
+        model_path = os.path.join(self.save_folder, MODEL_PATH.format(name))
 
-        # Save metadata
         data_folders_dict = {series.name: path for series, path in data_folders.items()}
-        metadata_path = os.path.join(self.save_folder, METADATA_PATH.format(name))
-        save_by_file_suffix(dict(metadata=self.metadata, data_folders=data_folders_dict), metadata_path)
 
+        files_to_save: Dict[str, Any] = dict()
+
+        # Save hyperparameters and metadata (if changed)
+        hypers_dict = self.hypers.as_dict()
+        if self._has_changed(hypers_dict, params_path):
+            files_to_save[params_path] = hypers_dict
+
+        metadata_dict = dict(metadata=self.metadata, data_folders=data_folders_dict)
+        if self._has_changed(metadata_dict, metadata_path):
+            files_to_save[metadata_path] = metadata_dict
+
+        # Always save the variable values
+        files_to_save[model_path] = vars_dict if vars_dict is not None else self.snapshot_variables()
+
+        for path, data in files_to_save.items():
+            if writer is None:
+                atomic_save(data, path)
+            else:
+                writer.submit(data, path)
+
+    def snapshot_variables(self) -> Dict[str, np.ndarray]:
+        """
+        Returns a copy of the values of all trainable variables.
+        """
         with self.sess.graph.as_default():
-            model_path = os.path.join(self.save_folder, MODEL_PATH.format(name))
+            vars_to_save = {var.name: var for var in self.trainable_vars}
+            return self.sess.run(vars_to_save)
 
-            # Get all variable values
-            trainable_vars = self.trainable_vars
-            vars_to_save = {var.name: var for var in trainable_vars}
-            vars_dict = self.sess.run(vars_to_save)
+    def _has_changed(self, data: Any, path: str) -> bool:
+        """
+        Returns whether the data differs from the last data saved to the given path (by this model).
+        """
+        digest = hashlib.sha1(pickle.dumps(data)).hexdigest()
+        if self._saved_digests.get(path) == digest and os.path.exists(path):
+            return False
 
-            # Save results
-            save_by_file_suffix(vars_dict, model_path)
+        self._saved_digests[path] = digest
+        return True
 
-    def restore(self, name: str, is_train: bool, is_frozen: bool):
+    def restore_metadata(self, name: str):
         """
-        Restore model metadata, hyper-parameters, and trainable parameters.
+        Restore the model hyper-parameters and metadata.
         """
         # Restore hyperparameters
         params_path = os.path.join(self.save_folder, HYPERS_PATH.format(name))
@@ -525,6 +1085,14 @@ class TFModel(Model):
         train_metadata = read_by_file_suffix(metadata_path)
         self.metadata = train_metadata['metadata']
 
+        self._restore_name = name
+
+    def restore(self, name: str, is_train: bool, is_frozen: bool):
+        """
+        Restore model metadata, hyper-parameters, and trainable parameters.
+        """
+        self.restore_metadata(name=name)
+
         # Build the model
         self.make(is_train=is_train, is_frozen=is_frozen)
 
@@ -551,3 +1119,161 @@ class TFModel(Model):
 
         if is_frozen:
             self.freeze()
+
+    def restore_for_inference(self, name: str, use_cached_graph: bool = True, optimize: bool = False, use_xla: bool = False):
+        """
+        Restores the model into a pruned inference graph. The graph has no optimizer, no loss,
+        and holds all trainable parameters as constants. The serialized graph is cached next
+        to the model file so later restores only need to import a single GraphDef.
+
+        Args:
+            name: Name of the model to restore
+            use_cached_graph: Whether to use (and create) the cached inference graph
+            optimize: Whether to apply the Grappler optimizations (e.g. constant folding) to the frozen graph
+            use_xla: Whether to compile the graph with the XLA JIT
+        """
+        self.restore_metadata(name=name)
+
+        graph_path = os.path.join(self.save_folder, INFERENCE_GRAPH_PATH.format(name))
+        cache_key = self._inference_cache_key(name=name)
+
+        inference_graph: Optional[Dict[str, Any]] = None
+        if use_cached_graph and os.path.exists(graph_path):
+            inference_graph = read_by_file_suffix(graph_path)
+
+            # Discard stale graphs (e.g. after retraining or code changes)
+            if inference_graph.get('key') != cache_key:
+                inference_graph = None
+
+        should_save = False
+        if inference_graph is None:
+            inference_graph = self._make_inference_graph(name=name)
+            inference_graph['key'] = cache_key
+            should_save = True
+
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(inference_graph['graph_def'])
+
+        # The optimized graph is cached alongside the frozen graph
+        if optimize:
+            if inference_graph.get('optimized_graph_def') is None:
+                output_nodes = set(tensor_name.split(':')[0] for tensor_name in inference_graph['ops'].values())
+                output_nodes.update(tensor_name.split(':')[0] for tensor_name in inference_graph['placeholders'].values())
+
+                optimized_graph_def = optimize_graph_def(graph_def, output_nodes=list(sorted(output_nodes)))
+                inference_graph['optimized_graph_def'] = optimized_graph_def.SerializeToString()
+                should_save = True
+
+            graph_def = tf.GraphDef()
+            graph_def.ParseFromString(inference_graph['optimized_graph_def'])
+
+        # Other processes may restore the same model concurrently, so the cache is replaced atomically
+        if use_cached_graph and should_save:
+            atomic_save(inference_graph, graph_path)
+
+        # Import the serialized graph into a fresh session
+        if use_xla:
+            self._sess.close()
+            self._sess = self._make_session(use_xla=True)
+
+        with self.sess.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+            graph = self.sess.graph
+            self._ops = {op_name: graph.get_tensor_by_name(tensor_name) for op_name, tensor_name in inference_graph['ops'].items()}
+            self._placeholders = {op_name: graph.get_tensor_by_name(tensor_name) for op_name, tensor_name in inference_graph['placeholders'].items()}
+
+        self._is_made = True
+        self._is_inference = True
+
+    def _make_inference_graph(self, name: str) -> Dict[str, Any]:
+        """
+        Builds the inference graph and converts all variables to constants.
+
+        Args:
+            name: Name of the model to restore
+        Returns:
+            A dictionary with the serialized GraphDef and the names of all operations and placeholders.
+        """
+        self.make(is_train=False, is_frozen=False, is_inference=True)
+
+        with self.sess.graph.as_default():
+            model_path = os.path.join(self.save_folder, MODEL_PATH.format(name))
+            vars_dict = read_by_file_suffix(model_path)
+
+            # Load the saved values directly through the variable initializers. This avoids
+            # creating (and executing) an additional assignment operation per variable.
+            init_feed_dict: Dict[tf.Tensor, np.ndarray] = dict()
+            for trainable_var in self.trainable_vars:
+                saved_value = vars_dict.get(trainable_var.name)
+                if saved_value is None:
+                    print('WARNING: No value for {0}'.format(trainable_var.name))
+                else:
+                    init_feed_dict[trainable_var.initial_value] = saved_value
+
+            self.sess.run(tf.global_variables_initializer(), feed_dict=init_feed_dict)
+
+            # Only keep the tensor-valued operations. The remaining graph is pruned away.
+            op_tensors = {op_name: op for op_name, op in self._ops.items() if isinstance(op, tf.Tensor)}
+            placeholder_tensors = {op_name: op for op_name, op in self._placeholders.items() if isinstance(op, tf.Tensor)}
+
+            output_nodes = set(t.op.name for t in op_tensors.values())
+            output_nodes.update(t.op.name for t in placeholder_tensors.values())
+
+        graph_def = self.freeze(output_nodes=list(sorted(output_nodes)))
+
+        # Reset the session. The caller imports the frozen graph.
+        self._sess.close()
+        self._sess = self._make_session()
+        self._ops = dict()
+        self._placeholders = dict()
+        self._is_made = False
+
+        return {
+            'graph_def': graph_def.SerializeToString(),
+            'ops': {op_name: t.name for op_name, t in op_tensors.items()},
+            'placeholders': {op_name: t.name for op_name, t in placeholder_tensors.items()}
+        }
+
+    def _make_session(self, use_xla: bool = False) -> tf.Session:
+        """
+        Creates a session with an empty graph using the configured thread counts.
+        """
+        config = get_session_config(self.hypers.intra_op_threads, self.hypers.inter_op_threads, use_xla=use_xla)
+        return tf.Session(graph=tf.Graph(), config=config)
+
+    def _inference_cache_key(self, name: str) -> Dict[str, Any]:
+        """
+        Returns the key used to validate the cached inference and optimized graphs. The key tracks
+        the saved model files, the contents of the source files which define the graph, and the
+        Tensorflow version.
+        """
+        model_paths = [path.format(name) for path in (MODEL_PATH, HYPERS_PATH, METADATA_PATH)]
+
+        # The model classes, layers and graph utilities determine the graph structure
+        source_paths = [os.path.relpath(sys.modules[cls.__module__].__file__, SOURCE_FOLDER) for cls in type(self).__mro__ if issubclass(cls, TFModel)]
+        for source in INFERENCE_GRAPH_SOURCES:
+            source_path = os.path.join(SOURCE_FOLDER, source)
+            if os.path.isdir(source_path):
+                source_paths.extend(os.path.relpath(os.path.join(folder, file_name), SOURCE_FOLDER)
+                                    for folder, _, file_names in os.walk(source_path) for file_name in file_names if file_name.endswith('.py'))
+            else:
+                source_paths.append(source)
+
+        def get_stats(folder: str, paths: List[str]) -> Dict[str, Tuple[int, float]]:
+            stats = {path: os.stat(os.path.join(folder, path)) for path in paths}
+            return {path: (stat.st_size, stat.st_mtime) for path, stat in stats.items()}
+
+        # Sources are keyed on their contents. Checkouts and copies change the modification times
+        # without changing the graph, and rebuilding the (Grappler-optimized) graph is expensive.
+        def get_digests(folder: str, paths: List[str]) -> Dict[str, str]:
+            digests: Dict[str, str] = dict()
+            for path in paths:
+                with open(os.path.join(folder, path), 'rb') as source_file:
+                    digests[path] = hashlib.sha1(source_file.read()).hexdigest()
+
+            return digests
+
+        return dict(model_files=get_stats(self.save_folder, model_paths),
+                    source_files=get_digests(SOURCE_FOLDER, source_paths),
+                    tf_version=tf.__version__)
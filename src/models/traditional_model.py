@@ -1,9 +1,10 @@
 import os
 import numpy as np
 from datetime import datetime
+from joblib import Parallel, delayed
 from sklearn.preprocessing import StandardScaler
 from collections import defaultdict
-from typing import List, Set, Any, Dict, Optional, Iterable, DefaultDict
+from typing import List, Set, Any, Dict, Optional, Iterable, DefaultDict, Tuple
 
 from layers.output_layers import OutputType
 from dataset.dataset import Dataset, DataSeries
@@ -32,29 +33,26 @@ class TraditionalModel(Model):
     def model(self) -> Any:
         return self._model
 
+    @property
+    def n_jobs(self) -> Optional[int]:
+        return self.hypers.model_params.get('n_jobs', 1)
+
+    @property
+    def prediction_chunk_size(self) -> int:
+        return self.hypers.model_params.get('prediction_chunk_size', 10000)
+
     def compute_flops(self, level: int) -> int:
         return 0
 
     def load_metadata(self, dataset: Dataset):
-        input_samples: List[np.ndarray] = []
-        output_samples: List[Any] = []
+        input_samples, output_samples = self.read_raw_arrays(dataset, series=DataSeries.TRAIN)
 
         unique_labels: Set[Any] = set()
-        for sample in dataset.iterate_series(series=DataSeries.TRAIN):
-            input_sample = np.array(sample[INPUTS]).reshape(-1)
-            if np.any(np.isnan(input_sample)) or np.any(input_sample is None):
-                continue
-
-            if sample[OUTPUT] is None:
-                continue
-
-            input_samples.append(input_sample)
-
-            if self.output_type == OutputType.MULTI_CLASSIFICATION:
-                unique_labels.add(sample[OUTPUT])
+        if self.output_type == OutputType.MULTI_CLASSIFICATION:
+            unique_labels.update(output_samples.tolist())
 
         # Get the number of input features
-        num_input_features = len(input_samples[0])
+        num_input_features = input_samples.shape[1]
 
         # Create and fit the input sample scaler
         input_scaler = StandardScaler()
@@ -76,9 +74,87 @@ class TraditionalModel(Model):
         self.metadata[LABEL_MAP] = label_map
         self.metadata[REV_LABEL_MAP] = reverse_label_map
 
-    def train(self, dataset: Dataset, drop_incomplete_batches: bool = False) -> str:
+    def read_raw_arrays(self, dataset: Dataset, series: DataSeries) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the given series as a [N, D] input matrix and a [N] output array. Samples with
+        missing values, or with a different number of input features than the first complete
+        sample, are removed.
+        """
+        num_input_features = self.metadata.get(INPUT_SHAPE)
+
+        def is_complete(sample: Dict[str, Any]) -> bool:
+            nonlocal num_input_features
+
+            if sample.get(INPUTS) is None or sample.get(OUTPUT) is None:
+                return False
+
+            try:
+                input_sample = np.array(sample[INPUTS], dtype=float).reshape(-1)
+            except (TypeError, ValueError):
+                return False
+
+            if num_input_features is None:
+                num_input_features = len(input_sample)
+
+            return len(input_sample) == num_input_features
+
+        arrays = dataset.read_series(series, should_include=is_complete)
+
+        inputs = arrays[INPUTS]
+        inputs = inputs.reshape(len(inputs), -1).astype(float)
+        outputs = arrays[OUTPUT]
+
+        is_valid = np.logical_not(np.any(np.isnan(inputs), axis=-1))
+        return inputs[is_valid], outputs[is_valid]
+
+    def read_arrays(self, dataset: Dataset, series: DataSeries) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the given series as normalized inputs and (re-mapped) outputs. This is the vectorized
+        equivalent of tensorizing each sample.
+
+        Args:
+            dataset: The dataset to read
+            series: The series to read
+        Returns:
+            A tuple of the [N, D] normalized inputs and the [N] outputs.
+        """
+        inputs, outputs = self.read_raw_arrays(dataset, series)
+
+        normalized_inputs = self.metadata[INPUT_SCALER].transform(inputs)
+
+        # Re-map labels for classification problems
+        if self.metadata[NUM_CLASSES] > 0:
+            label_map = self.metadata[LABEL_MAP]
+            labels = np.array(list(sorted(label_map.keys())))
+            label_indices = np.array([label_map[label] for label in labels])
+
+            positions = np.clip(np.searchsorted(labels, outputs), a_min=0, a_max=len(labels) - 1)
+            if not np.all(labels[positions] == outputs):
+                raise ValueError('Found labels which are not present in the training set.')
+
+            outputs = label_indices[positions]
+
+        return normalized_inputs, outputs
+
+    def predict_arrays(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Predicts the outputs for the given inputs. Large inputs are split into chunks which are predicted
+        in parallel when the estimator does not parallelize prediction itself.
+        """
+        n_jobs = self.n_jobs
+        if n_jobs == 1 or hasattr(self.model, 'n_jobs') or len(inputs) <= self.prediction_chunk_size:
+            return self.model.predict(inputs)
+
+        num_chunks = int(np.ceil(len(inputs) / self.prediction_chunk_size))
+        chunks = np.array_split(inputs, num_chunks)
+
+        predictions = Parallel(n_jobs=n_jobs)(delayed(self.model.predict)(chunk) for chunk in chunks)
+        return np.concatenate(predictions)
+
+    def train(self, dataset: Dataset, should_print: bool = True, drop_incomplete_batches: bool = False) -> str:
         """
-        Fits the model to the dataset
+        Fits the model to the dataset. The model is fit on the entire training set,
+        so incomplete batches are never dropped.
         """
         # Load the metadata
         self.load_metadata(dataset)
@@ -90,41 +166,23 @@ class TraditionalModel(Model):
         self.make(is_train=True, is_frozen=False)
 
         # Fit the model on the training set
-        train_inputs: List[np.ndarray] = []
-        train_outputs: List[int] = []
-        train_generator = dataset.minibatch_generator(DataSeries.TRAIN,
-                                                      batch_size=self.hypers.batch_size,
-                                                      metadata=self.metadata,
-                                                      should_shuffle=False,
-                                                      drop_incomplete_batches=drop_incomplete_batches)
-        for batch in train_generator:
-            train_inputs.extend(batch[INPUTS])
-            train_outputs.extend(batch[OUTPUT])
-
-        train_inputs = np.reshape(train_inputs, newshape=(-1, self.metadata[INPUT_SHAPE]))
-        train_outputs = np.reshape(train_outputs, newshape=(-1))
-
-        print('Fitting the model...')
+        train_inputs, train_outputs = self.read_arrays(dataset, series=DataSeries.TRAIN)
+
+        if should_print:
+            print('Fitting the model...')
+
         self.model.fit(train_inputs, train_outputs)
-        print('Completed training. Starting validation...')
+
+        if should_print:
+            print('Completed training. Starting validation...')
 
         # Validate model on the validation set
-        valid_inputs: List[np.ndarray] = []
-        valid_outputs: List[int] = []
-        valid_generator = dataset.minibatch_generator(DataSeries.VALID,
-                                                      batch_size=self.hypers.batch_size,
-                                                      metadata=self.metadata,
-                                                      should_shuffle=False,
-                                                      drop_incomplete_batches=drop_incomplete_batches)
-        for batch in valid_generator:
-            valid_inputs.extend(batch[INPUTS])
-            valid_outputs.extend(batch[OUTPUT])
-
-        valid_inputs = np.reshape(valid_inputs, newshape=(-1, self.metadata[INPUT_SHAPE]))
-        valid_outputs = np.reshape(valid_outputs, newshape=(-1))
-        valid_accuracy = self.model.score(valid_inputs, valid_outputs)
-
-        print(f'Validation Accuracy: {valid_accuracy:.4f}')
+        valid_inputs, valid_outputs = self.read_arrays(dataset, series=DataSeries.VALID)
+        valid_predictions = self.predict_arrays(valid_inputs)
+        valid_accuracy = float(np.average(np.equal(valid_predictions, valid_outputs)))
+
+        if should_print:
+            print(f'Validation Accuracy: {valid_accuracy:.4f}')
 
         # Save results
         train_results = dict(valid_accuracy=valid_accuracy)
@@ -135,6 +193,36 @@ class TraditionalModel(Model):
 
         return name
 
+    def predict(self, dataset: Dataset,
+                test_batch_size: Optional[int],
+                max_num_batches: Optional[int],
+                series: DataSeries = DataSeries.TEST) -> DefaultDict[str, Dict[str, Any]]:
+        """
+        Predicts the entire series with a single (possibly parallel) call to the model.
+        """
+        inputs, labels = self.read_arrays(dataset, series=series)
+
+        # Match the number of samples used by batched prediction
+        if max_num_batches is not None:
+            test_batch_size = test_batch_size if test_batch_size is not None else self.hypers.batch_size
+            num_samples = (max_num_batches + 1) * test_batch_size
+            inputs, labels = inputs[:num_samples], labels[:num_samples]
+
+        predictions = self.predict_arrays(inputs)
+        return self.get_classification_metrics(predictions=predictions.reshape(-1, 1), labels=labels.reshape(-1, 1))
+
+    def get_classification_metrics(self, predictions: np.ndarray, labels: np.ndarray) -> DefaultDict[str, Dict[str, Any]]:
+        result: DefaultDict[str, Dict[str, float]] = defaultdict(dict)
+        for metric_name in ClassificationMetric:
+            if self.output_type == OutputType.BINARY_CLASSIFICATION:
+                metric_value = get_binary_classification_metric(metric_name, predictions, labels)
+            else:
+                metric_value = get_multi_classification_metric(metric_name, predictions, labels, self.metadata[NUM_CLASSES])
+
+            result[MODEL][metric_name.name] = metric_value
+
+        return result
+
     def predict_classification(self, test_batch_generator: Iterable[Dict[str, Any]],
                                test_batch_size: int,
                                max_num_batches: Optional[int]) -> DefaultDict[str, Dict[str, Any]]:
@@ -144,7 +232,7 @@ class TraditionalModel(Model):
         for batch_num, test_batch in enumerate(test_batch_generator):
 
             inputs = np.reshape(test_batch[INPUTS], newshape=(-1, self.metadata[INPUT_SHAPE]))
-            predictions = self.model.predict(inputs)
+            predictions = self.predict_arrays(inputs)
 
             labels_list.append(np.vstack(test_batch[OUTPUT]))
             predictions_list.append(np.vstack(predictions))
@@ -155,16 +243,7 @@ class TraditionalModel(Model):
         labels = np.vstack(labels_list)
         predictions = np.vstack(predictions_list)
 
-        result: DefaultDict[str, Dict[str, float]] = defaultdict(dict)
-        for metric_name in ClassificationMetric:
-            if self.output_type == OutputType.BINARY_CLASSIFICATION:
-                metric_value = get_binary_classification_metric(metric_name, predictions, labels)
-            else:
-                metric_value = get_multi_classification_metric(metric_name, predictions, labels, self.metadata[NUM_CLASSES])
-
-            result[MODEL][metric_name.name] = metric_value
-
-        return result
+        return self.get_classification_metrics(predictions=predictions, labels=labels)
 
     def save(self, name: str, data_folders: Dict[DataSeries, str], loss_ops: Optional[List[str]], loss_var_dict: Optional[Dict[str, List[str]]]):
         """
@@ -172,7 +251,7 @@ class TraditionalModel(Model):
         """
         # Save hyperparameters
         params_path = os.path.join(self.save_folder, HYPERS_PATH.format(name))
-        save_by_file_suffix(self.hypers.__dict__(), params_path)
+        save_by_file_suffix(self.hypers.as_dict(), params_path)
 
         # Save metadata
         data_folders_dict = {series.name: path for series, path in data_folders.items()}
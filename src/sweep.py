@@ -0,0 +1,401 @@
+import os
+import time
+import traceback
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple, Set
+
+from dataset.dataset import Dataset, DataSeries
+from dataset.dataset_factory import get_dataset
+from layers.output_layers import is_classification
+from models.model_factory import get_model
+from utils.constants import SWEEP_MANIFEST_PATH, TRAIN_LOG_PATH, VALID, BIG_NUMBER
+from utils.file_utils import save_by_file_suffix, read_by_file_suffix
+from utils.hyperparameters import HyperParameters
+from utils.resource_utils import init_pool_worker
+from train import train
+from test import test
+
+
+# A single configuration in the sweep. New models optionally warm-start from the given saved model.
+SweepTask = namedtuple('SweepTask', ['data_folder', 'params_file', 'trial', 'warm_start_path'], defaults=(None,))
+
+# Series evaluated after each model finishes training
+EVAL_SERIES = (DataSeries.VALID, DataSeries.TEST)
+
+# Datasets opened by this (worker) process. Datasets are only ever read by the workers, and
+# the npz data files are memory-mapped, so workers share the underlying pages through the OS.
+_worker_datasets: Dict[Tuple[str, str], Dataset] = dict()
+
+
+def get_worker_dataset(dataset_type: str, data_folder: str) -> Dataset:
+    """
+    Returns the dataset for the given folder, reusing datasets already opened by this process.
+    """
+    key = (dataset_type.lower(), data_folder)
+    if key not in _worker_datasets:
+        _worker_datasets[key] = get_dataset(dataset_type=dataset_type, data_folder=data_folder)
+
+    return _worker_datasets[key]
+
+
+def run_training_task(task: SweepTask, save_folder: str, should_print: bool, max_epochs: Optional[int]) -> Dict[str, Any]:
+    start_time = time.time()
+
+    try:
+        hypers = HyperParameters.create_from_file(task.params_file)
+        dataset = get_worker_dataset(hypers.dataset_type, task.data_folder)
+
+        name = train(data_folder=task.data_folder,
+                     save_folder=save_folder,
+                     hypers=hypers,
+                     should_print=should_print,
+                     max_epochs=max_epochs,
+                     dataset=dataset,
+                     warm_start_path=task.warm_start_path)
+        error = None
+    except Exception:
+        name = None
+        error = traceback.format_exc()
+
+    return dict(name=name, error=error, train_time=time.time() - start_time)
+
+
+def run_evaluation_task(name: str, task: SweepTask, save_folder: str, series: DataSeries) -> Dict[str, Any]:
+    start_time = time.time()
+
+    try:
+        hypers = HyperParameters.create_from_file(task.params_file)
+        dataset = get_worker_dataset(hypers.dataset_type, task.data_folder)
+
+        log_file = test(model_name=name,
+                        dataset_folder=task.data_folder,
+                        save_folder=save_folder,
+                        hypers=hypers,
+                        max_num_batches=None,
+                        batch_size=None,
+                        series=series,
+                        dataset=dataset)
+        error = None
+    except Exception:
+        log_file = None
+        error = traceback.format_exc()
+
+    return dict(log_file=log_file, error=error, eval_time=time.time() - start_time)
+
+
+def run_rung_task(task: SweepTask, name: Optional[str], save_folder: str, epochs: int, should_print: bool, max_epochs: Optional[int]) -> Dict[str, Any]:
+    """
+    Trains the given configuration up to the given (total) number of epochs. Training
+    resumes from the saved state when a name is given. Otherwise, the model warm-starts
+    from the task's warm start path (if any). The optional max_epochs overrides the configured
+    number of epochs, so the configuration finishes training once it is reached.
+    """
+    start_time = time.time()
+
+    try:
+        hypers = HyperParameters.create_from_file(task.params_file)
+        dataset = get_worker_dataset(hypers.dataset_type, task.data_folder)
+
+        if max_epochs is not None:
+            hypers.epochs = max_epochs
+
+        model = get_model(hypers, save_folder=save_folder, is_train=True)
+        name = model.train(dataset=dataset, should_print=should_print, name=name, max_epochs=epochs, warm_start_path=task.warm_start_path)
+
+        # Rank configurations by the best validation accuracy (classification) or the negated
+        # best validation loss (otherwise) so far. Higher metrics are always better.
+        train_log = read_by_file_suffix(os.path.join(save_folder, TRAIN_LOG_PATH.format(name)))
+        if is_classification(model.output_type):
+            valid_accuracy = train_log['accuracy'][VALID]
+            metric = max(valid_accuracy) if len(valid_accuracy) > 0 else 0.0
+        else:
+            valid_loss = train_log['loss'][VALID]
+            metric = -min(valid_loss) if len(valid_loss) > 0 else -BIG_NUMBER
+
+        result = dict(name=name,
+                      metric=metric,
+                      epochs=train_log['epochs'],
+                      finished=train_log['finished'],
+                      error=None)
+    except Exception:
+        result = dict(name=name, metric=None, epochs=None, finished=True, error=traceback.format_exc())
+
+    result['train_time'] = time.time() - start_time
+    return result
+
+
+def run_stop_task(task: SweepTask, name: str, save_folder: str) -> Dict[str, Any]:
+    """
+    Removes the training state of a configuration which was never promoted to completion. The best
+    model found so far is kept.
+    """
+    try:
+        hypers = HyperParameters.create_from_file(task.params_file)
+        model = get_model(hypers, save_folder=save_folder, is_train=True)
+        model.remove_train_state(name)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+
+    return dict(error=error)
+
+
+def save_manifest(save_folder: str, start_time: str, manifest: List[Dict[str, Any]], **kwargs: Any) -> str:
+    manifest_path = os.path.join(save_folder, SWEEP_MANIFEST_PATH.format(start_time))
+    save_by_file_suffix(dict(start_time=start_time,
+                             end_time=datetime.now().strftime('%Y-%m-%d-%H-%M-%S'),
+                             models=manifest,
+                             **kwargs), manifest_path)
+    return manifest_path
+
+
+def run_sweep(tasks: List[SweepTask],
+              save_folder: str,
+              num_workers: int,
+              should_print: bool,
+              max_epochs: Optional[int],
+              intra_op_threads: Optional[int] = None,
+              inter_op_threads: int = 1,
+              placement: str = 'compact') -> str:
+    """
+    Trains and evaluates all configurations using a pool of worker processes. Evaluations on the
+    validation and testing sets are scheduled as soon as the corresponding model finishes training.
+
+    Args:
+        tasks: The configurations to train
+        save_folder: Folder in which to save the models and logs
+        num_workers: Number of worker processes
+        should_print: Whether to print training progress
+        max_epochs: Optional maximum number of training epochs
+        intra_op_threads: Number of Tensorflow intra-op threads per worker. Defaults to an even split of the cores.
+        inter_op_threads: Number of Tensorflow inter-op threads per worker.
+        placement: The CPU placement policy (compact, spread or none) for the workers.
+    Returns:
+        The path to the sweep manifest.
+    """
+    assert num_workers > 0, 'Must provide a positive number of workers'
+
+    start_time = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+
+    # One entry per configuration. Entries are updated as the tasks complete.
+    manifest: List[Dict[str, Any]] = [dict(data_folder=task.data_folder, params_file=task.params_file, trial=task.trial, warm_start_path=task.warm_start_path) for task in tasks]
+
+    # Use spawned processes to avoid forking an initialized Tensorflow runtime
+    mp_context = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             mp_context=mp_context,
+                             initializer=init_pool_worker,
+                             initargs=(mp_context.Value('i', 0), num_workers, intra_op_threads, inter_op_threads, placement)) as executor:
+        pending: Dict[Future, Tuple[int, Optional[DataSeries]]] = dict()
+
+        for task_idx, task in enumerate(tasks):
+            future = executor.submit(run_training_task, task, save_folder, should_print, max_epochs)
+            pending[future] = (task_idx, None)
+
+        while len(pending) > 0:
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                task_idx, series = pending.pop(future)
+                result = future.result()
+                entry = manifest[task_idx]
+
+                if series is None:
+                    entry.update(result)
+                    print('Finished training {0}/{1}: {2}'.format(task_idx + 1, len(tasks), result['name'] if result['error'] is None else 'FAILED'))
+
+                    # Schedule the follow-up evaluations
+                    if result['error'] is None:
+                        for eval_series in EVAL_SERIES:
+                            eval_future = executor.submit(run_evaluation_task, result['name'], tasks[task_idx], save_folder, eval_series)
+                            pending[eval_future] = (task_idx, eval_series)
+                else:
+                    entry[series.name.lower()] = result
+
+    return save_manifest(save_folder=save_folder,
+                         start_time=start_time,
+                         manifest=manifest,
+                         num_workers=num_workers,
+                         intra_op_threads=intra_op_threads,
+                         inter_op_threads=inter_op_threads)
+
+
+class SuccessiveHalvingScheduler:
+    """
+    Asynchronous successive halving (ASHA). Rung k trains configurations for min_epochs * reduction_factor^k
+    epochs. Whenever a worker is free, the scheduler promotes a configuration in the top 1 / reduction_factor
+    of its rung (searching from the highest rung). Otherwise, it starts a new configuration in the lowest rung.
+    Configurations are never paused waiting for their rung to fill.
+    """
+
+    def __init__(self, num_tasks: int, min_epochs: int, reduction_factor: int):
+        assert min_epochs > 0, 'Must train for at least one epoch per rung'
+        assert reduction_factor > 1, 'The reduction factor must be greater than one'
+
+        self._num_tasks = num_tasks
+        self._min_epochs = min_epochs
+        self._reduction_factor = reduction_factor
+
+        self._next_task = 0
+        self._rung_results: List[Dict[int, float]] = []
+        self._promoted: List[Set[int]] = []
+        self._finished: Set[int] = set()
+
+    def rung_epochs(self, rung: int) -> int:
+        return self._min_epochs * (self._reduction_factor ** rung)
+
+    def get_job(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns the next (task index, rung) pair to train, or None if there is no available work.
+        """
+        for rung in reversed(range(len(self._rung_results))):
+            results = self._rung_results[rung]
+            num_promotable = int(len(results) / self._reduction_factor)
+
+            ranked = sorted(results.keys(), key=lambda idx: results[idx], reverse=True)
+            for task_idx in ranked[:num_promotable]:
+                if task_idx not in self._promoted[rung] and task_idx not in self._finished:
+                    self._promoted[rung].add(task_idx)
+                    return task_idx, rung + 1
+
+        if self._next_task < self._num_tasks:
+            task_idx = self._next_task
+            self._next_task += 1
+            return task_idx, 0
+
+        return None
+
+    def is_finished(self, task_idx: int) -> bool:
+        return task_idx in self._finished
+
+    def report(self, task_idx: int, rung: int, metric: Optional[float], is_finished: bool):
+        while len(self._rung_results) <= rung:
+            self._rung_results.append(dict())
+            self._promoted.append(set())
+
+        if metric is not None:
+            self._rung_results[rung][task_idx] = metric
+
+        if is_finished:
+            self._finished.add(task_idx)
+
+
+def run_successive_halving(tasks: List[SweepTask],
+                           save_folder: str,
+                           num_workers: int,
+                           min_epochs: int,
+                           reduction_factor: int,
+                           should_print: bool,
+                           max_epochs: Optional[int] = None,
+                           intra_op_threads: Optional[int] = None,
+                           inter_op_threads: int = 1,
+                           placement: str = 'compact') -> str:
+    """
+    Runs the sweep using asynchronous successive halving. Configurations are checkpointed between
+    rungs and resume from the saved training state when promoted. Configurations which finish training
+    (early stopping or the maximum number of epochs) are evaluated on the validation and testing sets.
+    Configurations which are never promoted to completion are recorded as stopped.
+
+    Args:
+        tasks: The configurations to train
+        save_folder: Folder in which to save the models and logs
+        num_workers: Number of worker processes
+        min_epochs: Number of epochs in the lowest rung
+        reduction_factor: The fraction (1 / reduction_factor) of configurations promoted from each rung
+        should_print: Whether to print training progress
+        max_epochs: Optional maximum number of training epochs. Rungs are capped at this number of epochs.
+        intra_op_threads: Number of Tensorflow intra-op threads per worker. Defaults to an even split of the cores.
+        inter_op_threads: Number of Tensorflow inter-op threads per worker.
+        placement: The CPU placement policy (compact, spread or none) for the workers.
+    Returns:
+        The path to the sweep manifest.
+    """
+    assert num_workers > 0, 'Must provide a positive number of workers'
+
+    start_time = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+
+    scheduler = SuccessiveHalvingScheduler(num_tasks=len(tasks), min_epochs=min_epochs, reduction_factor=reduction_factor)
+
+    manifest: List[Dict[str, Any]] = [dict(data_folder=task.data_folder, params_file=task.params_file, trial=task.trial, warm_start_path=task.warm_start_path, rungs=[]) for task in tasks]
+    names: Dict[int, str] = dict()
+
+    mp_context = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(max_workers=num_workers,
+                             mp_context=mp_context,
+                             initializer=init_pool_worker,
+                             initargs=(mp_context.Value('i', 0), num_workers, intra_op_threads, inter_op_threads, placement)) as executor:
+        pending: Dict[Future, Tuple[int, Optional[int], Optional[DataSeries]]] = dict()
+        num_training = 0
+
+        while True:
+            # Keep every worker busy with training jobs
+            while num_training < num_workers:
+                job = scheduler.get_job()
+                if job is None:
+                    break
+
+                task_idx, rung = job
+
+                epochs = scheduler.rung_epochs(rung)
+                if max_epochs is not None:
+                    epochs = min(epochs, max_epochs)
+
+                future = executor.submit(run_rung_task, tasks[task_idx], names.get(task_idx), save_folder, epochs, should_print, max_epochs)
+                pending[future] = (task_idx, rung, None)
+                num_training += 1
+
+            if len(pending) == 0:
+                break
+
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                task_idx, rung, series = pending.pop(future)
+                result = future.result()
+                entry = manifest[task_idx]
+
+                # Record the evaluation results
+                if series is not None:
+                    entry[series.name.lower()] = result
+                    continue
+
+                num_training -= 1
+                entry['rungs'].append(dict(rung=rung, **result))
+
+                if result['name'] is not None:
+                    names[task_idx] = result['name']
+                    entry['name'] = result['name']
+
+                scheduler.report(task_idx=task_idx, rung=rung, metric=result['metric'], is_finished=result['finished'])
+
+                if should_print:
+                    print('Finished rung {0} for task {1}: {2}'.format(rung, task_idx, result['metric']))
+
+                # Evaluate configurations which completed training
+                if result['finished'] and result['error'] is None:
+                    for eval_series in EVAL_SERIES:
+                        eval_future = executor.submit(run_evaluation_task, result['name'], tasks[task_idx], save_folder, eval_series)
+                        pending[eval_future] = (task_idx, None, eval_series)
+
+        # Configurations which were never promoted to completion are stopped. Their training
+        # state is removed, so they are not resumed.
+        stopped = [task_idx for task_idx in sorted(names.keys()) if not scheduler.is_finished(task_idx)]
+        stop_futures = [executor.submit(run_stop_task, tasks[task_idx], names[task_idx], save_folder) for task_idx in stopped]
+
+        for task_idx, future in zip(stopped, stop_futures):
+            manifest[task_idx]['stopped'] = True
+            manifest[task_idx]['stop_error'] = future.result()['error']
+
+    return save_manifest(save_folder=save_folder,
+                         start_time=start_time,
+                         manifest=manifest,
+                         num_workers=num_workers,
+                         min_epochs=min_epochs,
+                         reduction_factor=reduction_factor,
+                         intra_op_threads=intra_op_threads,
+                         inter_op_threads=inter_op_threads)
@@ -4,12 +4,14 @@ import sys
 from argparse import ArgumentParser
 from typing import Optional
 
-from models.model_factory import get_model
 from dataset.dataset_factory import get_dataset
-from dataset.dataset import DataSeries
+from dataset.dataset import DataSeries, Dataset
 from utils.hyperparameters import HyperParameters
+from utils.loading_utils import make_model
 from utils.file_utils import extract_model_name, read_by_file_suffix, save_by_file_suffix
 from utils.constants import HYPERS_PATH, TEST_LOG_PATH, TRAIN, VALID, TEST, METADATA_PATH, FINAL_TRAIN_LOG_PATH, FINAL_VALID_LOG_PATH
+from utils.resource_utils import add_resource_args, configure_from_args
+from utils.profiling import add_profiling_args, configure_profiling_from_args
 
 
 def model_test(path: str, batch_size: Optional[int], max_num_batches: Optional[int], dataset_folder: Optional[str], series: str):
@@ -41,13 +43,14 @@ def model_test(path: str, batch_size: Optional[int], max_num_batches: Optional[i
          series=DataSeries[series.upper()])
 
 
-def test(model_name: str, dataset_folder: str, save_folder: str, hypers: HyperParameters, batch_size: Optional[int], max_num_batches: Optional[int], series: DataSeries = DataSeries.TEST):
-    # Create the dataset
-    dataset = get_dataset(hypers.dataset_type, dataset_folder)
+def test(model_name: str, dataset_folder: str, save_folder: str, hypers: HyperParameters, batch_size: Optional[int], max_num_batches: Optional[int], series: DataSeries = DataSeries.TEST, dataset: Optional[Dataset] = None) -> str:
+    # Create the dataset. Datasets given by the caller are left open for reuse.
+    should_close = dataset is None
+    if dataset is None:
+        dataset = get_dataset(hypers.dataset_type, dataset_folder)
 
     # Build model and restore trainable parameters
-    model = get_model(hypers, save_folder=save_folder, is_train=False)
-    model.restore(name=model_name, is_train=False, is_frozen=False)
+    model = make_model(model_name=model_name, hypers=hypers, save_folder=save_folder)
 
     # Test the model
     print('Starting evaluation on {0} set...'.format(series.name.capitalize()))
@@ -56,7 +59,8 @@ def test(model_name: str, dataset_folder: str, save_folder: str, hypers: HyperPa
                                  max_num_batches=max_num_batches,
                                  series=series)
     # Close the dataset
-    dataset.close()
+    if should_close:
+        dataset.close()
 
     if series == DataSeries.TRAIN:
         result_file = os.path.join(save_folder, FINAL_TRAIN_LOG_PATH.format(model_name))
@@ -68,6 +72,8 @@ def test(model_name: str, dataset_folder: str, save_folder: str, hypers: HyperPa
     save_by_file_suffix([test_results], result_file)
     print('Completed evaluation.')
 
+    return result_file
+
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -76,6 +82,12 @@ if __name__ == '__main__':
     parser.add_argument('--max-num-batches', type=int)
     parser.add_argument('--dataset-folder', type=str)
     parser.add_argument('--series', type=str, default='test')
+    add_resource_args(parser)
+    add_profiling_args(parser)
     args = parser.parse_args()
 
+    # Pin the threads and cores when several processes share this host
+    configure_from_args(args)
+    configure_profiling_from_args(args)
+
     model_test(args.model_path, batch_size=args.batch_size, max_num_batches=args.max_num_batches, dataset_folder=args.dataset_folder, series=args.series)
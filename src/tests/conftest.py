@@ -0,0 +1,14 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+# The modules import each other relative to the source folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The tested controllers are pure NumPy and only import Tensorflow through the model modules,
+# so the tests stub Tensorflow when it is not installed
+try:
+    import tensorflow
+except ImportError:
+    for module_name in ('tensorflow', 'tensorflow.core', 'tensorflow.core.protobuf', 'tensorflow.python', 'tensorflow.python.framework', 'tensorflow.python.grappler'):
+        sys.modules[module_name] = MagicMock()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from controllers.model_controllers import BudgetOptimizer, levels_to_execute, get_level_counts
+from controllers.power_utils import PowerType, make_power_system
+from utils.constants import BIG_NUMBER
+
+
+def make_threshold_data(rand: np.random.RandomState, num_samples: int, num_levels: int):
+    # Rounding creates ties between samples and values on the candidate grid
+    stop_probs = np.round(rand.uniform(size=(num_samples, num_levels)) * 64) / 64
+    model_correct = (rand.uniform(size=(num_samples, num_levels)) < np.linspace(0.4, 0.9, num_levels)).astype(float)
+    return stop_probs, model_correct
+
+
+def reference_levels_to_execute(probs: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    The original (unchunked) implementation of levels_to_execute().
+    """
+    probs = np.expand_dims(probs, axis=0)
+    level_predictions = (probs > np.expand_dims(thresholds, axis=1)).astype(int)  # [S, B, L]
+
+    level_idx = np.arange(start=0, stop=thresholds.shape[-1])
+    index_mask = (1.0 - level_predictions) * BIG_NUMBER + level_idx  # [S, B, L]
+    levels = np.min(index_mask, axis=-1)  # [S, B]
+    return np.minimum(levels, thresholds.shape[-1] - 1).astype(int)
+
+
+@pytest.mark.parametrize('num_levels,precision,power_type', [(4, 5, PowerType.TEMP), (10, 8, PowerType.BLUETOOTH)])
+def test_candidate_losses_match_loss_function(num_levels: int, precision: int, power_type: PowerType):
+    rand = np.random.RandomState(num_levels)
+    stop_probs, model_correct = make_threshold_data(rand, num_samples=400, num_levels=num_levels)
+
+    power_system = make_power_system(power_type, num_levels=num_levels, seq_length=2 * num_levels)
+    budget = (power_system.get_min_power() + power_system.get_max_power()) / 2
+    optimizer = BudgetOptimizer(budgets=np.array([budget]), power_system=power_system, precision=precision, trials=1, max_iter=1, patience=1)
+
+    candidates = np.arange(1 << precision) / (1 << precision)
+    thresholds = np.round(rand.uniform(size=num_levels) * 32) / 32
+
+    for level in range(num_levels - 1):
+        losses, powers = optimizer.candidate_losses(thresholds=thresholds,
+                                                    level=level,
+                                                    candidates=candidates,
+                                                    budget=budget,
+                                                    model_correct=model_correct,
+                                                    stop_probs=stop_probs)
+
+        candidate_thresholds = np.repeat(np.expand_dims(thresholds, axis=0), len(candidates), axis=0)
+        candidate_thresholds[:, level] = candidates
+        expected_losses, expected_powers = optimizer.loss_function(thresholds=candidate_thresholds,
+                                                                   budgets=np.full(len(candidates), budget),
+                                                                   model_correct=model_correct,
+                                                                   stop_probs=stop_probs)
+
+        assert np.array_equal(losses, expected_losses)
+        assert np.array_equal(powers, expected_powers)
+
+
+@pytest.mark.parametrize('max_chunk_size,num_threads', [(1 << 24, 1), (300 * 10 * 3, 1), (70, 1), (70, 4), (1, 4)])
+def test_levels_to_execute_matches_reference(max_chunk_size: int, num_threads: int):
+    rand = np.random.RandomState(1)
+    probs = np.round(rand.uniform(size=(300, 10)) * 16) / 16
+    thresholds = np.round(rand.uniform(size=(17, 10)) * 16) / 16
+    thresholds[:, -1] = rand.choice([0, 1], size=17)
+
+    levels = levels_to_execute(probs, thresholds, max_chunk_size=max_chunk_size, num_threads=num_threads)
+    expected = reference_levels_to_execute(probs, thresholds)
+
+    assert levels.dtype == expected.dtype
+    assert np.array_equal(levels, expected)
+
+    expected_counts = np.stack([np.bincount(row, minlength=10) for row in expected])
+    assert np.array_equal(get_level_counts(levels, num_levels=10), expected_counts)
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+from controllers.power_utils import PowerType, make_power_system
+
+
+SOURCE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('power_type', list(PowerType))
+def test_power_tables_match_direct_computation(power_type: PowerType):
+    num_levels = 5
+    power_system = make_power_system(power_type, num_levels=num_levels, seq_length=20)
+
+    for level in range(1, num_levels + 1):
+        assert power_system.get_avg_power(level) == power_system._compute_avg_power(level)
+
+    rand = np.random.RandomState(2)
+    for _ in range(10):
+        num_levels_per_sample = rand.randint(low=1, high=num_levels + 1, size=50)
+
+        # The original computation of the weighted average power
+        counts = np.bincount(num_levels_per_sample, minlength=num_levels + 1)
+        weights = counts.astype(float) / np.sum(counts)
+        expected = power_system.get_weighted_avg_power(weights[1:])
+
+        assert power_system.get_avg_power_multiple(num_levels_per_sample) == expected
+        assert power_system.avg_power_for_levels(np.expand_dims(num_levels_per_sample - 1, axis=0))[0] == expected
+
+
+def test_avg_power_multiple_counts_empty_episodes():
+    # Episodes without levels only pass the argument checks when assertions are disabled
+    script = '\n'.join(['import numpy as np',
+                        'from controllers.power_utils import PowerType, make_power_system',
+                        'power_system = make_power_system(PowerType.TEMP, num_levels=5, seq_length=20)',
+                        'print(repr(float(power_system.get_avg_power_multiple(np.array([0, 0, 0])))))',
+                        'print(repr(float(power_system.get_avg_power_multiple(np.array([0, 2, 5, 0])))))'])
+    output = subprocess.run([sys.executable, '-O', '-c', script], cwd=SOURCE_FOLDER, stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').split()
+
+    # The original computation counts empty episodes in the denominator
+    power_system = make_power_system(PowerType.TEMP, num_levels=5, seq_length=20)
+    counts = np.bincount(np.array([0, 2, 5, 0]), minlength=6)
+    expected = power_system.get_weighted_avg_power(counts[1:].astype(float) / np.sum(counts))
+
+    assert float(output[0]) == 0.0
+    assert np.isclose(float(output[1]), expected)
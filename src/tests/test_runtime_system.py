@@ -0,0 +1,117 @@
+import os
+import numpy as np
+import pytest
+
+from controllers.controller_utils import ModelResults
+from controllers.model_controllers import CONTROLLER_PATH, levels_to_execute
+from controllers.noise_generators import get_noise_generator
+from controllers.power_utils import PowerType, make_power_system
+from controllers.runtime_system import RuntimeSystem, SystemType
+from utils.file_utils import save_pickle_gz
+from utils.np_utils import round_to_precision
+
+
+NUM_LEVELS = 5
+NUM_CLASSES = 4
+SEQ_LENGTH = 20
+MAX_TIME = 500
+NUM_BUDGETS = 6
+MODEL_NAME = 'RNN-test-model_best'
+
+
+def make_results(rand: np.random.RandomState, num_samples: int) -> ModelResults:
+    labels = rand.randint(low=0, high=NUM_CLASSES, size=num_samples)
+    is_correct = rand.uniform(size=(num_samples, NUM_LEVELS)) < np.linspace(0.4, 0.9, NUM_LEVELS)
+    predictions = np.where(is_correct, np.expand_dims(labels, axis=-1), rand.randint(low=0, high=NUM_CLASSES, size=(num_samples, NUM_LEVELS)))
+    stop_probs = np.round(rand.uniform(size=(num_samples, NUM_LEVELS)) * 64) / 64
+    return ModelResults(predictions=predictions, labels=labels, stop_probs=stop_probs, accuracy=np.mean(is_correct, axis=0))
+
+
+@pytest.fixture(scope='module')
+def saved_model(tmp_path_factory):
+    """
+    Writes the hyperparameters, metadata and a fitted adaptive controller for a synthetic model.
+    Returns the model path, the budgets and the validation and testing results.
+    """
+    rand = np.random.RandomState(3)
+    folder = str(tmp_path_factory.mktemp('model'))
+
+    model_path = os.path.join(folder, 'model-{0}.pkl.gz'.format(MODEL_NAME))
+    save_pickle_gz({'model': 'RNN', 'model_params': {'num_outputs': NUM_LEVELS}}, os.path.join(folder, 'model-hyper-params-{0}.pkl.gz'.format(MODEL_NAME)))
+    save_pickle_gz({'metadata': {'seq_length': SEQ_LENGTH, 'num_classes': NUM_CLASSES}}, os.path.join(folder, 'model-metadata-{0}.pkl.gz'.format(MODEL_NAME)))
+
+    valid_results, test_results = make_results(rand, num_samples=1000), make_results(rand, num_samples=MAX_TIME)
+
+    power_system = make_power_system(PowerType.TEMP, num_levels=NUM_LEVELS, seq_length=SEQ_LENGTH)
+    budgets = np.linspace(power_system.get_min_power() * 1.05, power_system.get_max_power() * 0.95, NUM_BUDGETS)
+
+    thresholds = round_to_precision(np.sort(rand.uniform(size=(NUM_BUDGETS, NUM_LEVELS)), axis=0)[::-1], 7)
+    thresholds[:, -1] = 0
+
+    levels = levels_to_execute(valid_results.stop_probs, thresholds)  # [S, B]
+    level_counts = np.stack([np.bincount(row, minlength=NUM_LEVELS) for row in levels]) / levels.shape[1]
+
+    def label_distribution(budget_levels: np.ndarray):
+        predictions = valid_results.predictions[np.arange(len(budget_levels)), budget_levels]
+        return {label: np.bincount(budget_levels, minlength=NUM_LEVELS, weights=(predictions == label).astype(float)) for label in range(NUM_CLASSES)}
+
+    controller = dict(budgets=budgets,
+                      thresholds=thresholds,
+                      trials=1,
+                      is_fitted=True,
+                      model_path=model_path,
+                      dataset_folder=None,
+                      precision=7,
+                      avg_level_counts=level_counts,
+                      est_accuracy=rand.uniform(size=NUM_BUDGETS),
+                      stop_means=None,
+                      stop_std=None,
+                      label_distribution={budget: label_distribution(levels[i]) for i, budget in enumerate(budgets)},
+                      lowest_distribution=label_distribution(np.zeros(levels.shape[1], dtype=int)),
+                      highest_distribution=label_distribution(np.full(levels.shape[1], NUM_LEVELS - 1)),
+                      power_system_type='TEMP')
+    save_pickle_gz(controller, os.path.join(folder, CONTROLLER_PATH.format('temp', MODEL_NAME)))
+
+    return model_path, budgets, valid_results, test_results
+
+
+def make_system(saved_model, system_type: SystemType) -> RuntimeSystem:
+    model_path, _, valid_results, test_results = saved_model
+    return RuntimeSystem(valid_results=valid_results,
+                         test_results=test_results,
+                         system_type=system_type,
+                         model_path=model_path,
+                         dataset_folder=None,
+                         seq_length=SEQ_LENGTH,
+                         num_levels=NUM_LEVELS,
+                         num_classes=NUM_CLASSES,
+                         power_system_type=PowerType.TEMP)
+
+
+@pytest.mark.parametrize('system_type', list(SystemType))
+@pytest.mark.parametrize('noise_params', [dict(noise_type='gaussian', loc=0.5, scale=0.05),
+                                          dict(noise_type='sin', loc=0.0, scale=0.05, period=50, amplitude=0.3)])
+def test_simulate_matches_step(saved_model, system_type: SystemType, noise_params):
+    _, budgets, _, _ = saved_model
+    power_system = make_power_system(PowerType.TEMP, num_levels=NUM_LEVELS, seq_length=SEQ_LENGTH)
+
+    stepwise_system = make_system(saved_model, system_type)
+    batched_system = make_system(saved_model, system_type)
+
+    # Include budgets between the fitted budgets and outside of the feasible range
+    test_budgets = [budgets[1] + 0.013, budgets[2], power_system.get_min_power() * 0.9, power_system.get_max_power() * 1.1]
+
+    for noise_generator in get_noise_generator(noise_params, max_time=MAX_TIME):
+        noise = np.array([noise_generator.get_noise(t=t) for t in range(MAX_TIME)])
+
+        for budget in test_budgets:
+            stepwise_system.init_for_budget(budget=budget, max_time=MAX_TIME)
+            for t in range(MAX_TIME):
+                stepwise_system.step(budget=budget, power_noise=noise[t], t=t)
+
+            batched_system.simulate(budget=budget, noise=noise, max_time=MAX_TIME)
+
+            assert np.array_equal(stepwise_system.get_energy(), batched_system.get_energy())
+            assert np.array_equal(stepwise_system.get_num_correct(), batched_system.get_num_correct())
+            assert np.array_equal(stepwise_system.get_target_budgets(), batched_system.get_target_budgets())
+            assert np.array_equal(stepwise_system.get_levels(), batched_system.get_levels())
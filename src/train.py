@@ -1,31 +1,42 @@
 import os.path
+import sys
 from argparse import ArgumentParser
 from datetime import datetime
 
 from utils.hyperparameters import HyperParameters
-from utils.constants import TRAIN, VALID, TEST
-from utils.file_utils import read_by_file_suffix, make_dir, iterate_files
+from utils.constants import TRAIN, VALID, TEST, HYPERS_PATH, METADATA_PATH
+from utils.file_utils import read_by_file_suffix, make_dir, iterate_files, extract_model_name
+from utils.profiling import add_profiling_args, configure_profiling_from_args
 from models.model_factory import get_model
+from models.tf_model import TFModel
 from dataset.dataset_factory import get_dataset
-from dataset.dataset import DataSeries
+from dataset.dataset import DataSeries, Dataset
 from typing import Optional, Dict, List
 from test import test
 
 
-def train(data_folder: str, save_folder: str, hypers: HyperParameters, should_print: bool, max_epochs: Optional[int] = None) -> str:
+def train(data_folder: str, save_folder: str, hypers: HyperParameters, should_print: bool, max_epochs: Optional[int] = None, dataset: Optional[Dataset] = None,
+          name: Optional[str] = None, warm_start_path: Optional[str] = None) -> str:
     model = get_model(hypers, save_folder=save_folder, is_train=True)
 
-    # Create dataset
-    dataset = get_dataset(hypers.dataset_type, data_folder)
+    # Create dataset. Datasets given by the caller are left open for reuse.
+    should_close = dataset is None
+    if dataset is None:
+        dataset = get_dataset(hypers.dataset_type, data_folder)
 
     if max_epochs is not None:
         hypers.epochs = max_epochs
 
-    # Train the model
-    train_label = model.train(dataset=dataset, should_print=should_print)
+    # Train the model. Only neural networks can resume or warm-start training.
+    if name is None and warm_start_path is None:
+        train_label = model.train(dataset=dataset, should_print=should_print)
+    else:
+        assert isinstance(model, TFModel), 'Can only resume or warm-start neural network models'
+        train_label = model.train(dataset=dataset, should_print=should_print, name=name, warm_start_path=warm_start_path)
 
     # Close the dataset files
-    dataset.close()
+    if should_close:
+        dataset.close()
 
     return train_label
 
@@ -38,8 +49,40 @@ if __name__ == '__main__':
     parser.add_argument('--trials', type=int, default=1)
     parser.add_argument('--should-print', action='store_true')
     parser.add_argument('--testrun', action='store_true')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes. Values above one run the sweep in parallel.')
+    parser.add_argument('--halving-min-epochs', type=int, help='Epochs in the first rung of successive halving. Enables successive halving.')
+    parser.add_argument('--halving-reduction-factor', type=int, default=3, help='Only the top 1 / factor of each rung is promoted.')
+    parser.add_argument('--placement', type=str, choices=['compact', 'spread', 'none'], default='compact', help='CPU placement of the sweep workers.')
+    parser.add_argument('--resume', type=str, help='Path to a saved model (model-*.pkl.gz). Continues training this model with its own hyperparameters.')
+    parser.add_argument('--warm-start', type=str, help='Path to a saved model (model-*.pkl.gz). New models load all compatible weights from this model.')
+    add_profiling_args(parser)
     args = parser.parse_args()
 
+    configure_profiling_from_args(args)
+
+    # Resume training of an existing model
+    if args.resume is not None:
+        resume_folder, model_file = os.path.split(args.resume)
+        model_name = extract_model_name(model_file)
+        assert model_name is not None, f'Could not extract name from file: {model_file}'
+
+        hypers = HyperParameters.create_from_file(os.path.join(resume_folder, HYPERS_PATH.format(model_name)))
+
+        # Default to the data folder used to train the model
+        if args.data_folders is not None and len(args.data_folders) > 0:
+            data_folder = os.path.abspath(args.data_folders[0])
+        else:
+            metadata = read_by_file_suffix(os.path.join(resume_folder, METADATA_PATH.format(model_name)))
+            data_folder = os.path.dirname(metadata['data_folders'][TRAIN.upper()])
+
+        name = train(data_folder=data_folder,
+                     save_folder=resume_folder,
+                     hypers=hypers,
+                     should_print=args.should_print,
+                     name=model_name)
+        print(f'Resumed training of {name}')
+        sys.exit(0)
+
     assert args.params_files is not None and len(args.params_files) > 0, f'Must provide at least one set of parameters'
 
     max_epochs = 1 if args.testrun else None
@@ -81,6 +124,35 @@ if __name__ == '__main__':
     save_folder = os.path.join(base_save_folder, current_day)
     make_dir(save_folder)
 
+    # Run the sweep using a pool of worker processes
+    if args.workers > 1 or args.halving_min_epochs is not None:
+        # Imported here because the sweep module imports this module
+        from sweep import SweepTask, run_sweep, run_successive_halving
+
+        warm_start_path = os.path.abspath(args.warm_start) if args.warm_start is not None else None
+        tasks = [SweepTask(data_folder=os.path.abspath(data_folder), params_file=params_file, trial=trial, warm_start_path=warm_start_path)
+                 for data_folder in args.data_folders for trial in range(trials) for params_file in params_files]
+
+        if args.halving_min_epochs is not None:
+            manifest_path = run_successive_halving(tasks=tasks,
+                                                   save_folder=save_folder,
+                                                   num_workers=args.workers,
+                                                   min_epochs=args.halving_min_epochs,
+                                                   reduction_factor=args.halving_reduction_factor,
+                                                   should_print=args.should_print,
+                                                   max_epochs=max_epochs,
+                                                   placement=args.placement)
+        else:
+            manifest_path = run_sweep(tasks=tasks,
+                                      save_folder=save_folder,
+                                      num_workers=args.workers,
+                                      should_print=args.should_print,
+                                      max_epochs=max_epochs,
+                                      placement=args.placement)
+
+        print('Wrote sweep manifest to {0}'.format(manifest_path))
+        sys.exit(0)
+
     for data_folder in args.data_folders:
         print(f'Started {data_folder}')
         print('====================')
@@ -101,7 +173,8 @@ if __name__ == '__main__':
                              save_folder=save_folder,
                              hypers=hypers,
                              should_print=args.should_print,
-                             max_epochs=max_epochs)
+                             max_epochs=max_epochs,
+                             warm_start_path=args.warm_start)
 
                 print('==========')
                 # Collect Results from the validation set
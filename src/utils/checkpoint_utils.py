@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Dict
+
+from utils.file_utils import save_by_file_suffix
+from utils.profiling import timed
+
+
+@timed('checkpoint.write')
+def atomic_save(data: Any, file_path: str):
+    """
+    Saves the data to the given path by writing to a temporary file and renaming. Readers
+    therefore never observe partially-written files.
+    """
+    folder, file_name = os.path.split(file_path)
+
+    # The temporary file keeps the original suffix because the format is inferred from the suffix
+    temp_path = os.path.join(folder, '.tmp-{0}-{1}'.format(os.getpid(), file_name))
+    save_by_file_suffix(data, temp_path)
+    os.replace(temp_path, file_path)
+
+
+class AsyncCheckpointWriter:
+    """
+    Writes checkpoints from a background thread. Pending writes to the same path are coalesced,
+    so only the most recent data for each path is written when the writer falls behind.
+    """
+
+    def __init__(self):
+        self._pending: OrderedDict = OrderedDict()  # Maps file paths to data
+        self._condition = threading.Condition()
+        self._is_writing = False
+        self._is_closed = False
+        self._error: Optional[BaseException] = None
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, data: Any, file_path: str):
+        """
+        Schedules the data to be written to the given path. The data must not be modified afterwards.
+        """
+        with self._condition:
+            assert not self._is_closed, 'Cannot submit to a closed writer'
+            self._raise_error()
+
+            self._pending.pop(file_path, None)
+            self._pending[file_path] = data
+            self._condition.notify_all()
+
+    def flush(self):
+        """
+        Blocks until all pending checkpoints are written.
+        """
+        with self._condition:
+            while len(self._pending) > 0 or self._is_writing:
+                self._condition.wait()
+
+            self._raise_error()
+
+    def close(self):
+        self.flush()
+
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+
+        self._thread.join()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._pending) == 0 and not self._is_closed:
+                    self._condition.wait()
+
+                if len(self._pending) == 0 and self._is_closed:
+                    return
+
+                file_path, data = self._pending.popitem(last=False)
+                self._is_writing = True
+
+            try:
+                atomic_save(data, file_path)
+            except BaseException as ex:
+                with self._condition:
+                    self._error = ex
+            finally:
+                with self._condition:
+                    self._is_writing = False
+                    self._condition.notify_all()
@@ -65,7 +65,16 @@ HYPERS_PATH = 'model-hyper-params-{0}.pkl.gz'
 METADATA_PATH = 'model-metadata-{0}.pkl.gz'
 MODEL_PATH = 'model-{0}.pkl.gz'
 TRAIN_LOG_PATH = 'model-train-log-{0}.pkl.gz'
+INFERENCE_GRAPH_PATH = 'model-inference-graph-{0}.pkl.gz'
+TRAIN_STATE_PATH = 'model-train-state-{0}.pkl.gz'
+TRAIN_CHECKPOINT_PATH = 'model-train-checkpoint-{0}'
 FINAL_VALID_LOG_PATH = 'model-final-valid-log-{0}.jsonl.gz'
 FINAL_TRAIN_LOG_PATH = 'model-final-train-log-{0}.jsonl.gz'
 TEST_LOG_PATH = 'model-test-log-{0}.jsonl.gz'
 MODEL_NAME_REGEX = r'^model-([^\.]+)(\.pkl\.gz)?$'
+SWEEP_MANIFEST_PATH = 'sweep-manifest-{0}.json'
+EVAL_CACHE_PATH = 'eval-cache-{0}-{1}'
+
+# Environment variables for Tensorflow threading
+INTRA_OP_THREADS_ENV = 'TF_INTRA_OP_THREADS'
+INTER_OP_THREADS_ENV = 'TF_INTER_OP_THREADS'
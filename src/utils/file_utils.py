@@ -3,11 +3,12 @@ import gzip
 import json
 import codecs
 import pickle
+import hashlib
 import os
 import numpy as np
 
 from collections import OrderedDict
-from typing import Union, Optional, Iterable, Any
+from typing import Union, Optional, Iterable, Any, List
 
 from .constants import MODEL_NAME_REGEX
 
@@ -130,12 +131,29 @@ def read_npz(file_path: str) -> Any:
     return np.load(file_path)
 
 
-def save_npz(data: Any, file_path: str):
+def save_npz(data: Any, file_path: str, compressed: bool = True):
     assert file_path.endswith('.npz'), 'Must provide a npz file.'
+    save_fn = np.savez_compressed if compressed else np.savez
+
     if isinstance(data, dict):
-        np.savez_compressed(file_path, **data)
+        save_fn(file_path, **data)
     else:
-        np.savez_compressed(file_path, data)
+        save_fn(file_path, data)
+
+
+def hash_files(file_paths: List[str], chunk_size: int = 1 << 20) -> str:
+    """
+    Returns the SHA-1 hash of the contents of the given files (in order).
+    """
+    hasher = hashlib.sha1()
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            chunk = f.read(chunk_size)
+            while len(chunk) > 0:
+                hasher.update(chunk)
+                chunk = f.read(chunk_size)
+
+    return hasher.hexdigest()
 
 
 def extract_model_name(model_file: str) -> Optional[str]:
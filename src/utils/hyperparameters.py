@@ -17,7 +17,7 @@ class HyperParameters:
         self.optimizer = parameters.get('optimizer', 'adam')
         self.batch_size = parameters.get('batch_size', 1000)
         self.epochs = parameters.get('epochs', 10)
-        self.patience = parameters.get('patience', 5)
+        self.patience = parameters.get('patience', 5)  # Epochs without a validation improvement before early stopping
         self.model = parameters.get('model')
         self.model_params = parameters.get('model_params', dict())
         self.input_noise = parameters.get('input_noise', 0.0)
@@ -25,6 +25,19 @@ class HyperParameters:
         self.dataset_type = parameters.get('dataset_type', 'standard')
         self.seq_length = parameters.get('seq_length')
 
+        # Validation cadence. Step-based validation (if given) takes precedence over the epoch frequency.
+        # Epochs without a validation count towards the patience.
+        self.validation_frequency = parameters.get('validation_frequency', 1)
+        self.validation_steps = parameters.get('validation_steps')
+        self.concurrent_validation = parameters.get('concurrent_validation', False)
+
+        # Tensorflow thread counts. By default, these are read from the environment (see utils/resource_utils.py).
+        self.intra_op_threads = parameters.get('intra_op_threads')
+        self.inter_op_threads = parameters.get('inter_op_threads')
+
+        # Number of epochs between saved training states. By default, the state is only saved when training stops.
+        self.checkpoint_frequency = parameters.get('checkpoint_frequency')
+
     def as_dict(self) -> Dict[str, Any]:
         return {
             'epochs': self.epochs,
@@ -41,7 +54,13 @@ class HyperParameters:
             'input_noise': self.input_noise,
             'batch_noise': self.batch_noise,
             'dataset_type': self.dataset_type,
-            'seq_length': self.seq_length
+            'seq_length': self.seq_length,
+            'validation_frequency': self.validation_frequency,
+            'validation_steps': self.validation_steps,
+            'concurrent_validation': self.concurrent_validation,
+            'checkpoint_frequency': self.checkpoint_frequency,
+            'intra_op_threads': self.intra_op_threads,
+            'inter_op_threads': self.inter_op_threads
         }
 
     def __str__(self) -> str:
@@ -1,10 +1,12 @@
 import os.path
-from typing import Tuple, Optional, Dict, Any
+from collections import OrderedDict
+from typing import Tuple, Optional, Dict, Any, List
 
 from dataset.dataset import Dataset
 from dataset.dataset_factory import get_dataset
 from models.base_model import Model
 from models.model_factory import get_model
+from models.tf_model import TFModel
 
 from .constants import TRAIN, METADATA_PATH, HYPERS_PATH
 from .file_utils import read_by_file_suffix, extract_model_name
@@ -32,7 +34,7 @@ def get_metadata(model_path: str) -> Dict[str, Any]:
     return read_by_file_suffix(metadata_file)['metadata']
 
 
-def make_dataset(model_name: str, save_folder: str, dataset_type: str, dataset_folder: Optional[str]) -> Dataset:
+def make_dataset(model_name: str, save_folder: str, dataset_type: str, dataset_folder: Optional[str], cache_folder: Optional[str] = None) -> Dataset:
     metadata_file = os.path.join(save_folder, METADATA_PATH.format(model_name))
     metadata = read_by_file_suffix(metadata_file)
 
@@ -43,16 +45,161 @@ def make_dataset(model_name: str, save_folder: str, dataset_type: str, dataset_f
     # Validate the dataset folder
     assert os.path.exists(dataset_folder), 'The dataset folder {0} does not exist!'.format(dataset_folder)
 
-    return get_dataset(dataset_type=dataset_type, data_folder=dataset_folder)
+    return get_dataset(dataset_type=dataset_type, data_folder=dataset_folder, cache_folder=cache_folder)
 
 
 def make_model(model_name: str, hypers: HyperParameters, save_folder: str) -> Model:
     model = get_model(hypers, save_folder, is_train=False)
-    model.restore(name=model_name, is_train=False, is_frozen=False)
+
+    # Neural networks are restored into a pruned (and cached) inference graph
+    if isinstance(model, TFModel):
+        model.restore_for_inference(name=model_name)
+    else:
+        model.restore(name=model_name, is_train=False, is_frozen=False)
+
     return model
 
 
-def restore_neural_network(model_path: str, dataset_folder: Optional[str]) -> Tuple[Model, Dataset]:
+# Default bounds on the process-local cache of restored models
+RESTORE_CACHE_ENTRIES = 8
+RESTORE_CACHE_BYTES = 1 << 30
+
+
+CacheKey = Tuple[str, Optional[str]]
+
+
+class RestoredModelCache:
+    """
+    LRU cache of restored (model, dataset) pairs keyed by the model path and dataset folder. The cache
+    is bounded by both the number of entries and the (approximate) memory of the restored models. Evicting
+    an entry only drops the cache's reference; callers may still hold the model and dataset, so the session
+    and data files are released by garbage collection once the last reference goes away.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        assert max_entries > 0, 'Must be able to cache at least one model'
+
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()  # Maps keys to (model, dataset, size) triples
+        self._total_bytes = 0
+
+    @property
+    def num_entries(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def set_limits(self, max_entries: int, max_bytes: int):
+        assert max_entries > 0, 'Must be able to cache at least one model'
+
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._shrink()
+
+    def get(self, key: CacheKey) -> Optional[Tuple[Model, Dataset]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        return entry[0], entry[1]
+
+    def put(self, key: CacheKey, model: Model, dataset: Dataset, model_path: str):
+        self.evict(key)
+
+        size = estimate_model_bytes(model, model_path)
+        self._entries[key] = (model, dataset, size)
+        self._total_bytes += size
+
+        self._shrink()
+
+    def evict(self, key: CacheKey):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        self._total_bytes -= entry[2]
+
+    def keys(self) -> List[CacheKey]:
+        return list(self._entries.keys())
+
+    def clear(self):
+        for key in self.keys():
+            self.evict(key)
+
+    def _shrink(self):
+        # Always keep the most recent entry, even if it exceeds the memory bound on its own
+        while len(self._entries) > 1 and (len(self._entries) > self._max_entries or self._total_bytes > self._max_bytes):
+            oldest_key = next(iter(self._entries.keys()))
+            self.evict(oldest_key)
+
+
+def estimate_model_bytes(model: Model, model_path: str) -> int:
+    """
+    Estimates the memory used by the given restored model. For neural networks, we use the size of the
+    serialized graph (inference graphs hold all weights as constants). Otherwise, we fall back to the
+    size of the saved model file.
+    """
+    if isinstance(model, TFModel):
+        return model.sess.graph_def.ByteSize()
+
+    return os.path.getsize(model_path) if os.path.exists(model_path) else 0
+
+
+_restore_cache = RestoredModelCache(max_entries=RESTORE_CACHE_ENTRIES, max_bytes=RESTORE_CACHE_BYTES)
+
+
+def get_restore_cache() -> RestoredModelCache:
+    return _restore_cache
+
+
+def make_restore_key(model_path: str, dataset_folder: Optional[str]) -> CacheKey:
+    folder = os.path.abspath(dataset_folder) if dataset_folder is not None else None
+    return os.path.abspath(model_path), folder
+
+
+def evict_restored_model(model_path: str, dataset_folder: Optional[str] = None):
+    """
+    Evicts the given model from the restored-model cache. When no dataset folder is
+    given, all entries for this model are removed.
+    """
+    if dataset_folder is not None:
+        _restore_cache.evict(make_restore_key(model_path, dataset_folder))
+        return
+
+    abs_model_path = os.path.abspath(model_path)
+    for key in _restore_cache.keys():
+        if key[0] == abs_model_path:
+            _restore_cache.evict(key)
+
+
+def clear_restored_models():
+    _restore_cache.clear()
+
+
+def restore_neural_network(model_path: str, dataset_folder: Optional[str], use_cache: bool = True) -> Tuple[Model, Dataset]:
+    """
+    Restores the model and dataset at the given paths. With use_cache, the returned objects are shared
+    with every other caller restoring the same model, so callers must NOT close the returned session or dataset.
+    """
+    if use_cache:
+        key = make_restore_key(model_path, dataset_folder)
+
+        cached = _restore_cache.get(key)
+        if cached is not None:
+            return cached
+
+        model, dataset = _restore_neural_network(model_path, dataset_folder)
+        _restore_cache.put(key, model=model, dataset=dataset, model_path=model_path)
+        return model, dataset
+
+    return _restore_neural_network(model_path, dataset_folder)
+
+
+def _restore_neural_network(model_path: str, dataset_folder: Optional[str]) -> Tuple[Model, Dataset]:
     save_folder, model_file = os.path.split(model_path)
 
     model_name = extract_model_name(model_file)
@@ -0,0 +1,225 @@
+"""
+Lightweight profiling of the pipeline stages (e.g. data loading, tensorization and session calls).
+Profiling is disabled by default. When disabled, timed stages and counters only check a single
+global, so the instrumentation may remain in hot loops.
+"""
+import atexit
+import inspect
+import json
+import os
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from functools import wraps
+from typing import Any, Callable, DefaultDict, Dict, List, Optional
+
+
+# Bound on the number of trace events to limit memory. The per-stage totals are always complete.
+MAX_TRACE_EVENTS = 1000000
+
+
+class StageStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        self.min = min(self.min, elapsed)
+        self.max = max(self.max, elapsed)
+
+    def as_dict(self, wall_time: float) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'avg': self.total / max(self.count, 1),
+            'min': self.min if self.count > 0 else 0.0,
+            'max': self.max,
+            'fraction': self.total / max(wall_time, 1e-9)
+        }
+
+
+class Profiler:
+    """
+    Records the time spent in each named stage, named counters and (optionally) one trace event per timed call.
+    Stage times are inclusive, so nested stages are also counted in their enclosing stages.
+    """
+
+    def __init__(self, record_trace: bool = True, max_trace_events: int = MAX_TRACE_EVENTS):
+        self._stages: DefaultDict[str, StageStats] = defaultdict(StageStats)
+        self._counters: DefaultDict[str, float] = defaultdict(float)
+        self._events: List[Dict[str, Any]] = []
+        self._record_trace = record_trace
+        self._max_trace_events = max_trace_events
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def record(self, name: str, start: float, end: float):
+        with self._lock:
+            self._stages[name].add(end - start)
+
+            if self._record_trace and len(self._events) < self._max_trace_events:
+                # Chrome traces use microseconds for complete ('X') events
+                self._events.append(dict(name=name,
+                                         ph='X',
+                                         ts=(start - self._start) * 1e6,
+                                         dur=(end - start) * 1e6,
+                                         pid=os.getpid(),
+                                         tid=threading.get_ident()))
+
+    def increment(self, name: str, amount: float):
+        with self._lock:
+            self._counters[name] += amount
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Returns the per-stage breakdown. Stages are sorted by their total time.
+        """
+        wall_time = time.perf_counter() - self._start
+
+        with self._lock:
+            stages = sorted(self._stages.items(), key=lambda t: t[1].total, reverse=True)
+            return {
+                'wall_time': wall_time,
+                'stages': {name: stats.as_dict(wall_time) for name, stats in stages},
+                'counters': dict(self._counters),
+                'num_dropped_events': max(sum(stats.count for _, stats in stages) - len(self._events), 0) if self._record_trace else 0
+            }
+
+    def trace(self) -> Dict[str, Any]:
+        """
+        Returns the trace in the Chrome trace event format (viewable in chrome://tracing).
+        """
+        with self._lock:
+            return {'traceEvents': list(self._events), 'displayTimeUnit': 'ms'}
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable_profiling(record_trace: bool = True) -> Profiler:
+    global _profiler
+    _profiler = Profiler(record_trace=record_trace)
+    return _profiler
+
+
+def disable_profiling():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def increment(name: str, amount: float = 1):
+    """
+    Adds the given amount to the named counter (e.g. the number of samples or bytes read).
+    """
+    if _profiler is not None:
+        _profiler.increment(name, amount)
+
+
+class timed:
+    """
+    Times the named stage. Use either as a context manager or as a decorator. Decorated
+    generator functions record the time of each step, so the time spent by the consumer
+    between steps is excluded.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._profiler: Optional[Profiler] = None
+        self._start = 0.0
+
+    def __enter__(self) -> 'timed':
+        self._profiler = _profiler
+        if self._profiler is not None:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._profiler is not None:
+            self._profiler.record(self._name, self._start, time.perf_counter())
+            self._profiler = None
+
+    def __call__(self, func: Callable) -> Callable:
+        name = self._name
+
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                generator = func(*args, **kwargs)
+                if _profiler is None:
+                    yield from generator
+                    return
+
+                while True:
+                    profiler = _profiler
+                    start = time.perf_counter()
+
+                    try:
+                        value = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        if profiler is not None:
+                            profiler.record(name, start, time.perf_counter())
+
+                    yield value
+
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter())
+
+        return wrapper
+
+
+def save_profile(report_path: Optional[str], trace_path: Optional[str]):
+    """
+    Writes the per-stage report and the Chrome trace as JSON. Does nothing when profiling is disabled.
+    """
+    if _profiler is None:
+        return
+
+    if report_path is not None:
+        with open(report_path, 'w') as report_file:
+            json.dump(_profiler.report(), report_file, indent=2)
+
+    if trace_path is not None:
+        with open(trace_path, 'w') as trace_file:
+            json.dump(_profiler.trace(), trace_file)
+
+
+def add_profiling_args(parser: ArgumentParser):
+    """
+    Adds the arguments to enable profiling.
+    """
+    parser.add_argument('--profile-report', type=str, help='Path to a JSON file for the per-stage time breakdown. Enables profiling.')
+    parser.add_argument('--profile-trace', type=str, help='Path to a JSON file for the Chrome trace. Enables profiling.')
+
+
+def configure_profiling_from_args(args: Namespace):
+    """
+    Enables profiling when either output path is given. The outputs are written when the process exits.
+    """
+    if args.profile_report is None and args.profile_trace is None:
+        return
+
+    enable_profiling(record_trace=args.profile_trace is not None)
+    atexit.register(save_profile, report_path=args.profile_report, trace_path=args.profile_trace)
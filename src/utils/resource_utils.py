@@ -0,0 +1,148 @@
+import os
+from argparse import ArgumentParser, Namespace
+from enum import Enum, auto
+from typing import List, Optional, Any
+
+from utils.constants import INTRA_OP_THREADS_ENV, INTER_OP_THREADS_ENV
+
+# Threadpoolctl is optional and limits the thread pools of libraries (e.g. BLAS) which are already loaded
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+class PlacementPolicy(Enum):
+    COMPACT = auto()  # Each worker uses a contiguous block of cores
+    SPREAD = auto()  # Workers interleave across the cores (e.g. across sockets)
+    NONE = auto()  # No CPU affinity
+
+
+def get_available_cpus() -> List[int]:
+    """
+    Returns the cores on which this process may run.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return list(sorted(os.sched_getaffinity(0)))
+    return list(range(os.cpu_count() or 1))
+
+
+def get_threads_per_worker(num_workers: int, intra_op_threads: Optional[int] = None) -> int:
+    """
+    Returns the number of intra-op threads per worker. By default, the available cores are split evenly between the workers.
+    """
+    if intra_op_threads is not None:
+        return intra_op_threads
+
+    return max(int(len(get_available_cpus()) / max(num_workers, 1)), 1)
+
+
+def get_worker_cpus(worker_index: int, num_workers: int, threads_per_worker: int, policy: PlacementPolicy, cpus: Optional[List[int]] = None) -> List[int]:
+    """
+    Returns the cores assigned to the given worker.
+
+    Args:
+        worker_index: The index of the worker in [0, num_workers)
+        num_workers: The total number of workers
+        threads_per_worker: The number of cores per worker
+        policy: The placement policy. COMPACT assigns contiguous blocks and SPREAD interleaves the workers.
+        cpus: The cores to assign. Defaults to the cores available to this process.
+    Returns:
+        The list of cores for this worker. Cores are shared between workers when there are too few cores.
+    """
+    assert num_workers > 0, 'Must have a positive number of workers'
+    assert threads_per_worker > 0, 'Must have a positive number of threads per worker'
+
+    cpus = cpus if cpus is not None else get_available_cpus()
+    worker_index = worker_index % num_workers
+
+    if policy == PlacementPolicy.NONE:
+        return list(cpus)
+    elif policy == PlacementPolicy.COMPACT:
+        indices = [worker_index * threads_per_worker + i for i in range(threads_per_worker)]
+    elif policy == PlacementPolicy.SPREAD:
+        indices = [worker_index + i * num_workers for i in range(threads_per_worker)]
+    else:
+        raise ValueError('Unknown placement policy: {0}'.format(policy))
+
+    return list(sorted(set(cpus[index % len(cpus)] for index in indices)))
+
+
+def set_cpu_affinity(cpus: List[int]):
+    """
+    Pins this process to the given cores. This is a no-op on platforms without affinity support.
+    """
+    if hasattr(os, 'sched_setaffinity') and len(cpus) > 0:
+        os.sched_setaffinity(0, cpus)
+
+
+def set_thread_counts(intra_op_threads: int, inter_op_threads: int):
+    """
+    Sets the thread counts for all Tensorflow sessions created later in this process.
+    """
+    os.environ[INTRA_OP_THREADS_ENV] = str(intra_op_threads)
+    os.environ[INTER_OP_THREADS_ENV] = str(inter_op_threads)
+
+    # Prevent the numerical libraries from oversubscribing the cores. The environment variable only
+    # affects libraries loaded later, so the pools of already-imported libraries (e.g. the BLAS used
+    # by numpy) are limited directly.
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+
+    if threadpool_limits is not None:
+        threadpool_limits(limits=intra_op_threads)
+
+
+def configure_worker(worker_index: int, num_workers: int, intra_op_threads: Optional[int] = None, inter_op_threads: int = 1, policy: PlacementPolicy = PlacementPolicy.COMPACT):
+    """
+    Configures the thread counts and CPU affinity of one of num_workers processes sharing this host,
+    so that N workers use N * k cores without contention.
+    """
+    threads_per_worker = get_threads_per_worker(num_workers, intra_op_threads)
+    set_thread_counts(intra_op_threads=threads_per_worker, inter_op_threads=inter_op_threads)
+
+    cpus = get_worker_cpus(worker_index=worker_index,
+                           num_workers=num_workers,
+                           threads_per_worker=threads_per_worker,
+                           policy=policy)
+    set_cpu_affinity(cpus)
+
+
+def init_pool_worker(counter: Any, num_workers: int, intra_op_threads: Optional[int], inter_op_threads: int, policy_name: str):
+    """
+    Initializer for process pools. The shared counter hands out the worker indices.
+    """
+    with counter.get_lock():
+        worker_index = counter.value
+        counter.value += 1
+
+    configure_worker(worker_index=worker_index,
+                     num_workers=num_workers,
+                     intra_op_threads=intra_op_threads,
+                     inter_op_threads=inter_op_threads,
+                     policy=PlacementPolicy[policy_name.upper()])
+
+
+def add_resource_args(parser: ArgumentParser):
+    """
+    Adds the arguments to place this process among several processes on the same host.
+    """
+    parser.add_argument('--worker-index', type=int, default=0, help='Index of this process among the processes on this host.')
+    parser.add_argument('--num-workers', type=int, default=1, help='Number of processes sharing this host.')
+    parser.add_argument('--intra-op-threads', type=int, help='Threads per process. Defaults to an even split of the cores.')
+    parser.add_argument('--inter-op-threads', type=int, default=1)
+    parser.add_argument('--placement', type=str, choices=[p.name.lower() for p in PlacementPolicy], default='compact')
+
+
+def configure_from_args(args: Namespace):
+    """
+    Configures this process using the arguments from add_resource_args(). Single processes keep
+    the default configuration unless thread counts are given explicitly.
+    """
+    if args.num_workers <= 1 and args.intra_op_threads is None:
+        return
+
+    configure_worker(worker_index=args.worker_index,
+                     num_workers=args.num_workers,
+                     intra_op_threads=args.intra_op_threads,
+                     inter_op_threads=args.inter_op_threads,
+                     policy=PlacementPolicy[args.placement.upper()])
@@ -1,9 +1,64 @@
+import os
+import numpy as np
 import tensorflow as tf
+from tensorflow.core.protobuf import meta_graph_pb2, rewriter_config_pb2
+from tensorflow.python.framework import tensor_util
+from tensorflow.python.grappler import tf_optimizer
 from typing import Dict, Optional, List, Callable, Union, Tuple
 from collections import namedtuple
 from functools import partial
 
-from utils.constants import SMALL_NUMBER, BIG_NUMBER
+from utils.constants import SMALL_NUMBER, BIG_NUMBER, INTRA_OP_THREADS_ENV, INTER_OP_THREADS_ENV
+
+
+def get_session_config(intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None, use_xla: bool = False) -> tf.ConfigProto:
+    """
+    Creates the session configuration. Thread counts default to the values in the
+    TF_INTRA_OP_THREADS and TF_INTER_OP_THREADS environment variables. A count of zero
+    lets Tensorflow pick the number of threads. The use_xla flag enables XLA JIT compilation.
+    """
+    if intra_op_threads is None:
+        intra_op_threads = int(os.environ.get(INTRA_OP_THREADS_ENV, 0))
+
+    if inter_op_threads is None:
+        inter_op_threads = int(os.environ.get(INTER_OP_THREADS_ENV, 0))
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+
+    if use_xla:
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+
+    return config
+
+
+def optimize_graph_def(graph_def: tf.GraphDef, output_nodes: List[str]) -> tf.GraphDef:
+    """
+    Applies the Grappler optimizations (e.g. constant folding, arithmetic simplification and
+    dead-node pruning) to the given frozen graph.
+
+    Args:
+        graph_def: The frozen graph to optimize
+        output_nodes: Names of the nodes to preserve. All other nodes may be removed or rewritten.
+    Returns:
+        The optimized graph.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+        meta_graph = tf.train.export_meta_graph(graph_def=graph.as_graph_def(), graph=graph)
+
+    # Grappler preserves the nodes in the train_op collection
+    fetch_collection = meta_graph_pb2.CollectionDef()
+    fetch_collection.node_list.value.extend(output_nodes)
+    meta_graph.collection_def['train_op'].CopyFrom(fetch_collection)
+
+    config = tf.ConfigProto()
+    rewrite_options = config.graph_options.rewrite_options
+    rewrite_options.optimizers.extend(['pruning', 'constfold', 'arithmetic', 'dependency', 'loop', 'constfold'])
+    rewrite_options.meta_optimizer_iterations = rewriter_config_pb2.RewriterConfig.TWO
+
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
 
 
 def get_optimizer(name: str, learning_rate: float, learning_rate_decay: float, global_step: tf.Variable, decay_steps: int = 100000, momentum: Optional[float] = None):
@@ -70,14 +125,43 @@ def get_regularizer(name: Optional[str], scale: float) -> Optional[Callable[[tf.
         raise ValueError(f'Unknown regularization name: {name}')
 
 
+def get_constant_value(x: Union[float, tf.Tensor]) -> Optional[float]:
+    """
+    Returns the value of the given scalar if it is known when building the graph (e.g. Python
+    numbers and constant tensors). Returns None otherwise.
+    """
+    if isinstance(x, (int, float)):
+        return float(x)
+
+    value = tensor_util.constant_value(x)
+    if value is None or np.size(value) != 1:
+        return None
+
+    return float(value)
+
+
 def apply_noise(x: tf.Tensor, scale: Union[float, tf.Tensor]) -> tf.Tensor:
     """
-    Applies unbiased Gaussian noise with the given scale to the given tensor.
+    Applies unbiased Gaussian noise with the given scale to the given tensor. No
+    operations are created when the scale is known to be zero.
     """
+    if get_constant_value(scale) == 0.0:
+        return x
+
     noise = scale * tf.random.normal(shape=tf.shape(x), mean=0.0, stddev=1.0)
     return x + noise
 
 
+def apply_dropout(x: tf.Tensor, keep_rate: Union[float, tf.Tensor]) -> tf.Tensor:
+    """
+    Applies dropout with the given keep rate. No operations are created when the keep rate is known to be one.
+    """
+    if get_constant_value(keep_rate) == 1.0:
+        return x
+
+    return tf.nn.dropout(x, keep_prob=keep_rate)
+
+
 def mask_last_element(values: tf.Tensor) -> tf.Tensor:
     """
     Sets the final element of each sequence to zero.